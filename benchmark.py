@@ -0,0 +1,348 @@
+#!/usr/bin/env python
+"""
+Copyright (c) 2020
+This file is part of the rotaprint project.
+
+Performance benchmarks for rotaprint.
+Run from the repository root with `python benchmark.py`.
+
+Unauthorized copying of this file, via any medium is strictly prohibited
+Proprietary and confidential
+"""
+
+import os
+import re
+import math
+import time
+import logging
+import tempfile
+import collections
+import numpy as np
+import rotaprint
+import simulator
+
+# Module globals normally created by the rotaprint setup sequence
+rotaprint.log = logging.getLogger("rotaprint")
+
+# Sample program and how many times to repeat it
+sample = "sample_files/sample_colour.gcode"
+scale = 100
+
+# Number of timed runs, the best run is reported
+repeats = 5
+
+
+def best_of(function, repeats=repeats):
+    # Return the fastest run time of function, and its result
+    times = []
+    for i in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+
+    return min(times), result
+
+
+def load_sample(path, scale):
+    # Load program the same way as websocket.receive_gcode
+    with open(path) as f:
+        lines = [line.strip() for line in f.read().splitlines()
+                 if not line.startswith('#')]
+
+    return lines * scale
+
+
+def parameters():
+    # Correction parameters using default settings
+    settings = rotaprint.database.settings
+    return {
+        "radius": settings["radius"],
+        "z_height": settings["z_height"],
+        "z_offset": settings["z_offset"],
+        "z_lift": settings["z_lift"],
+        "colour_origin": settings["colour_origin"],
+        "colour_offset": settings["colour_offset"],
+    }
+
+
+class baseline:
+    """
+    The gcode.correct loop which the columnar toolpath replaced, unchanged
+    except that it reads the radius and settings from the instance rather
+    than the module globals. Rewrites the program in place, line by line.
+    """
+
+    def __init__(self, lines, parameters):
+        self.gcode = list(lines)
+        self.radius = parameters["radius"]
+        self.settings = parameters
+
+    def correct(self):
+        for idx, line in enumerate(self.gcode):
+            # Correct Y and Z commands
+            self.correct_dims(idx, line)
+
+            # Add correct colour change commands
+            self.correct_colours(idx, line)
+
+        return self.gcode
+
+    def correct_dims(self, idx, line):
+        # Alter Y value
+        m = re.search(r"Y([\d.]+)", line)
+
+        if m:
+            y = m.string[m.start(1):m.end(1)]
+            y = float(y)
+            y = y * 360 / (2 * math.pi * self.radius)
+            y = round(y, 2)
+
+            new_line = line[:m.start(1)] + str(y) + line[m.end(1):]
+            self.gcode[idx] = new_line
+
+        # Alter Z value
+        m = re.search(r"Z([\d.]+)", line)
+
+        if m:
+            z = m.string[m.start(1):m.end(1)]
+            z = float(z)
+
+            if z == 1:
+                z = self.settings["z_height"] - \
+                    self.radius + self.settings["z_offset"]
+            else:
+                z = self.settings["z_height"] - \
+                    self.radius - self.settings["z_lift"]
+
+            z = round(z, 2)
+
+            new_line = line[:m.start(1)] + str(z) + line[m.end(1):]
+            self.gcode[idx] = new_line
+
+    def correct_colours(self, idx, line):
+        m = re.search(r"<C(\d+?)>", line)
+
+        if m:
+            colour = m.string[m.start(1): m.end(1)]
+            colour = float(colour)
+
+            command = "G0B" + \
+                str(self.settings["colour_origin"] +
+                    colour * self.settings["colour_offset"])
+            self.gcode[idx] = command
+
+
+def equivalent(a, b):
+    # Compare two corrected programs by value, ignoring number formatting
+    a = rotaprint.toolpath.parse(a)
+    b = rotaprint.toolpath.parse(b)
+
+    columns = ["x", "y", "z", "b", "i", "j", "f"]
+    same = all(np.allclose(getattr(a, c), getattr(b, c), equal_nan=True)
+               for c in columns)
+
+    return same and np.array_equal(a.opcode, b.opcode) and a.raw == b.raw
+
+
+def bench_correct():
+    lines = load_sample(sample, scale)
+    p = parameters()
+
+    print(f"gcode.correct(): {sample} x{scale} ({len(lines)} lines)")
+
+    # Original loop, three regex searches and a rebuilt string per line. Lines with both
+    # Y and Z lose their Y correction, so its output is not compared
+    t_line, _ = best_of(lambda: baseline(lines, p).correct())
+
+    # Per-line path kept for lines which cannot be parsed into columns, which
+    # corrects lines with both Y and Z
+    per_line = [rotaprint.toolpath.correct_line(line, **p) for line in lines]
+
+    # Columnar path, parsing happens once on upload so is timed separately
+    t_parse, program = best_of(lambda: rotaprint.toolpath.parse(lines))
+    t_columns, columnar = best_of(lambda: program.correct(**p).serialise())
+
+    print(f"  original correct:   {t_line * 1000:8.1f} ms")
+    print(f"  columnar parse:     {t_parse * 1000:8.1f} ms  (once per upload)")
+    print(f"  columnar correct:   {t_columns * 1000:8.1f} ms")
+    print(f"  speedup, correct:   {t_line / t_columns:8.1f} x  (each correction after upload)")
+    print(f"  speedup, end to end:{t_line / (t_parse + t_columns):8.1f} x  (parse and one correction)")
+    print(f"  equivalent output:  {equivalent(per_line, columnar)}  (to toolpath.correct_line)")
+
+
+def bench_simplify():
+    tolerance = rotaprint.database.settings["simplify_tolerance"]
+    print(f"toolpath.simplify(): tolerance {tolerance} mm")
+
+    for path in ["sample_files/sample_colour.gcode", "sample_files/short.gcode"]:
+        program = rotaprint.toolpath.parse(load_sample(path, 1))
+
+        t_simplify, (simplified, removed) = best_of(
+            lambda: program.simplify(tolerance))
+
+        print(f"  {path}: {len(program)} -> {len(simplified)} lines "
+              f"({100 * len(removed) / len(program):.0f}% removed) "
+              f"in {t_simplify * 1000:.1f} ms")
+
+
+def bench_fit_arcs():
+    settings = rotaprint.database.settings
+    rapid_rate = math.hypot(settings["$110"], settings["$111"])
+    print(f"toolpath.fit_arcs(): arc tolerance {settings['$12']} mm")
+
+    for path in ["sample_files/sample_colour.gcode", "sample_files/short.gcode"]:
+        program = rotaprint.toolpath.parse(load_sample(path, 1))
+        tolerance = settings["$12"] + rotaprint.toolpath.resolution(program.x, program.y) / 2
+
+        for radius in [settings["radius"], 360 / (2 * math.pi)]:
+            p = parameters()
+            p["radius"] = radius
+            corrected = program.correct(**p)
+            scale = 360 / (2 * math.pi * radius)
+
+            t_fit, fitted = best_of(
+                lambda: corrected.fit_arcs(tolerance, scale, rapid_rate))
+
+            print(f"  {path} (radius {radius:.1f} mm): {len(corrected)} -> "
+                  f"{len(fitted)} lines in {t_fit * 1000:.1f} ms")
+
+
+def options():
+    # Optimisation options using default settings, without whole program passes
+    settings = rotaprint.database.settings
+    return {
+        "simplify": True,
+        "simplify_tolerance": settings["simplify_tolerance"],
+        "reorder": False,
+        "rotary_mode": False,
+        "arc_fitting": True,
+        "arc_tolerance": settings["$12"] + 0.005,
+        "rapid_rate": math.hypot(settings["$110"], settings["$111"]),
+    }
+
+
+def bench_stream():
+    lines = load_sample(sample, scale)
+    p = parameters()
+    o = options()
+    scale_y = 360 / (2 * math.pi * p["radius"])
+
+    print(f"time to first block: {sample} x{scale} ({len(lines)} lines)")
+
+    program = rotaprint.toolpath.parse(lines)
+
+    def compiled():
+        # Whole program corrected before the first block is sent
+        corrected = program.simplify(o["simplify_tolerance"])[0].correct(**p)
+        corrected = corrected.fit_arcs(o["arc_tolerance"], scale_y, o["rapid_rate"])
+        return [rotaprint.job.encode(line) for line in corrected.serialise()]
+
+    t_whole, whole = best_of(compiled, 1)
+    t_first, first = best_of(lambda: next(iter(rotaprint.stream(program, p, o))))
+    t_stream, streamed = best_of(lambda: list(rotaprint.stream(program, p, o)), 1)
+
+    print(f"  whole program:      {t_whole * 1000:8.1f} ms")
+    print(f"  streamed, first:    {t_first * 1000:8.1f} ms")
+    print(f"  streamed, all:      {t_stream * 1000:8.1f} ms")
+    print(f"  identical output:   {whole == streamed}")
+
+
+class timed_streamer(rotaprint.streamer):
+    # Streamer which records the time from writing each block to its acknowledgement
+
+    def __init__(self, *args):
+        self.written = collections.deque()
+        self.latencies = []
+        super().__init__(*args)
+
+    def send(self, block):
+        super().send(block)
+        self.written.append(time.perf_counter())
+
+    def receive(self):
+        out = super().receive()
+        if (out.find('ok') >= 0 or out.find('error') >= 0) and self.written:
+            self.latencies.append(time.perf_counter() - self.written.popleft())
+
+        return out
+
+
+def connect_simulator(sim):
+    # Connect rotaprint to a simulated printer, with a database in a temporary directory
+    rotaprint.r = rotaprint.rotaprint()
+    rotaprint.db = rotaprint.database()
+
+    cwd = os.getcwd()
+    os.chdir(tempfile.mkdtemp())
+    try:
+        rotaprint.db.connect()
+    finally:
+        os.chdir(cwd)
+
+    rotaprint.db.set_settings([(sim.port, "port")])
+
+    g = rotaprint.grbl(rotaprint.r)
+    rotaprint.r.g = g
+    g.connect()
+
+    return g
+
+
+def bench_streaming():
+    # Motion runs faster than real time so the whole sample can be streamed quickly
+    time_scale = 50
+    settings = rotaprint.database.settings
+
+    sim = simulator.simulator(time_scale=time_scale)
+    sim.start()
+    g = connect_simulator(sim)
+
+    print(f"streaming: simulated grbl, {sim.baud_rate} baud, {sim.rx_buffer_size} byte RX buffer, "
+          f"{sim.planner_size} block planner, motion {time_scale}x real time")
+
+    for path in ["sample_files/sample_colour.gcode", "sample_files/short.gcode"]:
+        program = rotaprint.toolpath.parse(load_sample(path, 1)).correct(**parameters())
+        blocks = [rotaprint.job.encode(line) for line in program.serialise()]
+
+        # Check mode streams as fast as grbl can parse, without moving
+        for check in [True, False]:
+            if check:
+                g.send(["$C"], True)
+                g.flush()
+
+            sim.reset_stats()
+            sender = timed_streamer(g, settings["rx_buffer_size"])
+
+            start = time.perf_counter()
+            for block in blocks:
+                sender.send(block)
+            sender.finish()
+            elapsed = time.perf_counter() - start
+
+            if check:
+                g.send(["$C"], True)
+                time.sleep(0.1)
+                g.flush()
+
+            latency = np.percentile(sender.latencies, [50, 90, 99]) * 1000
+            stats = sim.stats
+
+            print(f"  {path}, {'check mode' if check else 'printing'}: {len(blocks)} lines")
+            print(f"    throughput:       {len(blocks) / elapsed:8.0f} lines/s "
+                  f"{sum(len(b) for b in blocks) / elapsed:8.0f} bytes/s")
+            print(f"    ack latency:      {latency[0]:8.1f} ms p50 {latency[1]:6.1f} ms p90 "
+                  f"{latency[2]:6.1f} ms p99")
+            if not check:
+                print(f"    planner starved:  {stats['starved'] * time_scale:8.1f} s of "
+                      f"{stats['motion_time'] * time_scale:.1f} s motion (real time)")
+            print(f"    errors {sender.errors}, RX overflow {stats['overflow']} bytes")
+
+    sim.stop()
+
+
+if __name__ == "__main__":
+    bench_correct()
+    bench_simplify()
+    bench_fit_arcs()
+    bench_stream()
+    bench_streaming()
@@ -23,20 +23,31 @@ import concurrent.futures
 import logging
 import sqlite3
 import os
-import io
 import sys
 import traceback
 import math
+import hashlib
+import base64
+import tempfile
+import shutil
+import mmap
+import select
+import collections
+import itertools
+import queue
 import numpy as np
 from skimage.metrics import structural_similarity
 import cv2
 from json import dumps, loads
 
+try:
+    import msgpack
+except ImportError:
+    # Without msgpack the GUI falls back to JSON websocket messages
+    msgpack = None
 
-class rotaprint:
-    # Setup threading pool
-    pool = concurrent.futures.ThreadPoolExecutor(max_workers=10)
 
+class rotaprint:
     # Initialise variables
     # Enables check mode to test gcode first
     check_mode = ""
@@ -59,16 +70,33 @@ class rotaprint:
     # Current offset / float
     offset = ""
 
-    # Fraction of total print remaining (where 0 is complete, 1 is not started)
-    remaining = 1
-
     # Quality control override
     qc_override = False
 
+    # Printing, or starting a print
+    active = False
+
+    # Corrected program for the current print
+    program = ()
+
+    # Predicted time / s at which each line of the program completes
+    times = np.zeros(0)
+
+    # Lines of the current part acknowledged by grbl
+    acknowledged = 0
+
+    # Seconds between checkpoints while printing
+    checkpoint_interval = 1
+
+    # Lines to go back from the last checkpoint when resuming, since acknowledged
+    # lines may still have been waiting in grbl's planner
+    resume_overlap = 16
+
     status = {
         "time_elapsed": 0,
         "parts_complete": 0,
         "time_remaining": 0,
+        "batch_eta": "",
         "operation": "Idle",
 
         "grbl_operation": "Idle",
@@ -76,26 +104,90 @@ class rotaprint:
         "grbl_y": "",
         "grbl_z": "",
         "grbl_lockout": 1,
+        "grbl_feed_override": "100%",
+        "grbl_rapid_override": "100%",
 
         "print_progress": 0
     }
 
+    # Startup state of each subsystem: "waiting", "starting", "ready" or "failed"
+    subsystems = {}
+
+    # Print settings copied when a print is sent to another printer
+    print_settings = ("check_mode", "scan_mode", "radius", "length", "batch", "offset")
+
+    def __init__(self, index=0):
+        # Position in the fleet, each printer has its own status
+        self.index = index
+        self.name = f"Printer {index + 1}"
+        self.status = dict(self.status)
+
+        # grbl connection and camera, attached by the fleet
+        self.g = None
+        self.v = None
+
+        # Long websocket commands for this printer, run one at a time in order
+        self.commands = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+        # Threads for this printer's print: its timer, its sender, and the sender of
+        # the next part which is started as the last one finishes
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=4)
+
+        # Stops the timer of the current print
+        self.timer_stop = threading.Event()
+
+    def boot(self, steps):
+        # Start subsystems in parallel, each once the subsystems it depends on are ready.
+        # Steps are {name: (function, [dependencies])}, a function returning False has failed.
+        start = time.perf_counter()
+        done = {name: threading.Event() for name in steps}
+
+        for name in steps:
+            self.subsystems[name] = "waiting"
+
+        def run(name, function, dependencies):
+            for dependency in dependencies:
+                done[dependency].wait()
+
+                if self.subsystems[dependency] != "ready":
+                    log.error(f"Not starting {name}, {dependency} failed to start")
+                    self.subsystems[name] = "failed"
+                    done[name].set()
+                    return
+
+            self.subsystems[name] = "starting"
+            step_start = time.perf_counter()
+
+            try:
+                ready = function() is not False
+            except:
+                r.except_logger()
+                ready = False
+
+            self.subsystems[name] = "ready" if ready else "failed"
+            log.info(f"Startup: {name} {self.subsystems[name]} after "
+                     f"{time.perf_counter() - step_start:.2f} s")
+            done[name].set()
+
+        threads = [threading.Thread(target=run, args=(name, *steps[name])) for name in steps]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        log.info(f"Startup complete in {time.perf_counter() - start:.2f} s")
+
     def setup_log(self):
         # Create normal logger
         log = logging.getLogger("rotaprint")
         log.setLevel(logging.DEBUG)
 
-        # Number of characters already sent
-        self.log_history = 0
-
         # Create variable logger for GUI
-        log_capture_string = io.StringIO()
-        ch = logging.StreamHandler(log_capture_string)
-        ch.setLevel(logging.DEBUG)
+        log_store = logstore()
         formatter = logging.Formatter(
             '<*>%(asctime)s<~>%(levelname)s<~>%(message)s', '%H:%M:%S')
-        ch.setFormatter(formatter)
-        log.addHandler(ch)
+        log_store.setFormatter(formatter)
+        log.addHandler(log_store)
 
         # Decrease output of external modules
         logging.getLogger("websockets").setLevel(logging.WARNING)
@@ -106,7 +198,7 @@ class rotaprint:
 
         log.info("Successfully setup logging")
 
-        return log, log_capture_string
+        return log, log_store
 
     def except_logger(self):
         exc_type, exc_value, tb = sys.exc_info()
@@ -117,54 +209,88 @@ class rotaprint:
             # Replace newline to prevent issues when displaying at frontend
             log.error(line)
 
-    def timer(self):
+    def format_time(self, seconds):
+        # Format a duration as minutes and seconds
+        return str(int(seconds // 60)) + "m " + str(int(seconds % 60)) + "s"
+
+    def time_remaining(self, elapsed=0):
+        # Predicted time / s until the batch completes, from the simulated program. Streamed
+        # programs are not simulated, so the time elapsed is extrapolated from progress
+        if not len(self.times):
+            lines = len(self.program)
+            if not lines or not self.batch:
+                return 0
+
+            part = min(self.acknowledged / lines, 1)
+            done = (int(self.batch_current or 0) + part) / self.batch
+
+            return elapsed * (1 - done) / done if done else 0
+
+        part_time = self.times[-1]
+        done = self.times[self.acknowledged - 1] if self.acknowledged else 0
+        parts = max(self.batch - 1 - self.batch_current, 0)
+
+        return part_time - done + parts * part_time
+
+    def start_timer(self):
+        # Stop the timer of any previous print, then time this one
+        self.timer_stop.set()
+        self.timer_stop = threading.Event()
+        self.pool.submit(self.timer, self.timer_stop)
+
+    def timer(self, stop):
         # Initialise start time
         start_time = time.time()
 
-        while self.active:
+        while self.active and not stop.is_set():
             # Do not update if on hold status
             if re.match("Hold", self.status["grbl_operation"]):
                 start_time += 1
 
             # Update time elapsed
             time_elapsed = time.time() - start_time
-            time_format = str(round(time_elapsed / 60)) + \
-                "m " + str(round(time_elapsed % 60)) + "s"
-            self.status["time_elapsed"] = time_format
+            self.status["time_elapsed"] = self.format_time(time_elapsed)
 
             # Estimate time remaining
-            try:
-                time_remaining = self.remaining * \
-                    (time_elapsed / (1 - self.remaining))
-            except ZeroDivisionError:
-                time_remaining = 0
+            time_remaining = self.time_remaining(time_elapsed)
 
-            time_format = "~" + str(round(time_remaining / 60)) + \
-                "m " + str(round(time_remaining % 60)) + "s"
-            self.status["time_remaining"] = time_format
+            self.status["time_remaining"] = "~" + self.format_time(time_remaining)
+            self.status["batch_eta"] = time.strftime(
+                "%H:%M", time.localtime(time.time() + time_remaining))
 
-            time.sleep(1)
+            stop.wait(1)
 
     def print_sequence(self):
         log.info("Starting print sequence!")
-        # Allow existing timers to end
-        self.active = False
-
-        time.sleep(2)
 
         # Indicate machine is active
         self.active = True
 
-        # Submit timer task
-        r.pool.submit(self.timer)
+        # Replace any existing timer
+        self.start_timer()
 
         # Modify gcode as required for colour change and dimensions
-        log.info("Correcting GCODE dimensions")
-        gc.correct()
+        if db.settings["streaming"]:
+            # Corrected while sending, so the whole program is never simulated
+            log.info("Streaming GCODE, correcting dimensions as it is sent")
+            self.program = gc.stream(self.radius)
+            self.times = np.zeros(0)
+        else:
+            log.info("Correcting GCODE dimensions")
+            self.program = gc.correct(self.radius)
+
+            # Predict print time from the firmware motion settings
+            self.times = gc.estimate(self.radius)
+
+        self.acknowledged = 0
+
+        if len(self.times):
+            log.info(f"Predicted print time: {self.format_time(self.times[-1])} per part, "
+                     f"{self.format_time(self.times[-1] * self.batch)} for {self.batch} part(s)")
 
         # Change check mode on grbl if required
-        if self.check_mode != g.check:
-            g.check_mode()
+        if self.check_mode != self.g.check:
+            self.g.check_mode()
 
         # Start batch at part 0
         self.batch_current = 0
@@ -177,23 +303,101 @@ class rotaprint:
             # Send gcode once
             self.batch_new_part()
         else:
-            if r.scan_mode:
+            if self.scan_mode:
                 # Move first part under camera for initial alignment
-                g.change_batch(self.batch_current, True)
+                self.g.change_batch(self.batch_current, True)
 
                 log.info(
                     "Scan mode is enabled, performing initial alignment scan.")
 
                 # Setup WCS for correct scan start position
-                g.offset_y(self.offset)
+                self.g.offset_y(self.offset)
 
                 # Scan for reference images
-                v.initial_alignment_scan()
+                self.v.initial_alignment_scan()
 
             self.batch_new_part()
 
         time.sleep(5)
 
+    def checkpoint(self, line):
+        # Record progress through the current print, so it can be resumed after an alarm or disconnect
+        program = self.program
+        db.set_checkpoint(self.index, {
+            "job": program.path if isinstance(program, job) else "",
+            "digest": gc.digest,
+            "streaming": int(isinstance(program, stream)),
+            "line": line,
+            "part": self.batch_current,
+            "batch": self.batch,
+            "radius": self.radius,
+            "length": self.length,
+            "offset": self.offset,
+            "check_mode": int(bool(self.check_mode)),
+            "scan_mode": int(bool(self.scan_mode)),
+        })
+
+    def resume(self):
+        # Continue an interrupted print from its last checkpoint
+        try:
+            self.resume_checkpoint()
+        except:
+            r.except_logger()
+
+    def resume_checkpoint(self):
+        checkpoint = db.get_checkpoint(self.index)
+        if not checkpoint:
+            log.error("No interrupted print to resume")
+            return
+
+        self.radius = checkpoint["radius"]
+        self.length = checkpoint["length"]
+        self.batch = int(checkpoint["batch"])
+        self.offset = checkpoint["offset"]
+        self.check_mode = bool(checkpoint["check_mode"])
+        self.scan_mode = bool(checkpoint["scan_mode"])
+        self.batch_current = int(checkpoint["part"])
+
+        # Compiled jobs are kept on disk, otherwise the same GCODE must be loaded
+        self.times = np.zeros(0)
+        if checkpoint["job"] and os.path.isfile(checkpoint["job"]):
+            self.program = job(checkpoint["job"])
+        elif checkpoint["digest"] == gc.digest and gc.toolpath is not None:
+            self.program = gc.stream(self.radius) if checkpoint["streaming"] else gc.correct(self.radius)
+        else:
+            log.error("Interrupted GCODE is no longer available, upload it again to resume")
+            return
+
+        if not checkpoint["streaming"] and checkpoint["digest"] == gc.digest:
+            self.times = gc.estimate(self.radius)
+
+        line = max(int(checkpoint["line"]) - self.resume_overlap, 0)
+
+        log.info(f"Resuming part {self.batch_current + 1} of {self.batch} from line {line}")
+
+        # The interrupted stream stops at its next response, or when its read times out
+        deadline = time.time() + 10
+        while self.g.is_run and time.time() < deadline:
+            time.sleep(0.1)
+
+        if self.g.is_run:
+            log.error("Previous print is still running, stop it before resuming")
+            return
+
+        # Position is lost after an alarm
+        if self.g.alarm or self.status["grbl_lockout"]:
+            self.g.home()
+
+        self.active = True
+        self.start_timer()
+
+        self.g.change_batch(self.batch_current)
+        if self.scan_mode:
+            self.g.offset_y(self.offset)
+
+        self.acknowledged = line
+        self.g.send(self.program, batch=True, start=line)
+
     def batch_new_part(self):
         # If there are more parts to do
         if self.batch_current < self.batch:
@@ -204,7 +408,7 @@ class rotaprint:
                 self.batch_current) + " of " + str(self.batch)
 
             # If not first part
-            if self.batch_current > 0 and r.scan_mode:
+            if self.batch_current > 0 and self.scan_mode:
                 log.info("Scan mode is enabled, starting scan sequence")
                 # If QC is required
                 if not self.qc_override:
@@ -212,20 +416,20 @@ class rotaprint:
                         "Scanning part for quality assurance...")
 
                     # Go back to scanner
-                    g.change_batch(self.batch_current - 1, True)
+                    self.g.change_batch(self.batch_current - 1, True)
 
                     # Only one part has completed, no reference for comparison
                     if self.batch_current == 1:
-                        v.initial_quality_scan()
+                        self.v.initial_quality_scan()
                     else:
                         # Scan part for quality checking
-                        score = v.quality_scan()
+                        score = self.v.quality_scan()
 
                         log.debug(f"Quality score :{score}")
 
                         # If score received is lower than needed
                         if score < db.settings["quality_score"]:
-                            r.status["grbl_operation"] == "Failed QC"
+                            self.status["grbl_operation"] == "Failed QC"
                             log.error("Quality check failed!")
 
                             return
@@ -238,23 +442,26 @@ class rotaprint:
                     self.qc_override = False
 
                 # Go to scanner
-                g.change_batch(self.batch_current, True)
+                self.g.change_batch(self.batch_current, True)
 
                 log.info("Scanning part for alignment...")
 
                 # Scan part for alignment
-                self.offset = v.alignment_scan()
+                self.offset = self.v.alignment_scan()
 
                 log.debug(f"Alignment offset: {self.offset}")
 
                 # Setup WCS for correct print start position
-                g.offset_y(self.offset)
+                self.g.offset_y(self.offset)
 
             # Go to printer
-            g.change_batch(self.batch_current)
+            self.g.change_batch(self.batch_current)
+
+            self.acknowledged = 0
+            self.checkpoint(0)
 
             # Send gcode
-            g.send(gc.gcode, batch=True)
+            self.g.send(self.program, batch=True)
 
         elif self.batch_current == self.batch:
             log.info("All parts complete!")
@@ -266,10 +473,15 @@ class rotaprint:
 
             self.status["time_remaining"] = "0m 0s"
 
+            # Nothing left to resume
+            db.clear_checkpoint(self.index)
+
+            # Y re-homing is only kept between parts
+            self.g.send(["G92.1"], True)
+
             # Check for final status update
             try:
-                g.s.write('?\n'.encode())
-                g.read()
+                self.g.query_status()
             except:
                 r.except_logger()
 
@@ -278,76 +490,1745 @@ class rotaprint:
             self.status["grbl_operation"] = "Done"
 
 
-class gcode:
-    gcode = ""
+class logstore(logging.Handler):
+    """
+    Recent log records for the GUI, kept in a fixed size ring so memory use
+    does not grow over a long batch. Records are numbered, so each client
+    reads on from its own cursor, and subscribers are called for every new
+    record.
+    """
+
+    def __init__(self, size=500):
+        super().__init__(logging.DEBUG)
+
+        # (number, level, formatted record), oldest first
+        self.records = collections.deque(maxlen=size)
+
+        # Number of the last record
+        self.count = 0
+
+        # Callbacks for every new record
+        self.subscribers = []
+
+    def connect(self):
+        # Keep as many records as the log history setting
+        size = int(db.get_settings()[0]["log_history"])
+
+        with self.lock:
+            self.records = collections.deque(self.records, maxlen=size)
+
+    def emit(self, record):
+        # Called by logging, holding self.lock
+        try:
+            message = self.format(record)
+        except:
+            self.handleError(record)
+            return
+
+        self.count += 1
+        self.records.append((self.count, record.levelno, message))
+
+        for subscriber in list(self.subscribers):
+            try:
+                subscriber("log", message)
+            except:
+                self.handleError(record)
+
+    @staticmethod
+    def parse_level(name):
+        # Level number for a level name or number sent by the GUI. Names logging does
+        # not know fall back to DEBUG, so no records are hidden
+        try:
+            return int(name)
+        except (TypeError, ValueError):
+            pass
+
+        level = logging.getLevelName(str(name).upper())
+        if isinstance(level, int):
+            return level
+
+        log.warning(f"Unknown log level {name}, sending every record")
+        return logging.DEBUG
+
+    def since(self, cursor, level=logging.DEBUG):
+        # Records after cursor of at least level, joined as text, and the new cursor
+        with self.lock:
+            text = "".join(message for number, levelno, message in self.records
+                           if number > cursor and levelno >= level)
+
+            return text, self.count
+
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self.subscribers:
+            self.subscribers.remove(callback)
+
+
+class fleet:
+    """
+    Printers driven by this process.
+
+    Each printer is a rotaprint instance with its own print state, grbl
+    connection and camera. One printer is created per serial port in the port
+    setting, separated by commas, with video devices listed in the same order.
+    Prints are sent to the selected printer, or the first idle one if it is busy.
+    """
+
+    def __init__(self, first):
+        # The first printer is created before the settings are read
+        self.printers = [first]
+
+    def __len__(self):
+        return len(self.printers)
+
+    def __iter__(self):
+        return iter(self.printers)
+
+    @staticmethod
+    def setting(name, index):
+        # Value of a comma separated setting for one printer, None if it has none
+        values = [value.strip() for value in str(db.settings[name]).split(",")]
+
+        return values[index] if index < len(values) and values[index] else None
+
+    def add(self):
+        printer = rotaprint(len(self.printers))
+        printer.g = grbl(printer)
+        printer.v = vision(printer)
+        self.printers.append(printer)
+
+        return printer
+
+    def connect(self):
+        # Create a printer for each configured port, then connect them all in parallel
+        db.get_settings()
+        ports = [port for port in str(db.settings["port"]).split(",") if port.strip()]
+
+        while len(self.printers) < len(ports):
+            self.add()
+
+        for printer in self.printers:
+            printer.g.port = self.setting("port", printer.index)
+
+        if len(self.printers) > 1:
+            log.info(f"Fleet of {len(self.printers)} printers: "
+                     f"{', '.join(p.g.port for p in self.printers)}")
+
+        steps = {}
+        for printer in self.printers:
+            # The first printer keeps the names used without a fleet
+            suffix = f" {printer.index + 1}" if printer.index else ""
+
+            steps["grbl" + suffix] = (printer.g.connect, [])
+            steps["vision" + suffix] = (printer.v.connect, [])
+            steps["monitor" + suffix] = (printer.g.monitor, [])
+
+        r.boot(steps)
+
+        return any(printer.g.connected for printer in self.printers)
+
+    def get(self, index):
+        # Printer selected in the GUI, the first printer if there is no such printer
+        index = int(index)
+        return self.printers[index] if 0 <= index < len(self.printers) else self.printers[0]
+
+    def busy(self, printer):
+        return printer.active or getattr(printer.g, "is_run", False)
+
+    def idle(self):
+        # First connected printer which is not printing, None if all are busy
+        for printer in self.printers:
+            if printer.g.connected and not self.busy(printer):
+                return printer
+
+        return None
+
+    def route(self, printer):
+        # Printer to send a print to, the selected printer unless it is busy
+        if not self.busy(printer):
+            return printer
+
+        other = self.idle()
+        if other is None:
+            return None
+
+        log.info(f"{printer.name} is busy, sending print to {other.name}")
+        for name in rotaprint.print_settings:
+            setattr(other, name, getattr(printer, name))
+
+        return other
+
+    def summary(self):
+        # Name, port and state of every printer, for the GUI printer selector
+        return [{
+            "name": printer.name,
+            "port": printer.g.port,
+            "connected": printer.g.connected,
+            "operation": printer.status["grbl_operation"],
+            "busy": self.busy(printer),
+        } for printer in self.printers]
+
+
+class toolpath:
+    """
+    Columnar (structure-of-arrays) representation of a GCODE program.
+
+    Motion blocks are stored as an opcode column plus X/Y/Z/B/F value columns
+    (NaN where the word is absent), and colour change markers as a colour
+    column, with I/J centre offsets for arcs made by fit_arcs. Any line which
+    does not fit this form is kept verbatim in `raw`, keyed by line index,
+    and corrected with the per-line path instead.
+    """
+
+    # Motion block as produced by the CAM tool, e.g. "G0 X0.03 Y21.16"
+    move_pattern = re.compile(
+        r"^(G\d+)\s*(?:X(\d+\.?\d*|\.\d+))?\s*(?:Y(\d+\.?\d*|\.\d+))?"
+        r"\s*(?:Z(\d+\.?\d*|\.\d+))?\s*(?:B(\d+\.?\d*|\.\d+))?"
+        r"\s*(?:F(\d+\.?\d*|\.\d+))?$")
+
+    # Column names and types, in storage order
+    dtypes = {
+        "opcode": np.uint8,
+        "x": np.float64,
+        "y": np.float64,
+        "z": np.float64,
+        "b": np.float64,
+        "f": np.float64,
+        "i": np.float64,
+        "j": np.float64,
+        "colour": np.int32,
+    }
+
+    # Generic colour change command, e.g. "<C1>"
+    colour_pattern = re.compile(r"^<C(\d+)>$")
+
+    # Patterns used by the per-line correction path
+    y_pattern = re.compile(r"Y([\d.]+)")
+    z_pattern = re.compile(r"Z([\d.]+)")
+    colour_search = re.compile(r"<C(\d+?)>")
+
+    def __init__(self, opcode, opcodes, x, y, z, b, f, i, j, colour, raw):
+        # Index into opcodes for each line, 0 for non-motion lines
+        self.opcode = opcode
+        self.opcodes = opcodes
+
+        # Axis and feed values / float, NaN if not present
+        self.x = x
+        self.y = y
+        self.z = z
+        self.b = b
+        self.f = f
+
+        # Arc centre offsets from the start point, NaN if not an arc
+        self.i = i
+        self.j = j
+
+        # Generic colour number / int, -1 if not a colour change
+        self.colour = colour
+
+        # Unparsed lines / {index: line}
+        self.raw = raw
+
+        # Columns may be shared between toolpaths, so must not be modified
+        for column in (opcode, x, y, z, b, f, i, j, colour):
+            column.flags.writeable = False
+
+    def __len__(self):
+        return len(self.opcode)
+
+    @classmethod
+    def parse_columns(cls, lines, opcodes, start=0):
+        # Parse GCODE lines into a dictionary of column arrays, adding any new
+        # opcodes to opcodes. Unparsed lines are numbered from start.
+        lookup = {op: idx for idx, op in enumerate(opcodes)}
+
+        opcode, colour = [], []
+        x, y, z, b, f = [], [], [], [], []
+        raw = {}
+
+        nan = math.nan
+        move = cls.move_pattern.match
+        marker = cls.colour_pattern.match
+
+        for idx, line in enumerate(lines, start):
+            m = move(line)
+
+            # Opcodes must fit in the opcode column
+            if m and (m.group(1) in lookup or len(opcodes) < 256):
+                op, mx, my, mz, mb, mf = m.groups()
+
+                if op not in lookup:
+                    lookup[op] = len(opcodes)
+                    opcodes.append(op)
+
+                opcode.append(lookup[op])
+                colour.append(-1)
+                x.append(float(mx) if mx else nan)
+                y.append(float(my) if my else nan)
+                z.append(float(mz) if mz else nan)
+                b.append(float(mb) if mb else nan)
+                f.append(float(mf) if mf else nan)
+                continue
+
+            m = marker(line)
+            if m:
+                colour.append(int(m.group(1)))
+            else:
+                colour.append(-1)
+                raw[idx] = line
+
+            opcode.append(0)
+            x.append(nan)
+            y.append(nan)
+            z.append(nan)
+            b.append(nan)
+            f.append(nan)
+
+        # Arcs in the uploaded program are not parsed, so have no centre columns
+        none = [nan] * len(opcode)
+        values = (opcode, x, y, z, b, f, none, none, colour)
+        columns = {name: np.array(column, dtype)
+                   for (name, dtype), column in zip(cls.dtypes.items(), values)}
+
+        return columns, raw
+
+    @classmethod
+    def parse(cls, lines):
+        # Parse a list of GCODE lines into a toolpath
+        opcodes = [""]
+        columns, raw = cls.parse_columns(lines, opcodes)
+
+        return cls(opcodes=opcodes, raw=raw, **columns)
+
+    def code(self, op):
+        # Index of an opcode in the opcode column, -1 if not used
+        try:
+            return self.opcodes.index(op)
+        except ValueError:
+            return -1
+
+    def take(self, index):
+        # Return a new toolpath made of the lines at index, in that order
+        index = np.asarray(index, np.intp)
+
+        raw = {}
+        if self.raw:
+            positions = np.flatnonzero(np.isin(index, list(self.raw)))
+            raw = {new: self.raw[old]
+                   for new, old in zip(positions.tolist(), index[positions].tolist())}
+
+        columns = {name: getattr(self, name)[index] for name in self.dtypes}
+
+        return toolpath(opcodes=list(self.opcodes), raw=raw, **columns)
+
+    def blocks(self, size, first=None):
+        # Generate consecutive sections of the toolpath as views of its columns,
+        # starting with first lines and doubling up to size. Sections end before
+        # a line which is not an XY move where possible, so runs are not split.
+        keys = np.array(sorted(self.raw), np.intp)
+        step = first or size
+        start = 0
+
+        while start < len(self):
+            stop = min(start + step, len(self))
+
+            # Look ahead up to a full section for the end of a run of moves
+            ahead = slice(stop, min(stop + size, len(self)))
+            move = (np.isin(self.opcode[ahead], [self.code("G0"), self.code("G1")]) &
+                    np.isnan(self.z[ahead]) & np.isnan(self.b[ahead]) &
+                    np.isnan(self.f[ahead]) &
+                    ~(np.isnan(self.x[ahead]) & np.isnan(self.y[ahead])))
+            if len(move) and not move.all():
+                stop += int(np.argmin(move))
+
+            low, high = np.searchsorted(keys, [start, stop])
+            raw = {idx - start: self.raw[idx] for idx in keys[low:high].tolist()}
+            columns = {name: getattr(self, name)[start:stop] for name in self.dtypes}
+
+            yield toolpath(opcodes=self.opcodes, raw=raw, **columns)
+
+            start = stop
+            step = min(step * 2, size)
+
+    def append(self, opcodes, columns, lines=()):
+        # Return a new toolpath with lines added to the end, given as value
+        # columns which must include opcode, followed by unparsed lines. New
+        # rows are usually then placed with take.
+        count = len(columns["opcode"])
+        blank = {"opcode": 0, "colour": -1}
+
+        appended = {}
+        for name, dtype in self.dtypes.items():
+            values = np.full(count + len(lines), blank.get(name, np.nan), dtype)
+            if name in columns:
+                values[:count] = columns[name]
+            appended[name] = np.concatenate((getattr(self, name), values))
+
+        raw = dict(self.raw)
+        raw.update({len(self) + count + k: line for k, line in enumerate(lines)})
+
+        return toolpath(opcodes=opcodes, raw=raw, **appended)
+
+    def position(self, column):
+        # Forward-fill an axis column, giving the absolute position after each
+        # line, or NaN before the axis has first been set
+        index = np.where(np.isnan(column), 0, np.arange(len(column)))
+        np.maximum.accumulate(index, out=index)
+
+        return column[index]
+
+    def absolute(self):
+        # True unless the program switches to relative distance mode
+        return (self.code("G91") < 0 and
+                not any("G91" in line for line in self.raw.values()))
+
+    @staticmethod
+    def resolution(x, y):
+        # Grid step / mm which every X and Y value lies on, as written by the CAM
+        # tool, or 0 if finer than 0.0001
+        values = np.concatenate((x[~np.isnan(x)], y[~np.isnan(y)]))
+
+        for decimals in range(5):
+            scaled = values * 10 ** decimals
+            if np.allclose(scaled, np.round(scaled), rtol=0, atol=1e-6):
+                return 10.0 ** -decimals
+
+        return 0.0
+
+    def modal(self):
+        # True if any unparsed line has axis words without a motion command
+        return any(line.startswith(("X", "Y", "Z", "A", "B")) for line in self.raw.values())
+
+    def moves(self):
+        # Lines which are G0/G1 moves in X and Y only, with a known start point
+        linear = np.isin(self.opcode, [self.code("G0"), self.code("G1")])
+        x = self.position(self.x)
+        y = self.position(self.y)
+
+        return (linear & np.isnan(self.z) & np.isnan(self.b) & np.isnan(self.f) &
+                ~(np.isnan(self.x) & np.isnan(self.y)) &
+                ~np.isnan(np.roll(x, 1)) & ~np.isnan(np.roll(y, 1)) &
+                (np.arange(len(self)) > 0))
+
+    def simplify(self, tolerance):
+        # Return a new toolpath without zero-length moves, and with runs of
+        # nearly collinear moves merged where every removed point is within
+        # tolerance (mm) of the merged segment. Also returns the removed lines.
+        if not self.absolute():
+            log.warning("Relative moves found in GCODE, skipping simplification")
+            return self, self.take([])
+
+        x = self.position(self.x)
+        y = self.position(self.y)
+        moves = self.moves()
+        keep = np.ones(len(self), bool)
+
+        # Zero-length moves
+        keep[1:] &= ~(moves[1:] & (x[1:] == x[:-1]) & (y[1:] == y[:-1]))
+
+        # Runs of consecutive moves with the same opcode, skipping removed lines
+        kept = np.flatnonzero(keep)
+        sequence = np.flatnonzero(moves[kept])
+        breaks = np.flatnonzero((np.diff(sequence) > 1) |
+                                (np.diff(self.opcode[kept[sequence]].astype(int)) != 0)) + 1
+
+        for run in np.split(sequence, breaks):
+            if len(run) < 2:
+                continue
+
+            # Include the point each run starts from, which is always kept
+            rows = kept[np.concatenate(([run[0] - 1], run))]
+            points = np.column_stack((x[rows], y[rows]))
+
+            keep[rows[1:]] = self.chord_merge(points, tolerance)[1:]
+
+        # Kept moves must carry both axes, as earlier words may have been removed
+        filled = moves & keep
+        columns = {name: getattr(self, name) for name in self.dtypes}
+        columns["x"] = np.where(filled, x, self.x)
+        columns["y"] = np.where(filled, y, self.y)
+
+        simplified = toolpath(opcodes=list(self.opcodes), raw=self.raw, **columns)
+
+        return simplified.take(np.flatnonzero(keep)), self.take(np.flatnonzero(~keep))
+
+    def simulate(self, settings):
+        # Replay the program through a GRBL style trapezoidal motion planner with
+        # junction deviation, using the firmware max rates ($110-$114),
+        # accelerations ($120-$124) and junction deviation ($11). Assumes every
+        # block is planned with full look-ahead. Returns the time / s at which
+        # each line completes.
+        axes = ("x", "y", "z", "b")
+
+        # Axis numbers for each column, the batch axis (A) is not used by programs
+        numbers = (0, 1, 2, 4)
+        max_rate = np.array([settings["$11" + str(n)] for n in numbers]) / 60
+        acceleration = np.array([settings["$12" + str(n)] for n in numbers])
+        deviation = settings["$11"]
+
+        # Machine is assumed to start at zero on every axis
+        position = np.column_stack([np.nan_to_num(self.position(getattr(self, axis)))
+                                    for axis in axes])
+        delta = np.diff(position, axis=0, prepend=np.zeros((1, len(axes))))
+
+        motion = np.isin(self.opcode, [self.code(op) for op in ("G0", "G1", "G2", "G3")])
+        delta[~motion] = 0
+
+        chord = np.linalg.norm(delta, axis=1)
+        length = chord.copy()
+
+        # Arcs travel further than their chord, and a zero chord is a full circle
+        g2 = self.code("G2")
+        arcs = np.flatnonzero(np.isin(self.opcode, [g2, self.code("G3")]) &
+                              ~np.isnan(self.i) & ~np.isnan(self.j))
+        if len(arcs):
+            start = position[arcs, :2] - delta[arcs, :2]
+            centre = start + np.column_stack((self.i[arcs], self.j[arcs]))
+            v0 = start - centre
+            v1 = position[arcs, :2] - centre
+            clockwise = self.opcode[arcs] == g2
+
+            sweep = np.arctan2(v1[:, 1], v1[:, 0]) - np.arctan2(v0[:, 1], v0[:, 0])
+            sweep = np.where(clockwise, -sweep, sweep) % (2 * math.pi)
+            sweep[sweep == 0] = 2 * math.pi
+
+            arc_radius = np.hypot(*v0.T)
+            length[arcs] = np.hypot(arc_radius * sweep,
+                                    np.linalg.norm(delta[arcs, 2:], axis=1))
+            chord[arcs] = np.where(chord[arcs] > 0, chord[arcs], length[arcs])
+
+        blocks = np.flatnonzero(length > 0)
+
+        times = np.zeros(len(self))
+        if not len(blocks):
+            return times
+
+        # Axis limits for arcs are taken along their chord direction
+        length = length[blocks]
+        unit = delta[blocks] / chord[blocks, None]
+
+        def limit(values, direction):
+            # Largest value along direction without exceeding any axis limit
+            with np.errstate(divide="ignore"):
+                return np.min(values / np.abs(direction), axis=-1)
+
+        rate = limit(max_rate, unit)
+        accel = limit(acceleration, unit)
+
+        # Rapids run at the max rate, feed moves at the programmed feed / mm/min
+        feed = np.nan_to_num(self.position(self.f)[blocks], nan=np.inf) / 60
+        rapid = self.opcode[blocks] == self.code("G0")
+        nominal = np.where(rapid, rate, np.minimum(feed, rate))
+
+        # Direction of travel at the start and end of each block
+        entry_direction = unit.copy()
+        exit_direction = unit.copy()
+
+        if len(arcs):
+            def tangent(v):
+                # Unit tangent to the arc at v from the centre, in the direction of travel
+                t = np.column_stack((-v[:, 1], v[:, 0])) / arc_radius[:, None]
+                return np.where(clockwise[:, None], -t, t)
+
+            # Arcs are all blocks, as their length is never zero
+            index = np.searchsorted(blocks, arcs)
+            entry_direction[index] = 0
+            exit_direction[index] = 0
+            entry_direction[index, :2] = tangent(v0)
+            exit_direction[index, :2] = tangent(v1)
+
+            # Centripetal acceleration limits the speed around the arc
+            nominal[index] = np.minimum(nominal[index],
+                                        np.sqrt(accel[index] * arc_radius))
+
+        # Maximum junction speed squared between each block and the previous one
+        cos_theta = -np.sum(entry_direction[1:] * exit_direction[:-1], axis=1)
+        junction = entry_direction[1:] - exit_direction[:-1]
+        junction_length = np.linalg.norm(junction, axis=1)
+        junction = np.divide(junction, junction_length[:, None],
+                             out=np.zeros_like(junction), where=junction_length[:, None] > 0)
+        junction_accel = limit(acceleration, junction)
+
+        sin_half = np.sqrt(np.clip(0.5 * (1 - cos_theta), 0, 1))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            junction_speed = junction_accel * deviation * sin_half / (1 - sin_half)
+
+        # Straight through has no limit, a full reversal has to stop
+        junction_speed = np.where(cos_theta < -0.999999, np.inf, junction_speed)
+        junction_speed = np.where(cos_theta > 0.999999, 0, junction_speed)
+        junction_speed = np.minimum(junction_speed,
+                                    np.minimum(nominal[1:], nominal[:-1]) ** 2)
+
+        # Entry speeds squared, starting and finishing at rest
+        entry_max = [0.0] + junction_speed.tolist() + [0.0]
+        reach = (2 * accel * length).tolist()
+        entry = list(entry_max)
+
+        # Backward pass, every block must be able to decelerate to the next entry speed
+        for k in range(len(blocks) - 1, -1, -1):
+            entry[k] = min(entry_max[k], entry[k + 1] + reach[k])
+
+        # Forward pass, every block must be able to accelerate to its exit speed
+        for k in range(len(blocks)):
+            entry[k + 1] = min(entry[k + 1], entry[k] + reach[k])
+
+        v0 = np.sqrt(entry[:-1])
+        v1 = np.sqrt(entry[1:])
+
+        # Trapezoid if there is room to cruise at nominal speed, otherwise a triangle
+        accelerate = (nominal ** 2 - v0 ** 2) / (2 * accel)
+        decelerate = (nominal ** 2 - v1 ** 2) / (2 * accel)
+        cruise = length - accelerate - decelerate
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            trapezoid = (2 * nominal - v0 - v1) / accel + cruise / nominal
+            peak = np.sqrt((2 * accel * length + v0 ** 2 + v1 ** 2) / 2)
+            triangle = (2 * peak - v0 - v1) / accel
+
+        times[blocks] = np.where(cruise >= 0, trapezoid, triangle)
+
+        return np.cumsum(times)
+
+    def strokes(self):
+        # Find pen-down strokes as (pen down, last move) line index pairs, or
+        # None if the program is not made of strokes separated by pen-up travel
+        pen = np.flatnonzero(~np.isnan(self.z))
+
+        # Pen lines must only move Z
+        linear = np.isin(self.opcode[pen], [self.code("G0"), self.code("G1")])
+        if not (linear.all() and np.isnan(self.x[pen]).all() and
+                np.isnan(self.y[pen]).all() and np.isnan(self.b[pen]).all() and
+                np.isnan(self.f[pen]).all()):
+            return None
+
+        strokes = []
+        down = None
+        for idx, z in zip(pen.tolist(), self.z[pen].tolist()):
+            if z == 1 and down is None:
+                down = idx
+            elif z != 1 and down is not None:
+                strokes.append((down, idx - 1))
+                down = None
+
+        # Program must finish with the pen up
+        if down is not None or not strokes:
+            return None
+
+        moves = self.moves()
+        marker = (self.colour >= 0) & (self.opcode == 0)
+        feed_only = (self.opcode > 0) & ~np.isnan(self.f) & np.isnan(self.x) & \
+            np.isnan(self.y) & np.isnan(self.z) & np.isnan(self.b)
+        blank = np.zeros(len(self), bool)
+        blank[[idx for idx, line in self.raw.items() if line == ""]] = True
+
+        # Strokes may only contain moves
+        inside = np.zeros(len(self) + 1, int)
+        for down, last in strokes:
+            inside[down + 1] += 1
+            inside[last + 1] -= 1
+        inside = np.cumsum(inside[:-1]) > 0
+
+        if not moves[inside].all():
+            return None
+
+        # Between strokes there may only be pen-up travel, colour changes and feed changes
+        between = np.zeros(len(self), bool)
+        between[strokes[0][0]:strokes[-1][1] + 1] = True
+        between &= ~inside & np.isnan(self.z)
+
+        if not (moves | marker | feed_only | blank)[between].all():
+            return None
+
+        # Feed must stay the same throughout, so strokes can be moved
+        feeds = self.f[:strokes[-1][1] + 1]
+        if len(np.unique(feeds[~np.isnan(feeds)])) > 1:
+            return None
+
+        return strokes
+
+    def reorder(self):
+        # Return a new toolpath with strokes grouped by colour, and ordered to
+        # minimise pen-up travel. Also returns pen-up travel (mm) and colour
+        # changes, before and after.
+        strokes = self.strokes() if self.absolute() else None
+
+        if strokes is None:
+            log.warning("GCODE is not made of separate strokes, skipping reordering")
+            return self, None
+
+        x = self.position(self.x)
+        y = self.position(self.y)
+
+        # Colour in use at each line, -1 before the first colour change
+        marker = (self.colour >= 0) & (self.opcode == 0)
+        colour = self.position(np.where(marker, self.colour, np.nan))
+
+        down = np.array([s[0] for s in strokes])
+        last = np.array([s[1] for s in strokes])
+
+        entries = np.column_stack((x[down], y[down]))
+        exits = np.column_stack((x[last], y[last]))
+        colours = np.nan_to_num(colour[down], nan=-1).astype(int)
+
+        # Machine position at the start of the program is unknown, assume origin
+        origin = np.zeros(2)
+
+        def travel(entries, exits):
+            # Total straight-line pen-up travel between strokes
+            starts = np.vstack((origin, exits[:-1]))
+            return float(np.hypot(*(entries - starts).T).sum())
+
+        stats = {
+            "travel_before": travel(entries, exits),
+            "colours_before": int(marker.sum()),
+        }
+
+        # Colour groups in the order they first appear
+        groups = list(dict.fromkeys(colours.tolist()))
+
+        order, flipped = [], []
+        current = origin
+        for group in groups:
+            members = np.flatnonzero(colours == group)
+
+            o, f = self.plan_strokes(entries[members], exits[members], current)
+            order.extend(members[o].tolist())
+            flipped.extend(f.tolist())
+
+            current = entries[members[o[-1]]] if f[-1] else exits[members[o[-1]]]
+
+        # Rows are taken from the original program, followed by new travel and reversed moves
+        g0 = self.code("G0")
+        opcodes = list(self.opcodes)
+        if g0 < 0:
+            g0 = len(opcodes)
+            opcodes.append("G0")
+
+        rows = []
+        new_opcode, new_x, new_y = [], [], []
+
+        def new_row(op, px, py):
+            rows.append(len(self) + len(new_opcode))
+            new_opcode.append(op)
+            new_x.append(px)
+            new_y.append(py)
+
+        # Keep setup lines before the first stroke, but not travel or colour changes
+        prologue = np.arange(strokes[0][0])
+        travel_rows = np.isin(self.opcode, [self.code("G0"), self.code("G1")]) & \
+            np.isnan(self.z) & np.isnan(self.b) & np.isnan(self.f) & \
+            ~(np.isnan(self.x) & np.isnan(self.y))
+        rows.extend(prologue[~(travel_rows[prologue] | marker[prologue])].tolist())
+
+        markers = {}
+        for idx, line in zip(np.flatnonzero(marker).tolist(),
+                             self.colour[marker].tolist()):
+            markers.setdefault(line, idx)
+
+        current_colour = None
+        for k, reverse in zip(order, flipped):
+            start, end = strokes[k]
+
+            # One colour change per group
+            if colours[k] >= 0 and colours[k] != current_colour:
+                rows.append(markers[colours[k]])
+                current_colour = colours[k]
+
+            # Pen-up travel to the start of the stroke
+            entry = exits[k] if reverse else entries[k]
+            new_row(g0, entry[0], entry[1])
+
+            # Pen down
+            rows.append(start)
+
+            if reverse:
+                # Each segment keeps its opcode, travelling back to the previous point
+                for idx in range(end, start, -1):
+                    new_row(self.opcode[idx], x[idx - 1], y[idx - 1])
+            else:
+                rows.extend(range(start + 1, end + 1))
+
+            # Pen up
+            rows.append(end + 1)
+
+        # Everything after the last stroke's pen up
+        rows.extend(range(strokes[-1][1] + 2, len(self)))
+
+        pool = self.append(opcodes, {"opcode": new_opcode, "x": new_x, "y": new_y})
+
+        oriented_entries = np.array([exits[k] if f else entries[k]
+                                     for k, f in zip(order, flipped)])
+        oriented_exits = np.array([entries[k] if f else exits[k]
+                                   for k, f in zip(order, flipped)])
+
+        stats["travel_after"] = travel(oriented_entries, oriented_exits)
+        stats["colours_after"] = sum(1 for group in groups if group >= 0)
+
+        return pool.take(rows), stats
+
+    def unwrap(self, circumference, limit):
+        # Return a new toolpath where pen-up travel turns the shortest way around
+        # the part, tracking the cumulative Y position, and the Y work coordinate
+        # is re-homed with G92 whenever it would leave 0 to limit (mm), and at the
+        # end if it is past the first turn. G92 is not stored by grbl, and is
+        # cleared once the batch is done. Also returns travel saved (mm) and the
+        # number of times Y was re-homed.
+        if not self.absolute():
+            log.warning("Relative moves found in GCODE, skipping rotary unwrapping")
+            return self, None
+
+        if any("Y" in line for line in self.raw.values()):
+            log.warning("Unparsed Y moves found in GCODE, skipping rotary unwrapping")
+            return self, None
+
+        if limit < circumference:
+            log.warning("Y travel is less than one turn, skipping rotary unwrapping")
+            return self, None
+
+        has_y = ~np.isnan(self.y)
+        if not has_y.any():
+            return self, {"saved": 0.0, "rehomed": 0}
 
-    def correct(self):
-        for idx, line in enumerate(self.gcode):
-            # Correct Y and Z commands
-            self.correct_dims(idx, line)
+        y = self.position(self.y)
 
-            # Add correct colour change commands
-            self.correct_colours(idx, line)
+        # Pen-up travel may take either direction, each turn is a multiple of
+        # the circumference away from the programmed position
+        up = self.position(self.z) != 1
+        travel = self.moves() & up & has_y
+        delta = np.where(travel, y - np.roll(y, 1), 0)
+        shortest = delta - circumference * np.round(delta / circumference)
 
-    def correct_dims(self, idx, line):
-        # Correct y and z values to take radius into account
+        machine = y + np.cumsum(shortest - delta)
+
+        # Re-home just before the first line which would pass a travel limit, so
+        # the current position becomes the same angle within the first turn
+        rehome_rows, rehome_y = [], []
+        start = 0
+        while True:
+            outside = has_y[start:] & ((machine[start:] < 0) | (machine[start:] > limit))
+            if not outside.any():
+                break
+
+            idx = start + int(np.argmax(outside))
+            if idx == 0 or np.isnan(machine[idx - 1]):
+                log.warning("GCODE starts outside the Y travel limit, not re-homing")
+                break
+
+            shift = math.floor(machine[idx] / circumference) * circumference
+            rehome_rows.append(idx)
+            rehome_y.append(machine[idx - 1] - shift)
+
+            machine[idx:] -= shift
+            start = idx
+
+        # Re-home at the end if the next part would otherwise start by rewinding
+        # more than a turn
+        lines = []
+        final = machine[-1]
+        if not 0 <= final < circumference:
+            turns = math.floor(round(final / circumference, 6))
+            lines.append(f"G92 Y{max(final - turns * circumference, 0):.4f}")
+
+        opcodes = list(self.opcodes)
+        if "G92" not in opcodes:
+            opcodes.append("G92")
+
+        columns = {name: getattr(self, name) for name in self.dtypes}
+        columns["y"] = np.where(has_y, machine, np.nan)
+        unwrapped = toolpath(opcodes=opcodes, raw=self.raw, **columns)
+
+        pool = unwrapped.append(opcodes, {
+            "opcode": [opcodes.index("G92")] * len(rehome_rows),
+            "y": rehome_y,
+        }, lines)
+
+        new_rows = np.arange(len(self), len(pool))
+        rows = np.concatenate((np.insert(np.arange(len(self)), rehome_rows,
+                                         new_rows[:len(rehome_rows)]),
+                               new_rows[len(rehome_rows):]))
+
+        stats = {
+            "saved": float(np.sum(np.abs(delta) - np.abs(shortest))),
+            "rehomed": len(rehome_rows),
+        }
+
+        return pool.take(rows), stats
+
+    @staticmethod
+    def plan_strokes(entries, exits, origin, passes=20):
+        # Order reversible strokes to minimise travel, starting from origin,
+        # using nearest neighbour followed by 2-opt improvement.
+        # Returns stroke order, and whether each stroke is reversed.
+        n = len(entries)
+        remaining = np.ones(n, bool)
+        order = np.empty(n, int)
+        flipped = np.zeros(n, bool)
+
+        # Nearest neighbour, entering each stroke from whichever end is closer
+        current = origin
+        for i in range(n):
+            forward = np.hypot(*(entries - current).T)
+            backward = np.hypot(*(exits - current).T)
+            distance = np.where(remaining, np.minimum(forward, backward), np.inf)
+
+            k = int(np.argmin(distance))
+            order[i] = k
+            flipped[i] = backward[k] < forward[k]
+            remaining[k] = False
+
+            current = entries[k] if flipped[i] else exits[k]
+
+        # Oriented end points in travel order
+        a = np.where(flipped[:, None], exits[order], entries[order])
+        b = np.where(flipped[:, None], entries[order], exits[order])
+
+        # 2-opt, reversing a run of strokes reverses their order and direction.
+        # Only the travel into and out of the run changes.
+        for _ in range(passes):
+            improved = False
+
+            for i in range(n):
+                previous = b[i - 1] if i > 0 else origin
+                j = np.arange(i, n)
+
+                before = np.hypot(*(a[i] - previous))
+                after = np.hypot(*(b[j] - previous).T)
+
+                # Travel out of the run, nothing follows the last stroke
+                following = np.vstack((a[i + 1:], np.full((1, 2), np.nan)))
+                leave_before = np.nan_to_num(np.hypot(*(following - b[j]).T))
+                leave_after = np.nan_to_num(np.hypot(*(following - a[i]).T))
+
+                delta = after + leave_after - before - leave_before
+                best = int(np.argmin(delta))
+
+                if delta[best] < -1e-9:
+                    k = i + best
+                    order[i:k + 1] = order[i:k + 1][::-1].copy()
+                    flipped[i:k + 1] = ~flipped[i:k + 1][::-1]
+                    a[i:k + 1], b[i:k + 1] = b[i:k + 1][::-1].copy(), a[i:k + 1][::-1].copy()
+                    improved = True
+
+            if not improved:
+                break
+
+        return order, flipped
+
+    @staticmethod
+    def chord_merge(points, tolerance):
+        # Ramer-Douglas-Peucker polyline simplification, returns a mask of points to keep
+        keep = np.zeros(len(points), bool)
+        keep[0] = keep[-1] = True
+
+        stack = [(0, len(points) - 1)]
+        while stack:
+            start, end = stack.pop()
+            if end - start < 2:
+                continue
+
+            a = points[start]
+            ab = points[end] - a
+            ap = points[start + 1:end] - a
+
+            # Distance from each point to the chord segment between start and end
+            length = ab @ ab
+            if length > 0:
+                t = np.clip(ap @ ab / length, 0, 1)
+                distance = np.hypot(*(ap - np.outer(t, ab)).T)
+            else:
+                distance = np.hypot(*ap.T)
+
+            furthest = int(np.argmax(distance))
+            if distance[furthest] > tolerance:
+                split = start + 1 + furthest
+                keep[split] = True
+                stack.append((start, split))
+                stack.append((split, end))
+
+        return keep
+
+    def fit_arcs(self, tolerance, scale, rapid_rate):
+        # Return a new toolpath with runs of moves which lie on a circle replaced
+        # by G2/G3 arcs. Arcs are circles in machine coordinates, but every
+        # replaced point must be within tolerance (mm) of the arc on the unwrapped
+        # surface, where Y is divided by scale (Y units per mm).
+        if not self.absolute():
+            log.warning("Relative moves found in GCODE, skipping arc fitting")
+            return self
+
+        # Lines with only axis words would continue a preceding arc
+        if self.modal():
+            log.warning("Modal moves found in GCODE, skipping arc fitting")
+            return self
+
+        x = self.position(self.x)
+        y = self.position(self.y)
+        moves = self.moves()
+
+        # Arcs run at the feed rate, so rapids are only replaced if that is no slower
+        g0 = self.code("G0")
+        feed = np.nan_to_num(self.position(self.f))
+        moves &= (self.opcode != g0) | (feed >= rapid_rate)
+
+        # Zero-length moves have no direction around the centre
+        moves[1:] &= (x[1:] != x[:-1]) | (y[1:] != y[:-1])
+
+        opcodes = list(self.opcodes)
+        for op in ("G2", "G3"):
+            if op not in opcodes:
+                opcodes.append(op)
+
+        columns = {name: getattr(self, name).copy() for name in self.dtypes}
+        keep = np.ones(len(self), bool)
+
+        sequence = np.flatnonzero(moves)
+        breaks = np.flatnonzero((np.diff(sequence) > 1) |
+                                (np.diff(self.opcode[sequence].astype(int)) != 0)) + 1
+
+        for run in np.split(sequence, breaks):
+            if len(run) < 3:
+                continue
+
+            # Include the point each run starts from
+            rows = np.concatenate(([run[0] - 1], run))
+            points = np.column_stack((x[rows], y[rows]))
+
+            for start, end, centre, clockwise in self.arc_runs(points, tolerance, scale):
+                keep[rows[start + 1:end]] = False
+
+                row = rows[end]
+                columns["opcode"][row] = opcodes.index("G2" if clockwise else "G3")
+                columns["x"][row], columns["y"][row] = points[end]
+                columns["i"][row], columns["j"][row] = centre - points[start]
+
+        fitted = toolpath(opcodes=opcodes, raw=self.raw, **columns)
+
+        return fitted.take(np.flatnonzero(keep))
+
+    @classmethod
+    def arc_runs(cls, points, tolerance, scale, minimum=3, maximum=128):
+        # Greedily find the longest arcs through consecutive points, each replacing
+        # between minimum and maximum moves, as (start, end, centre, clockwise) tuples
+        arcs = []
+        start = 0
+
+        while start + minimum < len(points):
+            best = None
+
+            for end in range(start + minimum, min(start + maximum, len(points) - 1) + 1):
+                # Nearly straight runs are left to simplification, but may still curve later
+                if cls.straight(points[start:end + 1], tolerance, scale):
+                    continue
+
+                arc = cls.fit_arc(points[start:end + 1], tolerance, scale)
+                if arc is None:
+                    break
+                best = (end,) + arc
+
+            if best is None:
+                start += 1
+                continue
+
+            arcs.append((start,) + best)
+            start = best[0]
+
+        return arcs
+
+    @staticmethod
+    def fit_arc(points, tolerance, scale):
+        # Fit a circle through the first and last points, returning the centre and
+        # direction, or None if the points do not lie on an arc within tolerance
+        a, b = points[0], points[-1]
+        middle = (a + b) / 2
+        half = np.hypot(*(b - a)) / 2
+        if half == 0:
+            return None
+
+        # The centre lies on the perpendicular bisector of the end points, so an
+        # algebraic least squares fit is linear in the distance along it
+        normal = np.array([a[1] - b[1], b[0] - a[0]]) / (2 * half)
+        offset = points[1:-1] - middle
+        d = offset @ normal
+        q = np.sum(offset ** 2, axis=1) - half ** 2
+
+        if not np.any(d):
+            return None
+
+        centre = middle + normal * (q @ d) / (2 * d @ d)
+        radius = np.hypot(*(a - centre))
+
+        # Points must go around the centre in one direction, short of a full circle
+        v = points - centre
+        turn = np.diff(np.arctan2(v[:, 1], v[:, 0]))
+        turn = (turn + math.pi) % (2 * math.pi) - math.pi
+        if not (np.all(turn > 0) or np.all(turn < 0)) or abs(turn.sum()) > 1.9 * math.pi:
+            return None
+
+        # Radial error of each point, on the surface
+        surface = np.array([1, 1 / scale])
+        error = v[1:-1] * (1 - radius / np.hypot(*v[1:-1].T))[:, None] * surface
+        if np.any(np.hypot(*error.T) > tolerance):
+            return None
+
+        return centre, bool(turn[0] < 0)
+
+    @staticmethod
+    def straight(points, tolerance, scale):
+        # True if every point is within tolerance of the line through the end
+        # points, measured on the surface
+        surface = np.array([1, 1 / scale])
+        along = (points[-1] - points[0]) * surface
+        offset = (points[1:-1] - points[0]) * surface
+        across = np.abs(along[0] * offset[:, 1] - along[1] * offset[:, 0])
+
+        return bool(np.all(across <= tolerance * np.hypot(*along)))
+
+    def correct(self, radius, z_height, z_offset, z_lift, colour_origin, colour_offset):
+        # Return a new toolpath with Y in degrees, Z at print or lift height,
+        # and colour changes converted to colour axis moves
+
+        # deg = mm * (360 / 2πr)
+        y = np.round(self.y * 360 / (2 * math.pi * radius), 2)
+
+        # If drawing, set Z to part outer radius plus the offset, otherwise
+        # to part outer radius plus the lift height
+        z = np.where(self.z == 1,
+                     z_height - radius + z_offset,
+                     z_height - radius - z_lift)
+        z = np.where(np.isnan(self.z), np.nan, np.round(z, 2))
+
+        # Colour changes become a G0 move of the colour axis
+        opcodes = list(self.opcodes)
+        if "G0" not in opcodes:
+            opcodes.append("G0")
+
+        is_colour = self.colour >= 0
+        opcode = np.where(is_colour, opcodes.index("G0"), self.opcode).astype(np.uint8)
+        b = np.where(is_colour, colour_origin +
+                     self.colour * colour_offset, self.b)
+
+        raw = {idx: self.correct_line(line, radius, z_height, z_offset, z_lift,
+                                      colour_origin, colour_offset)
+               for idx, line in self.raw.items()}
+
+        return toolpath(opcode, opcodes, self.x, y, z, b, self.f, self.i, self.j,
+                        self.colour, raw)
+
+    def serialise(self):
+        # Convert columns back to a list of GCODE lines in a single pass
+        def words(letter, column):
+            # Format each distinct value once, then index the result per line
+            tokens = np.full(len(column), "", dtype=object)
+            present = ~np.isnan(column)
+
+            values, index = np.unique(column[present], return_inverse=True)
+            formatted = [" " + letter + ("%.4f" % value).rstrip("0").rstrip(".")
+                         for value in values.tolist()]
+
+            tokens[present] = np.array(formatted, dtype=object)[index]
+            return tokens
+
+        opcodes = np.array(self.opcodes, dtype=object)
+
+        lines = (opcodes[self.opcode] + words("X", self.x) + words("Y", self.y) +
+                 words("Z", self.z) + words("B", self.b) + words("I", self.i) +
+                 words("J", self.j) + words("F", self.f))
+
+        # Uncorrected colour change markers
+        for idx in np.flatnonzero((self.colour >= 0) & (self.opcode == 0)).tolist():
+            lines[idx] = "<C" + str(self.colour[idx]) + ">"
+
+        # Unparsed lines
+        for idx, line in self.raw.items():
+            lines[idx] = line
+
+        return lines.tolist()
+
+    @classmethod
+    def correct_line(cls, line, radius, z_height, z_offset, z_lift, colour_origin, colour_offset):
+        # Per-line correction, used for lines which could not be parsed into columns
+
+        # Replace generic colour change commands with correct GCODE
+        m = cls.colour_search.search(line)
+
+        # If a colour change command
+        if m:
+            colour = float(m.group(1))
+
+            # Update command correctly based on requested colour
+            return "G0B" + str(colour_origin + colour * colour_offset)
 
         # Alter Y value
-        m = re.search("Y([\d.]+)", line)
+        m = cls.y_pattern.search(line)
 
         # If command contains Y
         if m:
-            y = m.string[m.start(1):m.end(1)]
-            y = float(y)
+            y = float(m.group(1))
 
             # deg = mm * (360 / 2πr)
-            y = y * 360 / (2 * math.pi * r.radius)
+            y = y * 360 / (2 * math.pi * radius)
 
             y = round(y, 2)
 
-            new_line = line[:m.start(1)] + str(y) + line[m.end(1):]
-
-            self.gcode[idx] = new_line
+            line = line[:m.start(1)] + str(y) + line[m.end(1):]
 
         # Alter Z value
-        m = re.search("Z([\d.]+)", line)
+        m = cls.z_pattern.search(line)
 
         # If command contains Z
         if m:
-            z = m.string[m.start(1):m.end(1)]
-            z = float(z)
+            z = float(m.group(1))
+
+            # if drawing
+            if z == 1:
+                # set Z to part outer radius, plus the offset
+                z = z_height - radius + z_offset
+            else:
+                # set Z to part outer radius, plus the lift height
+                z = z_height - radius - z_lift
+
+            z = round(z, 2)
+
+            line = line[:m.start(1)] + str(z) + line[m.end(1):]
+
+        return line
+
+
+class upload:
+    """
+    Incremental GCODE upload.
+
+    Chunks of text are parsed into toolpath columns as they arrive, and the
+    columns are appended to files on disk every `block_size` lines, so memory
+    use does not depend on the size of the program. On commit the columns are
+    memory-mapped read-only as the uploaded toolpath.
+    """
+
+    # Lines to parse before appending columns to disk
+    block_size = 65536
+
+    def __init__(self, size=0):
+        # Expected upload size in characters, used for progress only
+        self.size = size
+        self.received = 0
+
+        # Lines accepted so far, and content hash of those lines
+        self.lines = 0
+        self.hash = hashlib.sha1()
+
+        # Trailing line which has not been completed by a newline yet
+        self.partial = ""
+
+        # Parsed lines waiting to be written to disk
+        self.pending = []
+
+        # Grid step / mm of the coordinates so far, the finest of any block
+        self.resolution = 1.0
+
+        self.opcodes = [""]
+        self.raw = {}
+
+        self.directory = tempfile.mkdtemp(prefix="rotaprint-")
+        self.files = {name: open(os.path.join(self.directory, name), "wb")
+                      for name in toolpath.dtypes}
+
+    def write(self, chunk):
+        # Add a chunk of text to the upload, returns percentage received
+        self.received += len(chunk)
+
+        lines = (self.partial + chunk).split("\n")
+        self.partial = lines.pop()
+
+        for line in lines:
+            self.add(line)
+
+        if self.size:
+            return min(100 * self.received / self.size, 100)
+        return 0
+
+    def add(self, line):
+        # Accept a single line, ignoring comments
+        if line.startswith('#'):
+            return
+
+        line = line.strip()
+
+        # Hash matches that of the lines joined by newlines
+        if self.lines:
+            self.hash.update(b"\n")
+        self.hash.update(line.encode())
+
+        self.lines += 1
+        self.pending.append(line)
+
+        if len(self.pending) >= self.block_size:
+            self.flush()
+
+    def flush(self):
+        # Parse pending lines and append their columns to disk
+        start = self.lines - len(self.pending)
+        columns, raw = toolpath.parse_columns(self.pending, self.opcodes, start)
+
+        for name, column in columns.items():
+            column.tofile(self.files[name])
+
+        self.resolution = min(self.resolution, toolpath.resolution(columns["x"], columns["y"]))
+        self.raw.update(raw)
+        self.pending = []
+
+    def commit(self):
+        # Finish the upload and return the memory-mapped toolpath
+        if self.partial:
+            self.add(self.partial)
+            self.partial = ""
+
+        self.flush()
+
+        for f in self.files.values():
+            f.close()
+
+        columns = {}
+        for name, dtype in toolpath.dtypes.items():
+            if self.lines:
+                columns[name] = np.memmap(os.path.join(
+                    self.directory, name), dtype, mode="r")
+            else:
+                # Empty files cannot be mapped
+                columns[name] = np.empty(0, dtype)
+
+        log.debug(
+            f"Upload complete, {self.lines} lines received ({self.digest[:8]})")
+
+        return toolpath(opcodes=self.opcodes, raw=self.raw, **columns)
+
+    @property
+    def digest(self):
+        return self.hash.hexdigest()
+
+    def remove(self):
+        # Delete column files from disk
+        for f in self.files.values():
+            f.close()
+
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class job:
+    """
+    Compiled GCODE program, ready for streaming.
+
+    Each line is stored stripped of whitespace and comments, uppercased and
+    newline terminated, after an index of block offsets. The file is
+    memory-mapped, so blocks can be written to serial straight from the map
+    and compiled jobs can be reopened without correcting the program again.
+
+    File layout: magic (8 bytes), block count (uint64), block offsets
+    (uint64, count + 1), then the blocks.
+    """
+
+    # File signature, including format version. Also part of the compiled job name,
+    # so change it whenever compiled output changes and older jobs are not reused
+    magic = b"RPJOB001"
+
+    # Comments and whitespace are not sent to grbl
+    strip_pattern = re.compile(r"\s|\(.*?\)")
+
+    def __init__(self, path):
+        self.path = path
+
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self.map[:8] != self.magic:
+            raise ValueError(f"{path} is not a compiled rotaprint job")
+
+        count = int.from_bytes(self.map[8:16], "little")
+        self.offsets = np.frombuffer(self.map, np.uint64, count + 1, 16)
+        self.data = memoryview(self.map)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __iter__(self):
+        # Yield each block as a view into the map
+        offsets = self.offsets.tolist()
+        data = self.data
+
+        for start, end in zip(offsets, offsets[1:]):
+            yield data[start:end]
+
+    def block(self, idx):
+        # Single block as a view into the map
+        return self.data[int(self.offsets[idx]):int(self.offsets[idx + 1])]
+
+    @classmethod
+    def encode(cls, line):
+        # Convert a GCODE line to the block sent to grbl
+        return (cls.strip_pattern.sub("", line).upper() + "\n").encode()
+
+    @classmethod
+    def compile(cls, lines, path):
+        # Write lines to path as a compiled job, and return it
+        blocks = [cls.encode(line) for line in lines]
+
+        # Blocks start after the header and offset index
+        header = 16 + 8 * (len(blocks) + 1)
+        lengths = np.fromiter(map(len, blocks), np.uint64, len(blocks))
+        offsets = np.concatenate(([0], np.cumsum(lengths))).astype(np.uint64) + header
+
+        # Write to a temporary file first, so a partly written job is never opened
+        temp = path + ".tmp"
+        with open(temp, "wb") as f:
+            f.write(cls.magic)
+            f.write(len(blocks).to_bytes(8, "little"))
+            f.write(offsets.tobytes())
+            f.write(b"".join(blocks))
+
+        os.replace(temp, path)
+
+        return cls(path)
+
+
+class stream:
+    """
+    Corrected GCODE program, generated a section at a time as it is sent.
+
+    The first block is ready almost immediately and memory use does not depend
+    on program length, as sections are taken from the uploaded columns on disk.
+    Only passes which work within a section are run. Can be iterated more than
+    once, e.g. once per batch part.
+    """
+
+    # Lines in the first section, doubling up to section_size
+    first_size = 64
+    section_size = 8192
+
+    def __init__(self, program, parameters, options):
+        self.program = program
+        self.parameters = parameters
+        self.options = options
+
+        # Blocks sent once the whole program has been generated, None until then
+        self.lines = None
+
+        # Relative or modal moves make sections depend on earlier ones
+        self.local = program.absolute() and not program.modal()
+
+    def __len__(self):
+        # Blocks sent, once known. Until then lines before optimisation, which is
+        # at least the number of blocks sent
+        return len(self.program) if self.lines is None else self.lines
+
+    def __iter__(self):
+        options = self.options
+        scale = 360 / (2 * math.pi * self.parameters["radius"])
+
+        # Position and feed rate at the end of the previous section
+        context = {"x": math.nan, "y": math.nan, "f": math.nan}
+        lines = 0
+
+        for section in self.program.blocks(self.section_size, self.first_size):
+            # Each section starts with a move to the previous position, so
+            # passes see the same start point as for the whole program
+            opcodes = list(section.opcodes)
+            if "G0" not in opcodes:
+                opcodes.append("G0")
+
+            pool = section.append(opcodes, {"opcode": [opcodes.index("G0")],
+                                            **{k: [v] for k, v in context.items()}})
+            section = pool.take(np.roll(np.arange(len(pool)), 1))
+
+            for name in context:
+                column = getattr(section, name)
+                known = np.flatnonzero(~np.isnan(column))
+                context[name] = column[known[-1]] if len(known) else math.nan
+
+            if self.local and options["simplify"]:
+                section = section.simplify(options["simplify_tolerance"])[0]
+
+            section = section.correct(**self.parameters)
+
+            if self.local and options["arc_fitting"]:
+                section = section.fit_arcs(options["arc_tolerance"], scale,
+                                           options["rapid_rate"])
+
+            for line in section.serialise()[1:]:
+                lines += 1
+                yield job.encode(line)
+
+        self.lines = lines
+
+
+class gcode:
+    # Columnar copy of the uploaded program, kept immutable once loaded
+    toolpath = None
+
+    # Upload which holds the toolpath columns on disk
+    upload = None
+
+    # Content hash of the uploaded program
+    digest = ""
+
+    # Grid step / mm of the uploaded program's coordinates
+    resolution = 0.0
+
+    # Maximum number of corrected programs to keep in memory
+    cache_size = 8
+
+    # Directory for compiled jobs, and maximum number to keep on disk
+    jobs_directory = "jobs"
+    jobs_size = 32
+
+    def __init__(self):
+        # Corrected programs / {(digest, parameters): (job, toolpath)}, least recently used first
+        self.cache = collections.OrderedDict()
+        self.cache_lock = threading.Lock()
+
+    def load(self, program):
+        # Store a completed upload, which has been parsed into columns as it arrived
+        previous = self.upload
+
+        self.toolpath = program.commit()
+        self.digest = program.digest
+        self.upload = program
+        self.resolution = program.resolution
+
+        # Previous columns are no longer needed, corrected programs are cached separately
+        if previous is not None:
+            previous.remove()
+
+    def parameters(self, radius):
+        # Current values of everything which affects the corrected program, for a
+        # part of radius / mm on the printer being sent to
+        return {
+            "radius": radius,
+            "z_height": db.settings["z_height"],
+            "z_offset": db.settings["z_offset"],
+            "z_lift": db.settings["z_lift"],
+            "colour_origin": db.settings["colour_origin"],
+            "colour_offset": db.settings["colour_offset"],
+        }
+
+    def options(self):
+        # Current values of the optional optimisation passes
+        return {
+            "simplify": bool(db.settings["simplify"]),
+            "simplify_tolerance": db.settings["simplify_tolerance"],
+            "reorder": bool(db.settings["reorder"]),
+            "rotary_mode": bool(db.settings["rotary_mode"]),
+            "rotary_limit": db.settings["$131"],
+            "arc_fitting": bool(db.settings["arc_fitting"]),
+            # Uploaded points are only known to half their last decimal place
+            "arc_tolerance": db.settings["$12"] + self.resolution / 2,
+            "rapid_rate": math.hypot(db.settings["$110"], db.settings["$111"]),
+        }
+
+    def optimise(self, program, options, parameters):
+        # Run enabled optimisation passes on the uncorrected program
+        if options["simplify"]:
+            original = program
+            program, removed = program.simplify(options["simplify_tolerance"])
+
+            # Print time before and after, simulated once corrected as grbl moves Y in degrees
+            before, after = (p.correct(**parameters).simulate(db.settings)
+                             for p in (original, program))
+            before, after = (t[-1] if len(t) else 0 for t in (before, after))
+
+            log.info(f"Simplified GCODE: removed {len(removed)} of {len(original)} lines, "
+                     f"simulated print time {before:.1f}s to {after:.1f}s")
+
+        if options["reorder"]:
+            program, stats = program.reorder()
+
+            if stats is not None:
+                log.info(f"Reordered GCODE: pen-up travel {stats['travel_before']:.0f}mm "
+                         f"to {stats['travel_after']:.0f}mm, colour changes "
+                         f"{stats['colours_before']} to {stats['colours_after']}")
+
+        return program
+
+    def unwrap(self, program, options, radius):
+        # Run rotary unwrapping on the uncorrected program, where Y is in mm
+        if not options["rotary_mode"]:
+            return program
+
+        circumference = 2 * math.pi * radius
+        limit = options["rotary_limit"] * circumference / 360
+        program, stats = program.unwrap(circumference, limit)
+
+        if stats is not None:
+            log.info(f"Unwrapped rotary moves: saved {stats['saved'] * 360 / circumference:.0f}° "
+                     f"of Y travel, re-homed Y {stats['rehomed']} time(s)")
+
+        return program
+
+    def fit_arcs(self, program, options, radius):
+        # Run arc fitting on the corrected program, where Y is in degrees
+        if not options["arc_fitting"]:
+            return program
+
+        lines = len(program)
+        scale = 360 / (2 * math.pi * radius)
+        program = program.fit_arcs(options["arc_tolerance"], scale, options["rapid_rate"])
+
+        log.info(f"Fitted arcs to GCODE: {lines} to {len(program)} lines "
+                 f"({100 * (lines - len(program)) / max(lines, 1):.0f}% fewer)")
+
+        return program
+
+    def corrected(self, radius):
+        # Return the program with corrected Y and Z commands and colour change
+        # commands, as lines and as a toolpath, reusing a previous result if
+        # nothing has changed
+        parameters = self.parameters(radius)
+
+        options = self.options()
+        key = (job.magic, self.digest, tuple(sorted(parameters.items())),
+               tuple(sorted(options.items())))
+
+        with self.cache_lock:
+            if key in self.cache:
+                log.debug("Using cached corrected GCODE")
+                self.cache.move_to_end(key)
+                return self.cache[key]
+
+        program = self.optimise(self.toolpath, options, parameters)
+        program = self.unwrap(program, options, parameters["radius"])
+        program = program.correct(**parameters)
+        program = self.fit_arcs(program, options, parameters["radius"])
+
+        # Reuse a job compiled previously with the same key, even from an earlier session
+        os.makedirs(self.jobs_directory, exist_ok=True)
+        name = hashlib.sha1(repr(key).encode()).hexdigest() + ".rpj"
+        path = os.path.join(self.jobs_directory, name)
+
+        try:
+            compiled = job(path)
+            log.debug(f"Reusing compiled job {name}")
+        except (OSError, ValueError):
+            compiled = job.compile(program.serialise(), path)
+            log.debug(f"Compiled job {name}")
+            self.prune_jobs()
+
+        corrected = (compiled, program)
+
+        with self.cache_lock:
+            self.cache[key] = corrected
+
+            # Drop least recently used programs
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+        return corrected
+
+    def correct(self, radius):
+        # Return the corrected program for the current settings, as a compiled job
+        return self.corrected(radius)[0]
+
+    def stream(self, radius):
+        # Return the corrected program for the current settings, generated as it is sent
+        options = self.options()
+        parameters = self.parameters(radius)
+
+        if options["reorder"] or options["rotary_mode"]:
+            log.info("Reordering and rotary mode need the whole program, "
+                     "skipping them while streaming")
+
+        return stream(self.toolpath, parameters, options)
+
+    def preamble(self, blocks, radius):
+        # Lines restoring grbl's state at the end of blocks already sent, so a program
+        # can be resumed after them: units, distance mode, colour, position with any G92
+        # offset, pen height, motion mode and feed
+        words = re.compile("([A-Z])([-+]?[0-9.]+)")
+
+        modes = {"units": "G21", "distance": "G90", "motion": "G0"}
+        position = {}
+        shift = collections.defaultdict(float)  # G92 offset, machine minus program
+        feed = None
+
+        for block in blocks:
+            line = bytes(block).decode().strip()
+            codes = []
+            values = {}
+            for letter, value in words.findall(line):
+                if letter == "G":
+                    codes.append(value)
+                else:
+                    values[letter] = float(value)
+
+            if "F" in values:
+                feed = values["F"]
+
+            if "92.1" in codes:
+                for axis in shift:
+                    position[axis] = position.get(axis, 0) + shift[axis]
+                shift.clear()
+                continue
+
+            if "92" in codes:
+                for axis in "XYZB":
+                    if axis in values:
+                        shift[axis] += position.get(axis, 0) - values[axis]
+                        position[axis] = values[axis]
+                continue
+
+            if "10" in codes or "4" in codes:
+                continue
+
+            for code in codes:
+                if code in ("20", "21"):
+                    modes["units"] = "G" + code
+                elif code in ("90", "91"):
+                    modes["distance"] = "G" + code
+                elif code in ("0", "00", "1", "01", "2", "02", "3", "03"):
+                    modes["motion"] = "G" + str(int(code))
+
+            for axis in "XYZB":
+                if axis in values:
+                    if modes["distance"] == "G91":
+                        position[axis] = position.get(axis, 0) + values[axis]
+                    else:
+                        position[axis] = values[axis]
+
+        parameters = self.parameters(radius)
+        lift = round(parameters["z_height"] - parameters["radius"] - parameters["z_lift"], 2)
 
-            # if drawing
-            if z == 1:
-                # set Z to part outer radius, plus the offset
-                z = db.settings["z_height"] - \
-                    r.radius + db.settings["z_offset"]
-            else:
-                # set Z to part outer radius, plus the lift height
-                z = db.settings["z_height"] - \
-                    r.radius - db.settings["z_lift"]
+        lines = [modes["units"] + "G90", "G92.1", f"G0Z{lift}"]
 
-            z = round(z, 2)
+        if "B" in position:
+            lines.append(f"G0B{position['B']:.4f}")
 
-            new_line = line[:m.start(1)] + str(z) + line[m.end(1):]
+        if "X" in position or "Y" in position:
+            # Y is rotary, so the G92 offset only matters modulo a turn
+            x, y = position.get("X", 0), position.get("Y", 0)
+            lines.append(f"G0X{x:.4f}Y{(y + shift['Y']) % 360:.4f}")
+            lines.append(f"G92Y{y:.4f}")
 
-            self.gcode[idx] = new_line
+        if "Z" in position:
+            lines.append(f"G1Z{position['Z']}F{feed if feed else db.settings['$112']}")
 
-    def correct_colours(self, idx, line):
-        # Replace generic colour change commands with correct GCODE
-        m = re.search("<C(\d+?)>", line)
+        lines.append(modes["distance"] + modes["motion"] + (f"F{feed}" if feed else ""))
 
-        # If a colour change command
-        if m:
-            colour = m.string[m.start(1): m.end(1)]
-            colour = float(colour)
+        return lines
 
-            # Update command correctly based on requested colour
-            command = "G0B" + \
-                str(db.settings["colour_origin"] +
-                    colour * db.settings["colour_offset"])
+    def prune_jobs(self):
+        # Delete the oldest compiled jobs beyond jobs_size
+        paths = [os.path.join(self.jobs_directory, name)
+                 for name in os.listdir(self.jobs_directory) if name.endswith(".rpj")]
+        paths.sort(key=os.path.getmtime, reverse=True)
+
+        for path in paths[self.jobs_size:]:
+            try:
+                os.remove(path)
+            except OSError:
+                log.warning(f"Could not remove old compiled job {path}")
 
-            self.gcode[idx] = command
+    def estimate(self, radius):
+        # Predicted time / s at which each corrected line completes
+        return self.corrected(radius)[1].simulate(db.settings)
 
 
 class webserver:
@@ -420,6 +2301,9 @@ class database:
 
         # --- Printer specific ---
         "port": "/dev/ttyS3",
+        "rx_buffer_size": 128,
+        "planner_feedback": 0,
+        "serial_trace": 0,
 
         # --- General settings ---
         "warning_percentage": 10,
@@ -430,11 +2314,21 @@ class database:
         "z_offset": 0,
         "z_lift": 10,
 
+        # --- Optimisation settings ---
+        "simplify": 0,
+        "simplify_tolerance": 0.01,
+        "reorder": 0,
+        "rotary_mode": 0,
+        "arc_fitting": 0,
+        "streaming": 0,
+
         # --- Batch settings ---
         "batch_origin": 110,
         "batch_offset": 100,
         "scanner_offset": 50,
         "video_device": 0,
+        "preview_rate": 5,
+        "preview_quality": 70,
         "reference_images": 4,
         "comparison_images": 20,
         "qc_images": 8,
@@ -455,6 +2349,13 @@ class database:
     # Convert dictionary to list of tuples for database connection
     settings_tuple = settings.items()
 
+    # Held while using the shared cursor, as settings are read by the websocket,
+    # logs and grbl threads at the same time
+    lock = threading.Lock()
+
+    # Held while reading or writing print checkpoints
+    checkpoint_lock = threading.Lock()
+
     def connect(self):
         log.info("Connecting to database...")
         db_location = 'rotaprint.db'
@@ -478,6 +2379,9 @@ class database:
                 db_location, check_same_thread=False)
             self.cursor = self.connection.cursor()
 
+            # Add any settings which are missing from an older database
+            self.add_missing_settings()
+
             # Update settings using database values
             self.get_settings()
 
@@ -488,6 +2392,10 @@ class database:
             'CREATE TABLE IF NOT EXISTS \'settings\' (parameter STRING, value REAL)')
         self.cursor.execute(
             'CREATE TABLE IF NOT EXISTS \'default_settings\' (parameter STRING, value REAL)')
+        self.cursor.execute(
+            'CREATE TABLE IF NOT EXISTS \'firmware\' (parameter STRING, value REAL)')
+        self.cursor.execute(
+            'CREATE TABLE IF NOT EXISTS \'checkpoint\' (parameter STRING, value REAL)')
 
         # Create default settings values
         log.debug("Inserting default settings values...")
@@ -499,27 +2407,109 @@ class database:
         self.connection.commit()
         log.debug("Settings updated successfully")
 
-    def get_settings(self):
-        # Select and retrieve all settings
-        log.debug("Fetching settings from database...")
-        self.cursor.execute('SELECT * FROM \'settings\'')
-        self.settings = dict(self.cursor.fetchall())
+    def add_missing_settings(self):
+        # Tables added since the database was created
+        self.cursor.execute(
+            'CREATE TABLE IF NOT EXISTS \'firmware\' (parameter STRING, value REAL)')
+        self.cursor.execute(
+            'CREATE TABLE IF NOT EXISTS \'checkpoint\' (parameter STRING, value REAL)')
+
+        # Insert default values for settings added since the database was created
+        self.cursor.execute('SELECT parameter FROM \'settings\'')
+        existing = {row[0] for row in self.cursor.fetchall()}
+
+        missing = [(k, v) for k, v in self.settings_tuple if k not in existing]
 
-        self.cursor.execute('SELECT * FROM \'default_settings\'')
-        default_settings = dict(self.cursor.fetchall())
+        if missing:
+            log.info(f"Adding {len(missing)} new setting(s) to database...")
+            self.cursor.executemany(
+                'INSERT INTO \'settings\' VALUES(?, ?)', missing)
+            self.cursor.executemany(
+                'INSERT INTO \'default_settings\' VALUES(?, ?)', missing)
+            self.connection.commit()
 
-        return self.settings, default_settings
+    def get_settings(self):
+        # Select and retrieve all settings
+        with self.lock:
+            log.debug("Fetching settings from database...")
+            self.cursor.execute('SELECT * FROM \'settings\'')
+            self.settings = dict(self.cursor.fetchall())
+
+            self.cursor.execute('SELECT * FROM \'default_settings\'')
+            default_settings = dict(self.cursor.fetchall())
+
+            return self.settings, default_settings
+
+    def get_firmware(self):
+        # Settings last written to the printer's firmware, with their hash and grbl version
+        with self.lock:
+            self.cursor.execute('SELECT * FROM \'firmware\'')
+            return dict(self.cursor.fetchall())
+
+    def set_firmware(self, settings, digest, version):
+        with self.lock:
+            log.debug("Updating firmware settings snapshot...")
+            self.cursor.execute('DELETE FROM \'firmware\'')
+            self.cursor.executemany(
+                'INSERT INTO \'firmware\' VALUES(?, ?)',
+                list(settings.items()) + [("hash", digest), ("version", version)])
+            self.connection.commit()
+
+    def clear_firmware(self):
+        # Firmware settings changed outside rotaprint, check them on the next connection
+        with self.lock:
+            self.cursor.execute('DELETE FROM \'firmware\'')
+            self.connection.commit()
+
+    def get_checkpoint(self, printer):
+        # Progress of a printer's last interrupted print, empty if there is none.
+        # Parameters are prefixed with the printer's index, e.g. 0:line
+        prefix = f"{printer}:"
+        with self.checkpoint_lock:
+            cursor = self.connection.cursor()
+            cursor.execute('SELECT * FROM \'checkpoint\' WHERE parameter LIKE ?', (prefix + "%",))
+            return {k[len(prefix):]: v for k, v in cursor.fetchall()}
+
+    def set_checkpoint(self, printer, checkpoint):
+        # Written while streaming, so uses its own cursor
+        prefix = f"{printer}:"
+        with self.checkpoint_lock:
+            cursor = self.connection.cursor()
+            cursor.execute('DELETE FROM \'checkpoint\' WHERE parameter LIKE ?', (prefix + "%",))
+            cursor.executemany(
+                'INSERT INTO \'checkpoint\' VALUES(?, ?)',
+                [(prefix + k, v) for k, v in checkpoint.items()])
+            self.connection.commit()
+
+    def clear_checkpoint(self, printer):
+        self.set_checkpoint(printer, {})
 
     def set_settings(self, settings):
-        log.debug("Updating database settings...")
-        self.cursor.executemany(
-            'UPDATE \'settings\' SET value=? WHERE parameter=?', settings)
-        self.connection.commit()
-        log.debug("Database successfully updated")
+        with self.lock:
+            log.debug("Updating database settings...")
+            self.cursor.executemany(
+                'UPDATE \'settings\' SET value=? WHERE parameter=?', settings)
+            self.connection.commit()
+            log.debug("Database successfully updated")
 
 
 class websocket:
     # Class for interacting with front end GUI over websocket (to receive data)
+
+    # Commands which wait on grbl or take a long time. They are run on the printer's
+    # command executor, answered with a job handle at once and their response when done
+    background = {"PRN", "HME", "BTC", "GRB", "RCN", "LGT", "DBS", "EST", "GCD", "GCC", "GCE"}
+
+    # Number of job handles to keep for JOB requests
+    jobs_size = 100
+
+    # Largest message accepted / bytes. GCODE is uploaded in chunks of 1 MiB
+    max_size = 4194304
+
+    # Message formats offered to the GUI, most preferred first. MessagePack messages
+    # are binary and keep the payload's type, JSON messages carry it as a string
+    protocols = ["rotaprint.msgpack", "rotaprint.json"] if msgpack else ["rotaprint.json"]
+
     def connect(self):
         logging.info("Initialising websocket instance")
         # Create thread to run websocket.listen
@@ -534,48 +2524,137 @@ class websocket:
         # Zero connections to start with
         self.connected = 0
 
+        # Handles of long commands / {job: handle}, oldest first
+        self.jobs = collections.OrderedDict()
+        self.job_count = 0
+
         # Listen always for messages over websocket
         async def listener(websocket, path):
             self.connected += 1
 
+            # Status pushed to this client once it subscribes
+            client = subscription(websocket, self.loop)
+
             try:
                 while True:
                     # Listen for new messages
                     data = await websocket.recv()
+                    request = self.decode(data)
 
-                    # Send incoming messages to the handler, in parallel with main process
-                    response = self.handler(data)
-                    await websocket.send(response)
-                    # future = r.pool.submit(self.handler, data)
-                    # response = future.result()
-                    # await websocket.send(response)
+                    if request["command"].upper() in self.background:
+                        # Keep listening while long commands run in parallel
+                        handle = self.start_job(request)
+                        await websocket.send(self.payloader("JOB", handle, request.get("id"), client.binary))
+                        self.loop.create_task(self.run_job(client, request, handle))
+                    else:
+                        response = self.handler(request, client)
+                        await websocket.send(response)
             finally:
                 # Decriment connection counter when disconnected
                 self.connected -= 1
+                client.close()
 
-        asyncio.set_event_loop(asyncio.new_event_loop())
-        server = websockets.serve(listener, 'localhost', 8765, max_size=None)
-        log.warning(
-            "No file size limit set on websocket connection. This may cause issues when trying to upload large files.")
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        # Messages are compressed with permessage-deflate when the browser supports it
+        server = websockets.serve(listener, 'localhost', 8765, max_size=self.max_size,
+                                  compression="deflate", subprotocols=self.protocols)
 
         asyncio.get_event_loop().run_until_complete(server)
         asyncio.get_event_loop().run_forever()
 
-    def payloader(self, command, payload):
-        # Used to combine a command and payload into a single JSON style string
+    def start_job(self, request):
+        # Create a handle for a long command, reported to the client as it progresses
+        self.job_count += 1
+        command = request["command"].upper()
+        printer = printers.get(request.get("printer", 0))
+
+        # Prints go to an idle printer if the selected one is busy, and run on its executor
+        if command == "PRN":
+            printer = printers.route(printer) or printer
+            request["printer"] = printer.index
+
+        handle = {
+            "job": self.job_count,
+            "command": command,
+            "printer": printer.index,
+            "state": "queued",
+        }
+
+        self.jobs[handle["job"]] = handle
+        while len(self.jobs) > self.jobs_size:
+            self.jobs.popitem(last=False)
+
+        return handle
+
+    async def run_job(self, client, request, handle):
+        # Run a long command on its printer's command executor, then send its response
+        def run():
+            self.update_job(client, handle, "running")
+            return self.handler(request, client)
+
+        printer = printers.get(handle["printer"])
+        response = await self.loop.run_in_executor(printer.commands, run)
+
+        try:
+            await client.socket.send(response)
+        except websockets.ConnectionClosed:
+            pass
+
+        failed = self.decode(response)["payload"] == "ERROR"
+        self.update_job(client, handle, "error" if failed else "done")
+
+    def update_job(self, client, handle, state):
+        # Report a job's new state to the client which started it, from any thread
+        handle["state"] = state
+        message = self.payloader("JOB", handle, binary=client.binary)
+
+        async def send():
+            try:
+                await client.socket.send(message)
+            except websockets.ConnectionClosed:
+                pass
+
+        asyncio.run_coroutine_threadsafe(send(), self.loop)
+
+    def payloader(self, command, payload, request=None, binary=False):
+        # Used to combine a command and payload into a single message,
+        # responses carry the ID of the request they answer
         data = {
             "command": str(command),
-            "payload": str(payload)
+            "payload": payload
         }
 
+        if request is not None:
+            data["id"] = request
+
+        # MessagePack keeps the payload as it is
+        if binary:
+            return msgpack.packb(data, use_bin_type=True)
+
+        # JSON messages carry structured payloads as a JSON string
+        if not isinstance(payload, str):
+            data["payload"] = dumps(payload)
+
         # Convert to JSON string and return
         data = dumps(data)
         return data
 
-    def handler(self, data):
+    def decode(self, data):
+        # Separate a message into command and payload, binary messages are MessagePack
+        if isinstance(data, bytes):
+            return msgpack.unpackb(data, raw=False)
+
+        return loads(data)
+
+    def handler(self, data, client):
+        def structured(payload):
+            # Structured payloads arrive as a JSON string from JSON clients
+            return loads(payload) if isinstance(payload, str) else payload
+
         def print_settings(self, payload):
             try:
-                settings = loads(payload)
+                settings = structured(payload)
 
                 r.check_mode = settings["check_mode"]
                 r.scan_mode = settings["scan_mode"]
@@ -593,18 +2672,23 @@ class websocket:
         def database_set(self, payload):
             # Update a database setting
 
-            # Load JSON string input to Python list
-            settings = loads(payload)
+            # Setting names and their new values
+            settings = structured(payload)
 
             # Convert to (reversed) tuple for SQL query
             db_settings = [(v, k) for k, v in settings.items()]
             db.set_settings(db_settings)
 
-            if g.connected:
-                g.send_settings()
-            else:
-                log.error(
-                    "Not connected to printer - could not update settings. Restart rotaprint!")
+            # Log history length may have changed
+            logs.connect()
+
+            # Settings are shared by every printer in the fleet
+            for printer in printers:
+                if printer.g.connected:
+                    printer.g.send_settings()
+                else:
+                    log.error(
+                        f"{printer.name} not connected - could not update settings. Restart rotaprint!")
 
             return "DONE"
 
@@ -613,8 +2697,27 @@ class websocket:
             if g.connected:
                 try:
                     data = payload + "\n"
-                    g.s.write(data.encode())
-                    log.info(f"GRBL > {g.read()}")
+
+                    # Firmware settings written by hand no longer match the snapshot
+                    if payload.strip().startswith("$") and payload.find("=") >= 0:
+                        db.clear_firmware()
+                        g.firmware_verified = False
+
+                    # Responses would be taken as acknowledgements by a print in progress
+                    with g.exchange_lock:
+                        if g.streaming:
+                            log.error("Cannot send manual commands while printing")
+                            return "ERROR"
+
+                        g.write(data.encode())
+
+                        # Read every response up to the command's ok or error
+                        while True:
+                            out = g.read()
+                            log.info(f"GRBL > {out}")
+                            if not out or out.find("ok") >= 0 or out.find("error") >= 0:
+                                break
+
                     return "DONE"
                 except:
                     r.except_logger()
@@ -626,161 +2729,614 @@ class websocket:
 
         def receive_gcode(self, payload):
             # Receive gcode, and load into global variable
-            gc.gcode = [line.strip() for line in payload.splitlines()
-                        if not line.startswith('#')]
+            program = upload(len(payload))
+            program.write(payload)
+            gc.load(program)
+
+            return "DONE"
+
+        def upload_begin(self, payload):
+            # Start a chunked gcode upload, payload contains the file size
+            if client.upload is not None:
+                log.warning("Discarding incomplete GCODE upload")
+                client.upload.remove()
+
+            size = int(structured(payload)["size"])
+            log.info(f"Receiving GCODE ({size} bytes)...")
+
+            client.upload = upload(size)
+
+            return "DONE"
+
+        def upload_chunk(self, payload):
+            # Parse the next chunk of a gcode upload, and return progress
+            if client.upload is None:
+                log.error("GCODE chunk received without an upload in progress")
+                return "ERROR"
+
+            progress = client.upload.write(payload)
+
+            return str(round(progress, 1))
+
+        def upload_commit(self, payload):
+            # Finish a chunked gcode upload and load it as the current program
+            if client.upload is None:
+                log.error("GCODE commit received without an upload in progress")
+                return "ERROR"
+
+            program, client.upload = client.upload, None
+            gc.load(program)
+
+            log.info(f"Received {program.lines} lines of GCODE")
 
             return "DONE"
 
         def print_now(self, payload):
             # Send all supplied GCODE to printer
-            if gc.gcode == "":
+            if gc.toolpath is None:
                 log.error("No GCODE supplied; cannot print")
                 return "ERROR"
             else:
-                log.info("Sending gcode to printer...")
+                # The job was routed to an idle printer when it was queued
+                if printers.busy(r):
+                    log.error("All printers are busy; cannot print")
+                    return "ERROR"
+
+                log.info(f"Sending gcode to {r.name}...")
 
-                # r.pool.submit(r.print_sequence())
-                thread = threading.Thread(target=r.print_sequence())
-                thread.start()
-                # r.print_sequence()
+                # Runs on the command executor, the print continues in the pool once started
+                r.print_sequence()
                 return "DONE"
 
+        def resume_print(self, payload):
+            # Continue an interrupted print from its last checkpoint
+            if not db.get_checkpoint(r.index):
+                log.error("No interrupted print to resume")
+                return "ERROR"
+
+            r.pool.submit(r.resume)
+            return "DONE"
+
+        def estimate_time(self, payload):
+            # Predict print time for the uploaded GCODE with the supplied print settings
+            if gc.toolpath is None:
+                log.error("No GCODE supplied; cannot estimate print time")
+                return "ERROR"
+
+            settings = structured(payload)
+            radius = float(settings["radius"])
+            batch = int(settings["batch"])
+
+            times = gc.estimate(radius)
+            part_time = float(times[-1]) if len(times) else 0
+
+            log.info(f"Predicted print time: {r.format_time(part_time)} per part, "
+                     f"{r.format_time(part_time * batch)} for {batch} part(s)")
+
+            return {
+                "part": part_time,
+                "batch": part_time * batch,
+                "lines": len(times),
+            }
+
         def home(self, payload):
             g.home()
             return "DONE"
 
         def fetch_settings(self, payload):
-            # Return all database settings in JSON format
+            # Return current and default database settings
             log.debug("Retrieving database settings")
             current_settings, default_settings = db.get_settings()
-            return dumps(current_settings) + "~<>~" + dumps(default_settings)
+            return [current_settings, default_settings]
 
         def fetch_value(self, payload):
             # Get current value of variable
             variable = {
-                "grbl": g.connected,
-                "websocket": w.connected,
+                "grbl": str(g.connected),
+                "websocket": str(w.connected),
+                "boot": r.subsystems,
+                "printers": printers.summary(),
             }
-            return self.payloader(payload, str(variable[payload]))
+            return {"command": payload, "payload": variable[payload]}
+
+        def reconnect_printer(self, payload):
+            # Reconnect to printer incase of issue
+            g.reconnect()
+            return "DONE"
+
+        def return_logs(self, payload):
+            # Return log records this client has not seen yet, payload is an optional minimum level
+            level = logs.parse_level(payload) if payload else client.log_level
+            new_logs, client.log_cursor = logs.since(client.log_cursor, level)
+
+            return new_logs
+
+        def reset_logs_counter(self, payload):
+            client.log_cursor = 0
+
+            return "DONE"
+
+        def subscribe_logs(self, payload):
+            # Push new log records to this client, payload is an optional minimum level.
+            # Records still in the log store are sent again with the new level
+            client.subscribe_logs(logs.parse_level(payload) if payload else logging.DEBUG)
+
+            return "DONE"
+
+        def get_current_status(self, payload):
+            status = dict(r.status)
+            status.update(g.telemetry.display())
+
+            return status
+
+        def job_state(self, payload):
+            # Current state of a long command, payload is its job handle number
+            handle = self.jobs.get(int(payload))
+            if handle is None:
+                return "ERROR"
+
+            return handle
+
+        def camera_preview(self, payload):
+            # Push live camera frames to this client, payload is the frame rate or 0 to stop.
+            # The rate is capped by the preview_rate setting
+            if r.v.camera is None:
+                return "NONE"
+
+            rate = db.settings["preview_rate"]
+            if payload:
+                rate = min(float(payload), rate)
+
+            client.subscribe_preview(r.v.camera, rate)
+
+            return "DONE"
+
+        def subscribe_status(self, payload):
+            # Push status changes to this client, payload is the shortest time between updates / ms
+            interval = float(payload) if payload else db.settings["polling_interval"]
+            client.subscribe(r, interval / 1000)
+
+            return "DONE"
+
+        def get_telemetry(self, payload):
+            # Recent status reports for plotting, payload is the number of reports or empty for all
+            count = int(payload) if payload else None
+            return g.telemetry.columns(count)
+
+        def toggle_lighting(self, payload):
+            g.toggle_lighting()
+
+            return "DONE"
+
+        def change_batch(self, payload):
+            payload = int(payload)
+            if payload in range(5):
+                g.change_batch(payload, True)
+            elif payload == -1:
+                g.send(["G0A0"], True)
+            else:
+                return "ERROR"
+
+            return "DONE"
+
+        def feed_hold(self, payload):
+            g.realtime("hold")
+            return "DONE"
+
+        def feed_release(self, payload):
+            g.realtime("resume")
+            return "DONE"
+
+        def feed_override(self, payload):
+            # Change feed rate of the running job, payload is "+10", "-10", "+1", "-1" or "100"
+            if "feed " + payload not in g.realtime_commands:
+                return "ERROR"
+
+            g.realtime("feed " + payload)
+            return "DONE"
+
+        def rapid_override(self, payload):
+            # Change rapid rate of the running job, payload is "100", "50" or "25"
+            if "rapid " + payload not in g.realtime_commands:
+                return "ERROR"
+
+            g.realtime("rapid " + payload)
+            return "DONE"
+
+        def quality_control_override(self, payload):
+            log.warning("Quality control check overridden!")
+            r.qc_override = True
+            r.batch_new_part
+            return "DONE"
+
+        switcher = {
+            "SET": print_settings,
+            "DBS": database_set,
+            "GRB": send_manual,
+            "GCD": receive_gcode,
+            "GCB": upload_begin,
+            "GCC": upload_chunk,
+            "GCE": upload_commit,
+            "PRN": print_now,
+            "RSM": resume_print,
+            "EST": estimate_time,
+            "HME": home,
+            "FTS": fetch_settings,
+            "RQV": fetch_value,
+            "RCN": reconnect_printer,
+            "LOG": return_logs,
+            "LGS": subscribe_logs,
+            "RLC": reset_logs_counter,
+            "GCS": get_current_status,
+            "SUB": subscribe_status,
+            "CAM": camera_preview,
+            "JOB": job_state,
+            "TEL": get_telemetry,
+            "LGT": toggle_lighting,
+            "BTC": change_batch,
+            "FHD": feed_hold,
+            "FRL": feed_release,
+            "FOV": feed_override,
+            "ROV": rapid_override,
+            "QCO": quality_control_override,
+        }
+
+        command = data["command"].upper()
+        payload = data["payload"]
+
+        # Commands act on the printer selected in the GUI, the first printer by default
+        r = printers.get(data.get("printer", 0))
+        g = r.g
+
+        if not (command == "LOG" or command == "GCS" or command == "GCC" or command == "TEL"):
+            if len(str(payload)) < 50:
+                log.debug(f'WSKT > {command} \"{payload}\"')
+            else:
+                log.debug(f'WSKT > {command} (long payload)')
+
+        # Call respective command using switcher
+        try:
+            response = switcher[command](self, payload)
+        except:
+            r.except_logger()
+            response = "ERROR"
+
+        if not (command == "LOG" or command == "GCS" or command == "GCC" or command == "TEL"):
+            if len(str(response)) < 50:
+                log.debug(f'WSKT < {command} \"{response}\"')
+            else:
+                log.debug(f'WSKT < {command} (long payload)')
+
+        return self.payloader(command, response, data.get("id"), client.binary)
+
+
+class subscription:
+    """
+    Status and log records pushed to one websocket client.
+
+    A message is sent as soon as grbl reports a change or a record is
+    logged, holding only the status fields which changed and the records
+    logged since the last message, and then nothing more for interval
+    seconds so fast changes are coalesced. The first status message after
+    subscribing holds every field. Runs on the websocket event loop.
+    """
+
+    # Seconds between checks for changes grbl does not report, such as the print timer
+    idle_interval = 1
+
+    def __init__(self, socket, loop):
+        self.socket = socket
+        self.loop = loop
+
+        # Whether the client chose MessagePack messages
+        self.binary = socket.subprotocol == "rotaprint.msgpack"
+
+        # Printer followed, and the seconds between messages
+        self.printer = None
+        self.interval = 0.1
+
+        # Fields as last sent to the client
+        self.sent = {}
+
+        # Number of the last log record sent, and the lowest level sent.
+        # Records are only pushed once subscribed to
+        self.log_cursor = 0
+        self.log_level = logging.DEBUG
+        self.log_subscribed = False
+
+        self.wake = asyncio.Event()
+        self.task = None
+
+        # Live camera frames, sent by their own task
+        self.preview = None
+
+        # Chunked gcode upload in progress
+        self.upload = None
+
+    def subscribe(self, printer, interval):
+        # Follow a printer, from any thread
+        self.loop.call_soon_threadsafe(self.start, printer, interval)
+
+    def subscribe_logs(self, level):
+        # Follow the log from the oldest record kept, from any thread
+        self.loop.call_soon_threadsafe(self.start_logs, level)
+
+    def subscribe_preview(self, camera, rate):
+        # Follow a camera at up to rate frames per second, from any thread
+        self.loop.call_soon_threadsafe(self.start_preview, camera, rate)
+
+    def start(self, printer, interval):
+        if self.printer is not None:
+            self.printer.g.unsubscribe(self.notify)
+
+        self.printer = printer
+        self.interval = interval
+        self.sent = {}
+
+        printer.g.subscribe(self.notify)
+        self.run_task()
+
+    def start_logs(self, level):
+        if not self.log_subscribed:
+            logs.subscribe(self.notify)
+
+        self.log_subscribed = True
+        self.log_level = level
+        self.log_cursor = 0
+        self.run_task()
+
+    def start_preview(self, camera, rate):
+        if self.preview is not None:
+            self.preview.cancel()
+            self.preview = None
+
+        if rate > 0:
+            self.preview = self.loop.create_task(self.run_preview(camera, 1 / rate))
+
+    def run_task(self):
+        if self.task is None:
+            self.task = self.loop.create_task(self.run())
+
+        self.wake.set()
+
+    def notify(self, kind, output):
+        # Called by the grbl reader thread for every status report, alarm and message,
+        # and by the log store for every record. The task reads everything new once woken,
+        # so there is no need to wake it again before it has run
+        if not self.wake.is_set():
+            self.loop.call_soon_threadsafe(self.wake.set)
+
+    def changes(self):
+        # Fields which differ from those last sent
+        status = dict(self.printer.status)
+        status.update(self.printer.g.telemetry.display())
+
+        changed = {k: v for k, v in status.items() if k not in self.sent or self.sent[k] != v}
+        self.sent.update(changed)
+
+        return changed
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.wake.wait(), self.idle_interval)
+            except asyncio.TimeoutError:
+                pass
+
+            self.wake.clear()
+            sent = False
+
+            try:
+                if self.printer is not None:
+                    changed = self.changes()
+                    if changed:
+                        await self.socket.send(w.payloader("SUB", changed, binary=self.binary))
+                        sent = True
+
+                if self.log_subscribed:
+                    records, self.log_cursor = logs.since(self.log_cursor, self.log_level)
+                    if records:
+                        await self.socket.send(w.payloader("LOG", records, binary=self.binary))
+                        sent = True
+            except websockets.ConnectionClosed:
+                # The client has gone, the listener closes this subscription
+                return
+
+            if sent:
+                await asyncio.sleep(self.interval)
+
+    async def run_preview(self, camera, interval):
+        # JPEG encoding runs in the event loop's own executor, so status and logs are
+        # not held up and prints never wait for a free thread
+        number = 0
+        while True:
+            number, picture = await self.loop.run_in_executor(
+                None, camera.jpeg, number, db.settings["preview_quality"])
+
+            if picture is not None:
+                # JSON messages cannot carry bytes
+                if not self.binary:
+                    picture = base64.b64encode(picture).decode()
+
+                try:
+                    await self.socket.send(w.payloader("CAM", picture, binary=self.binary))
+                except websockets.ConnectionClosed:
+                    return
+
+            await asyncio.sleep(interval)
+
+    def close(self):
+        if self.printer is not None:
+            self.printer.g.unsubscribe(self.notify)
+
+        logs.unsubscribe(self.notify)
+
+        if self.task is not None:
+            self.task.cancel()
+
+        if self.preview is not None:
+            self.preview.cancel()
+
+        if self.upload is not None:
+            log.warning("Discarding incomplete GCODE upload")
+            self.upload.remove()
+
+
+class camera:
+    """
+    Frame broker for one capture device.
+
+    A reader thread owns the device and keeps only its newest frame, so the
+    alignment and quality scans and any number of live previews share it
+    without competing for reads, and frames are never stale in the driver's
+    buffer. Frames are handed out by reference, numbered in capture order,
+    and are read only. A preview JPEG is encoded at most once per frame,
+    however many clients are watching.
+
+    The source is a device index, or the path of a video file for testing
+    without a camera. Video files play at their own frame rate, looped.
+    """
+
+    # Longest wait for a new frame / s
+    timeout = 5
+
+    def __init__(self, source):
+        try:
+            source = int(float(source))
+        except ValueError:
+            pass
 
-        def reconnect_printer(self, payload):
-            # Reconnect to printer incase of issue
-            g.reconnect()
-            return "DONE"
+        self.source = source
+        self.file = isinstance(source, str)
 
-        def return_logs(self, payload):
-            # Return current log data to frontend
-            log_contents = logs.getvalue()
+        # Newest frame and its number, 0 before the first frame
+        self.frame = None
+        self.number = 0
+        self.condition = threading.Condition()
+        self.running = False
 
-            new_logs = log_contents[r.log_history:]
+        # Newest preview / (frame number, JPEG)
+        self.preview = (0, None)
+        self.preview_lock = threading.Lock()
 
-            r.log_history += len(new_logs)
+    def open(self):
+        self.capture = cv2.VideoCapture(self.source)
+        if not self.capture.isOpened():
+            return False
 
-            return new_logs
+        # Video files are read in real time, cameras as fast as they deliver frames
+        rate = self.capture.get(cv2.CAP_PROP_FPS) if self.file else 0
+        self.period = 1 / rate if rate > 0 else 0
 
-        def reset_logs_counter(self, payload):
-            r.log_history = 0
+        self.running = True
+        reader = threading.Thread(target=self.read, daemon=True)
+        reader.start()
 
-            return "DONE"
+        return True
 
-        def get_current_status(self, payload):
-            data = dumps(r.status)
+    def read(self):
+        while self.running:
+            start = time.perf_counter()
+            ok, frame = self.capture.read()
 
-            return data
+            if not ok:
+                if self.file and self.number:
+                    # Loop video files
+                    self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                    continue
 
-        def toggle_lighting(self, payload):
-            g.toggle_lighting()
+                log.error(f"Could not read from video device {self.source}, vision system stopped")
+                break
 
-            return "DONE"
+            # Shared with every consumer
+            frame.flags.writeable = False
 
-        def change_batch(self, payload):
-            payload = int(payload)
-            if payload in range(5):
-                g.change_batch(payload, True)
-            elif payload == -1:
-                g.send(["G0A0"], True)
-            else:
-                return "ERROR"
+            with self.condition:
+                self.frame = frame
+                self.number += 1
+                self.condition.notify_all()
 
-            return "DONE"
+            if self.period:
+                time.sleep(max(0, self.period - (time.perf_counter() - start)))
 
-        def feed_hold(self, payload):
-            g.s.write("!".encode())
-            return "DONE"
+        # Released here so a read in progress is never interrupted
+        self.capture.release()
 
-        def feed_release(self, payload):
-            g.s.write("~".encode())
-            return "DONE"
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
 
-        def quality_control_override(self, payload):
-            log.warning("Quality control check overridden!")
-            r.qc_override = True
-            r.batch_new_part
-            return "DONE"
+    def latest(self):
+        # Newest frame and its number
+        with self.condition:
+            return self.number, self.frame
 
-        switcher = {
-            "SET": print_settings,
-            "DBS": database_set,
-            "GRB": send_manual,
-            "GCD": receive_gcode,
-            "PRN": print_now,
-            "HME": home,
-            "FTS": fetch_settings,
-            "RQV": fetch_value,
-            "RCN": reconnect_printer,
-            "LOG": return_logs,
-            "RLC": reset_logs_counter,
-            "GCS": get_current_status,
-            "LGT": toggle_lighting,
-            "BTC": change_batch,
-            "FHD": feed_hold,
-            "FRL": feed_release,
-            "QCO": quality_control_override,
-        }
+    def next(self, after=None):
+        # First frame captured after frame number `after`, by default after this call.
+        # The frame is None if there is none within the timeout
+        with self.condition:
+            if after is None:
+                after = self.number
 
-        # Separate JSON string into command and payload
-        data = loads(data)
-        command = data["command"].upper()
-        payload = data["payload"]
+            self.condition.wait_for(lambda: self.number > after or not self.running, self.timeout)
 
-        if not (command == "LOG" or command == "GCS"):
-            if len(payload) < 50:
-                log.debug(f'WSKT > {command} \"{payload}\"')
-            else:
-                log.debug(f'WSKT > {command} (long payload)')
+            if self.number > after:
+                return self.number, self.frame
 
-        # Call respective command using switcher
-        try:
-            response = switcher[command](self, payload)
-        except:
-            r.except_logger()
-            response = "ERROR"
+            return after, None
 
-        if not (command == "LOG" or command == "GCS"):
-            if len(response) < 50:
-                log.debug(f'WSKT < {command} \"{response}\"')
-            else:
-                log.debug(f'WSKT < {command} (long payload)')
+    def jpeg(self, after, quality):
+        # JPEG of the first frame captured after frame number `after`
+        number, frame = self.next(after)
+        if frame is None:
+            return number, None
+
+        with self.preview_lock:
+            if self.preview[0] < number:
+                _, picture = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, int(quality)])
+                self.preview = (number, picture.tobytes())
+
+            return self.preview
 
-        return self.payloader(command, response)
+    def close(self):
+        # The reader thread stops and releases the device
+        self.running = False
 
 
 class vision:
+    def __init__(self, printer=None):
+        # Printer the camera is mounted on
+        self.r = printer if printer is not None else r
+
+        # Frame broker for the camera, shared with live previews
+        self.camera = None
+
     def connect(self):
         log.debug("Activating the desired camera...")
-        self.cap = cv2.VideoCapture(int(db.settings["video_device"]))
+        device = fleet.setting("video_device", self.r.index)
+        if device is None:
+            log.warning(f"No video device set for {self.r.name}, vision system disabled")
+            return False
+
+        if self.camera is not None:
+            self.camera.close()
+
+        self.camera = camera(device)
 
         # Check if camera opened successfully
-        if (self.cap.isOpened() == False):
+        if not self.camera.open():
+            self.camera = None
             log.error(
                 "Error opening video stream! Attempted use of vision system will fail!")
+            return False
         else:
             log.info("Camera connected!")
+            return True
 
     def take_picture(self):
-        # Return a single frame in variable `picture_data`
-        # picture_data is an image array vector
-        _, picture_data = self.cap.read()
+        # Return the first frame captured after this call in variable `picture_data`
+        # picture_data is a read only image array vector
+        _, picture_data = self.camera.next()
 
         return picture_data
 
@@ -789,7 +3345,7 @@ class vision:
 
         # Turn on lighting
         log.debug("Turning lights on")
-        g.toggle_lighting(True)
+        self.r.g.toggle_lighting(True)
 
         log.info(f"Taking {n} picture(s) of the current part...")
 
@@ -802,7 +3358,7 @@ class vision:
         angle_step = 360 / n
 
         # Go to start rotation angle
-        g.send(["G0Y0"], settings_mode=True)
+        self.r.g.send(["G0Y0"], settings_mode=True)
 
         y_acceleration = db.settings["$121"]  # Acceleration in deg / s^2
         y_max_speed = db.settings["$111"] / 60  # Max speed in deg / s
@@ -844,13 +3400,13 @@ class vision:
             gcode = "G0Y" + str(angle)
 
             # Send command to firmware
-            g.send([gcode], settings_mode=True)
+            self.r.g.send([gcode], settings_mode=True)
 
             # Wait for machine to reach position
             time.sleep(delay)
 
             # Extract data from image taken
-            picture_data = take_picture()
+            picture_data = self.take_picture()
 
             # Record data in a list
             pictures_list.append(picture_data)
@@ -859,7 +3415,7 @@ class vision:
 
         # Turn off lighting
         log.debug("Turning lights off")
-        g.toggle_lighting(False)
+        self.r.g.toggle_lighting(False)
 
         return pictures_list
 
@@ -951,6 +3507,269 @@ class vision:
         return offset, max_score
 
 
+class streamer:
+    """
+    Character-counting streamer for grbl.
+
+    Blocks are written whenever they fit in grbl's serial RX buffer, counting
+    the bytes of every block which has not been acknowledged yet, so the
+    buffer (and so the planner) is kept full without overflowing.
+
+    With planner feedback, the Bf: field of status reports is used to measure
+    the RX buffer size, which may be much larger than 128 bytes on other
+    firmware, and to count planner underruns.
+    """
+
+    def __init__(self, machine, rx_buffer_size=128, feedback=False, trace=False):
+        self.machine = machine
+        self.rx_buffer_size = rx_buffer_size
+        self.feedback = feedback
+
+        # Log every block and its response, only worth the cost when debugging a print
+        self.trace = trace
+
+        # Sizes of blocks sent but not acknowledged, oldest first, and their total
+        self.pending = collections.deque()
+        self.filled = 0
+
+        self.sent = 0
+        self.acknowledged = 0
+        self.errors = 0
+
+        # Blocks sent before the program, which are not counted as acknowledged lines
+        self.preamble = 0
+
+        # Planner blocks when empty, and reports of an empty planner while streaming
+        self.planner_size = 0
+        self.underruns = 0
+
+        if feedback:
+            self.measure()
+
+    def measure(self):
+        # Request a status report before streaming, when the RX buffer is empty
+        self.machine.buffer_state = None
+
+        if self.machine.query_status() and self.machine.buffer_state is not None:
+            self.observe(*self.machine.buffer_state)
+
+        if self.machine.buffer_state is None:
+            log.warning("Status reports do not include buffer state, enable it with $10. "
+                        f"Using a {self.rx_buffer_size} byte RX buffer")
+            self.feedback = False
+        else:
+            log.info(f"grbl buffers: {self.planner_size} planner blocks, "
+                     f"{self.rx_buffer_size} byte RX buffer")
+
+            # Follow status reports while streaming
+            self.machine.subscribe(self.report)
+
+    def observe(self, planner, rx):
+        # Update buffer sizes from a status report
+        self.planner_size = max(self.planner_size, planner)
+
+        # grbl reports one byte less than its RX buffer size when empty. Reports
+        # are older than the last acknowledgement, so while blocks are pending
+        # they only show the buffer is at least this large.
+        if self.pending:
+            self.rx_buffer_size = max(self.rx_buffer_size, rx + 1)
+        else:
+            self.rx_buffer_size = rx + 1
+
+        if self.sent and planner == self.planner_size:
+            self.underruns += 1
+
+    def report(self, kind, output):
+        # Called by the grbl reader thread for every status report, alarm and message
+        if kind == "status" and self.machine.buffer_state is not None:
+            self.observe(*self.machine.buffer_state)
+
+    def receive(self):
+        # Read one response from grbl, acknowledging the oldest block on ok or error. Waits
+        # are short so an alarm or disconnect is noticed without a response arriving
+        out = self.machine.read(1)
+
+        if out.find('ok') < 0 and out.find('error') < 0:
+            if out:
+                log.debug(f"GRBL > {out}")
+
+            return out
+
+        if out.find('error') >= 0:
+            self.errors += 1
+
+        if self.pending:
+            self.filled -= self.pending.popleft()
+
+        if self.preamble:
+            self.preamble -= 1
+            log.debug(f"GRBL > {out}")
+            return out
+
+        self.acknowledged += 1
+        self.machine.r.acknowledged = self.acknowledged
+
+        if self.trace:
+            log.debug(f"GRBL > {str(self.acknowledged)}: {out}")
+
+        return out
+
+    def send(self, block):
+        # Write a block once it fits in the RX buffer, reading any responses first
+        size = len(block)
+
+        while self.pending and (self.filled + size >= self.rx_buffer_size or
+                                not self.machine.responses.empty()):
+            if self.stopped():
+                return
+            self.receive()
+
+        self.machine.write(block)
+
+        self.pending.append(size)
+        self.filled += size
+        self.sent += 1
+
+    def finish(self):
+        # Wait until all responses have been received
+        while self.pending and not self.stopped():
+            self.receive()
+
+    def stopped(self):
+        # grbl discards buffered blocks on an alarm, and nothing more arrives once disconnected
+        return self.machine.alarm or not self.machine.connected
+
+    def close(self):
+        # Stop following status reports
+        self.machine.unsubscribe(self.report)
+
+
+class telemetry:
+    """
+    Recent grbl status reports, kept as typed records in a fixed size ring
+    buffer so feed rate and planner use can be plotted. Fields missing from a
+    report are NaN or -1, apart from WCO and Ov which grbl only sends every few
+    reports, and are carried forward.
+    """
+
+    # Machine axes, and grbl states and input pins in the order they are stored
+    axis_names = "XYZAB"
+    states = ["Idle", "Run", "Hold", "Jog", "Alarm", "Door", "Check", "Home", "Sleep"]
+    pins = "XYZABPDHRS"
+
+    dtype = np.dtype([
+        ("time", np.float64),
+        ("state", np.uint8),            # Index into states, 255 if unknown
+        ("substate", np.int8),          # Hold and Door reason, -1 if none
+        ("mpos", np.float64, 5),        # Machine position
+        ("wco", np.float64, 5),         # Work coordinate offset
+        ("feed", np.float32),
+        ("spindle", np.float32),
+        ("planner", np.int16),          # Planner blocks available
+        ("rx", np.int16),               # RX buffer bytes available
+        ("line", np.int32),
+        ("ov", np.uint8, 3),            # Feed, rapid and spindle override, %
+        ("pins", np.uint16),            # Mask of input pins, in pins order
+    ])
+
+    def __init__(self, size=1024):
+        self.records = np.zeros(size, self.dtype)
+        self.count = 0
+        self.lock = threading.Lock()
+
+        self.wco = [0.0] * 5
+        self.ov = [100, 100, 100]
+
+    @classmethod
+    def axes(cls, value):
+        # Axis values of a report field, padded to every machine axis with NaN
+        values = [float(v) for v in value.split(",")]
+        return (values + [math.nan] * 5)[:5]
+
+    @classmethod
+    def pin_mask(cls, value):
+        mask = 0
+        for pin in value:
+            i = cls.pins.find(pin)
+            if i >= 0:
+                mask |= 1 << i
+        return mask
+
+    def add(self, state, mpos, wpos, wco, feed, spindle, planner, rx, line, ov, pins):
+        # Add a parsed status report, overwriting the oldest once full
+        name, _, substate = state.partition(":")
+        index = self.states.index(name) if name in self.states else 255
+
+        if wco is not None:
+            self.wco = wco
+        if ov is not None:
+            self.ov = ov
+
+        # Reports contain either machine or work position, depending on $10
+        if mpos is None:
+            mpos = [w + o for w, o in zip(wpos, self.wco)] if wpos is not None else [math.nan] * 5
+
+        record = (time.time(), index, int(substate) if substate else -1, mpos, self.wco,
+                  feed, spindle, planner, rx, line, self.ov, pins)
+
+        with self.lock:
+            self.records[self.count % len(self.records)] = record
+            self.count += 1
+
+    def history(self, count=None):
+        # Copy of the last count records, oldest first
+        with self.lock:
+            size = len(self.records)
+            available = min(self.count, size)
+            count = available if count is None else min(count, available)
+
+            end = self.count % size
+            index = np.arange(end - count, end) % size
+            return self.records[index]
+
+    def latest(self):
+        records = self.history(1)
+        return records[0] if len(records) else None
+
+    def display(self):
+        # Status fields formatted for the GUI, from the latest report
+        record = self.latest()
+        if record is None:
+            return {}
+
+        status = {
+            "grbl_feed_override": f"{record['ov'][0]}%",
+            "grbl_rapid_override": f"{record['ov'][1]}%",
+        }
+
+        for axis, position in zip("xyz", record["mpos"]):
+            status["grbl_" + axis] = "<b>{}</b>{:.2f}".format(axis.upper(), position)
+
+        return status
+
+    def columns(self, count=None):
+        # History as lists of plain values, with missing values as None
+        records = self.history(count)
+
+        def values(column):
+            return [None if v != v else v for v in column.tolist()]
+
+        data = {
+            "time": records["time"].tolist(),
+            "state": [self.states[i] if i < len(self.states) else "" for i in records["state"]],
+            "feed": values(records["feed"]),
+            "spindle": values(records["spindle"]),
+            "planner": records["planner"].tolist(),
+            "rx": records["rx"].tolist(),
+            "line": records["line"].tolist(),
+        }
+
+        for i, axis in enumerate(self.axis_names.lower()):
+            data[axis] = values(records["mpos"][:, i])
+
+        return data
+
+
 class grbl:
     """
     Object for control and configuration of grbl firmware and connection.
@@ -966,22 +3785,87 @@ class grbl:
     # Connected flag
     connected = False
 
+    # Seconds to wait for the startup banner or a status report after opening the port,
+    # the Arduino bootloader takes up to 2 s. Then, if grbl does not answer $I either,
+    # soft reset up to reset_attempts times.
+    startup_timeout = 2.5
+    reset_timeout = 1
+    reset_attempts = 3
+
+    # Startup banner, e.g. Grbl 1.1h ['$' for help]
+    banner = ""
+
+    # Set by an alarm, prints stop until the machine is homed or reconnected
+    alarm = False
+
+    # Firmware settings are known to match the database snapshot on this connection
+    firmware_verified = False
+    firmware_version = None
+
     # Lighting toggle
     lighting = False
 
-    def __init__(self):
-        # Get GRBL settings
-        self.settings, _ = db.get_settings()
-        self.port = self.settings["port"]
-        self.settings = {x: self.settings[x]
-                         for x in self.settings if x.find("$") >= 0}
+    # Serial baud rate
+    baud_rate = 115200
+
+    # Planner blocks and RX buffer bytes available, from the last status report
+    buffer_state = None
+
+    # Real-time commands, acted on by grbl as soon as they are received
+    realtime_commands = {
+        "status": b"?",
+        "hold": b"!",
+        "resume": b"~",
+        "reset": b"\x18",
+        "feed 100": b"\x90",
+        "feed +10": b"\x91",
+        "feed -10": b"\x92",
+        "feed +1": b"\x93",
+        "feed -1": b"\x94",
+        "rapid 100": b"\x95",
+        "rapid 50": b"\x96",
+        "rapid 25": b"\x97",
+    }
+
+    def __init__(self, printer=None):
+        # Print state and status of the printer this connection drives
+        self.r = printer if printer is not None else r
+
+        # Serial port, the first port in the settings unless set by the fleet
+        self.port = None
+
+        # Responses to commands, in order, filled by the reader thread
+        self.responses = queue.Queue()
+
+        # Callbacks for status reports, alarms and messages
+        self.subscribers = []
+
+        # Recent status reports
+        self.telemetry = telemetry()
+
+        # Set by the startup banner and by status reports while connecting
+        self.started = threading.Event()
+        self.running = threading.Event()
+
+        # Held for every write, so blocks from different threads are never interleaved
+        self.port_lock = threading.Lock()
+
+        # Held for each call-response exchange, so only one command waits on the responses
+        # at a time. Exchanges are refused while a program streams, since the streamer takes
+        # every response as the acknowledgement of one of its blocks
+        self.exchange_lock = threading.Lock()
+        self.streaming = False
+
+        # Number of status reports parsed, notified on every report
+        self.status_count = 0
+        self.status_received = threading.Condition()
 
     def reconnect(self):
         log.debug("Reconnecting to printer...")
 
         try:
-            self.s.close()
             self.connected = False
+            self.s.close()
         except:
             r.except_logger()
             log.warning("Could not disconnect")
@@ -990,23 +3874,36 @@ class grbl:
     def connect(self):
         log.info("Connecting to printer...")
         try:
-            # Connect to serial
-            log.debug(f"Connecting on port {self.port}...")
-            self.s = serial.Serial(self.port, 115200, timeout=10)
+            # Connect to serial, on the port currently in the settings
+            db.get_settings()
+            port = self.port or fleet.setting("port", 0)
+            log.debug(f"Connecting {self.r.name} on port {port}...")
+            self.s = serial.Serial(port, self.baud_rate, timeout=10)
 
             log.info("Connection success!")
 
-            # Wake up grbl
-            log.debug("GRBL < \"\\r\\n\\r\\n\"")
-            self.s.write("\r\n\r\n".encode())
+            # Start reading, all responses from this port go through the reader thread
+            self.responses = queue.Queue()
+            self.started.clear()
+            self.running.clear()
+            self.subscribe(self.handshake)
+            readerThread = threading.Thread(target=self.reader, args=(self.s,))
+            readerThread.daemon = True
+            readerThread.start()
 
-            time.sleep(2)  # Wait for grbl to initialize
+            try:
+                ready = self.wait_ready()
+            finally:
+                self.unsubscribe(self.handshake)
 
-            for i in range(3):
-                log.debug(self.read())
+            if not ready:
+                log.error("No startup message from grbl, check the port and restart the printer")
+                return False
 
-            self.s.flushInput()  # Flush startup text in serial input
+            self.flush()  # Flush startup responses
             self.connected = True
+            self.firmware_verified = False
+            self.alarm = False
 
             self.send_settings()
 
@@ -1014,11 +3911,123 @@ class grbl:
             log.error("Unable to connect to printer!")
             r.except_logger()
 
+        return self.connected
+
+    def handshake(self, kind, output):
+        # Watch for the startup banner, or a status report from a controller already running
+        if kind == "message" and output.startswith("Grbl "):
+            self.banner = output
+            self.started.set()
+        elif kind == "status":
+            self.running.set()
+
+    def wait_ready(self):
+        # Wait until grbl has started. A controller which is already running is left as
+        # it is, so a held job and the machine position are kept, and is only soft reset
+        # if it does not answer
+        start = time.perf_counter()
+
+        # Boards reset by opening the port print the banner once booted, while one
+        # already running answers a status query straight away
+        self.realtime("status")
+
+        deadline = start + self.startup_timeout
+        while not self.started.is_set() and not self.running.is_set() and time.perf_counter() < deadline:
+            self.started.wait(0.01)
+
+        if not self.started.is_set():
+            # Already running, or silent to status queries, identify it by its version instead
+            version, _ = self.build_info()
+            if version is not None:
+                self.banner = f"Grbl {version} (already running)"
+                self.started.set()
+
+        for attempt in range(self.reset_attempts):
+            if self.started.is_set():
+                break
+
+            log.debug(f"Soft resetting grbl, attempt {attempt + 1}...")
+            self.realtime("reset")
+            self.started.wait(self.reset_timeout)
+
+        if not self.started.is_set():
+            return False
+
+        log.info(f"grbl ready in {time.perf_counter() - start:.2f} s: {self.banner}")
+        return True
+
     def send_settings(self):
         log.info("Checking if firmware settings need updating...")
 
+        # Get required settings from Database
+        self.settings, _ = db.get_settings()
+
+        # Convert received settings to directionary
+        self.settings = {x: self.settings[x]
+                         for x in self.settings if x.find("$") >= 0}
+
+        digest = self.settings_digest(self.settings)
+
+        # Settings last written to the firmware, tagged with their hash in grbl's build info
+        snapshot = db.get_firmware()
+        current_settings = {x: snapshot[x] for x in snapshot if x.find("$") >= 0}
+        force_settings = False
+
+        # Hash in grbl's build info, as last written by rotaprint unless read below
+        info = snapshot.get("hash")
+
+        if not self.firmware_verified:
+            version, info = self.build_info()
+
+            if info is not None and info == snapshot.get("hash") and version == snapshot.get("version"):
+                log.info("Firmware settings match the last known snapshot")
+            else:
+                log.info("Firmware settings unknown, reading all settings...")
+                current_settings, force_settings = self.read_settings()
+
+            self.firmware_version = version
+            self.firmware_verified = True
+
+        send_settings = list()
+
+        # Iterate through received data and find outdated settings
+        for key in self.settings:
+            if self.settings[key] != current_settings.get(key):
+                log.debug(f"Out of date setting: {key}")
+                send_settings.append(
+                    key + "=" + str(self.settings[key]))
+            else:
+                log.debug(f"Up to date setting: {key}")
+
+        # Send new settings if required
+        if len(send_settings) > 0 or force_settings:
+            log.info(f"{len(send_settings)} setting(s) need updating!")
+            log.info("Sending updated settings...")
+            errors = self.send(send_settings + ["$I=" + digest], True)
+
+            if errors:
+                # Check everything again next time
+                log.warning("Not all settings were accepted by the firmware")
+                self.firmware_verified = False
+                return
+
+            db.set_firmware(self.settings, digest, self.firmware_version)
+        else:
+            log.info("No settings need updating")
+
+            # Tag the firmware and keep a snapshot, so the next connection skips $$
+            if info != digest and self.send(["$I=" + digest], True):
+                log.warning("Could not tag the firmware settings")
+                self.firmware_verified = False
+                return
+
+            if snapshot.get("hash") != digest or snapshot.get("version") != self.firmware_version:
+                db.set_firmware(self.settings, digest, self.firmware_version)
+
+    def read_settings(self):
+        # Read all current settings with $$, returns them and whether all settings must be sent
         log.debug("GRBL <* $$")
-        self.s.write("$$\n".encode())
+        self.write("$$\n".encode())
 
         # # In testing, GRBL would often take several lines to start responding,
         # # this should flush that so program will not hang
@@ -1080,36 +4089,40 @@ class grbl:
                 log.info("All settings will be forced instead")
                 force_settings = True
 
-        send_settings = list()
+        return current_settings, force_settings
 
-        # Get required settings from Database
-        self.settings, _ = db.get_settings()
+    def settings_digest(self, settings):
+        # Short hash identifying a set of firmware settings
+        text = ",".join(f"{x}={float(settings[x]):g}" for x in sorted(settings))
+        # Upper case, since grbl converts everything it receives
+        return hashlib.sha1(text.encode()).hexdigest()[:16].upper()
 
-        # Convert received settings to directionary
-        self.settings = {x: self.settings[x]
-                         for x in self.settings if x.find("$") >= 0}
+    def build_info(self):
+        # grbl version and build info string, from [VER:1.1h.20190825:info]
+        log.debug("GRBL <* $I")
+        self.write("$I\n".encode())
 
-        # Iterate through received data and find outdated settings
-        for key in self.settings:
-            if self.settings[key] != current_settings.get(key):
-                log.debug(f"Out of date setting: {key}")
-                send_settings.append(
-                    key + "=" + str(self.settings[key]))
-            else:
-                log.debug(f"Up to date setting: {key}")
+        version, info = None, None
+        for i in range(5):
+            out = self.read(2)
+            log.debug(f"GRBL > {out}")
 
-        # Send new settings if required
-        if len(send_settings) > 0 or force_settings:
-            log.info(f"{len(send_settings)} setting(s) need updating!")
-            log.info("Sending updated settings...")
-            self.send(send_settings, True)
-        else:
-            log.info("No settings need updating")
+            match = re.match("^\\[VER:([^:]*):(.*)\\]$", out)
+            if match:
+                version, info = match.groups()
+            elif out.find('ok') >= 0 or out.find('error') >= 0 or not out:
+                break
+
+        return version, info
 
     def home(self):
         # Built-in GRBL homing functionality
         log.info("Homing machine...")
-        self.send(["$H"], True)
+        if not self.send(["$H"], True):
+            self.alarm = False
+
+            # Clear any Y re-homing left by an interrupted rotary print
+            self.send(["G92.1"], True)
 
     def toggle_lighting(self, manual=None):
         # Turn lights and laser on or off
@@ -1152,8 +4165,8 @@ class grbl:
         # Setup offset value
         command = "G10 L2 P1 Y" + str(offset)
 
-        # Send command to grbl
-        self.send([command], True)
+        # Send command to grbl, clearing any Y re-homing left by the last part
+        self.send(["G92.1", command], True)
 
     def send_status_query(self):
         # Built in GRBL status report, in format:
@@ -1162,7 +4175,7 @@ class grbl:
         # log.debug("Sending status query...")
         # log.debug("GRBL < ?")
         try:
-            self.s.write('?\n'.encode())
+            self.realtime("status")
         except:
             r.except_logger()
 
@@ -1194,8 +4207,6 @@ class grbl:
         else:
             log.info("Check mode disabled!")
 
-        log.info(self.read())
-
         # while True:
         #     out = self.s.readline().strip()  # Wait for grbl response with carriage return
         #     if out.find('error') >= 0:
@@ -1206,32 +4217,150 @@ class grbl:
         #     elif out.find('ok') >= 0:
         #         log.debug(f'GRBL > {out}')
 
-    def read(self):
-        output = self.s.readline().strip().decode()
+    def reader(self, port):
+        # Read every line from grbl, until the port is closed or replaced by a reconnect
+        while port is self.s:
+            try:
+                output = port.readline().strip().decode(errors="replace")
+            except:
+                if port is self.s and self.connected:
+                    r.except_logger()
+                    log.error("Lost connection to printer")
+                    self.connected = False
+                break
+
+            if output:
+                self.route(output)
 
-        # Contains status report
-        if re.search("^<[\\w\\W]+?>$", output):
-            # Current grbl operation
-            r.status["grbl_operation"] = re.findall(
-                "<([\\w\\W]+?)\\|", output)[0]
+        log.debug("Serial reader stopped")
+
+    def route(self, output):
+        # Lockout message warning
+        if "$X" in output or "error:9" in output:
+            self.r.status["grbl_lockout"] = 1
+
+        if output[0] == "<" and output[-1] == ">":
+            # Status report
+            self.parse_status(output)
+            kind = "status"
+        elif output.startswith("ALARM"):
+            log.error(f"GRBL > {output}")
+            self.alarm = True
+            kind = "alarm"
+        elif output.startswith("[MSG:") or output.startswith("Grbl "):
+            # Feedback messages and the startup banner are not responses to a command
+            log.info(f"GRBL > {output}")
+            kind = "message"
+        else:
+            # ok, error and anything printed by a command, such as $$
+            self.responses.put(output)
+            return
 
-            # Current grbl position
-            MPos = re.findall("MPos:([\\w\\W]+?)\\|", output)
-            MPos = MPos[0].split(",")
+        for subscriber in list(self.subscribers):
+            try:
+                subscriber(kind, output)
+            except:
+                r.except_logger()
 
-            r.status["grbl_x"] = "<b>X</b>{:.2f}".format(float(MPos[0]))
-            r.status["grbl_y"] = "<b>Y</b>{:.2f}".format(float(MPos[1]))
-            r.status["grbl_z"] = "<b>Z</b>{:.2f}".format(float(MPos[2]))
+    def parse_status(self, output):
+        # Single pass over a grbl 1.1 status report, <State|Field:values|...>
+        fields = output[1:-1].split("|")
+        mpos = wpos = wco = ov = None
+        feed = spindle = math.nan
+        planner = rx = line = -1
+        pins = 0
+
+        for field in fields[1:]:
+            key, _, value = field.partition(":")
+
+            if key == "MPos":
+                mpos = telemetry.axes(value)
+            elif key == "WPos":
+                wpos = telemetry.axes(value)
+            elif key == "WCO":
+                wco = telemetry.axes(value)
+            elif key == "FS" or key == "F":
+                values = value.split(",")
+                feed = float(values[0])
+                spindle = float(values[1]) if len(values) > 1 else math.nan
+            elif key == "Bf":
+                planner, rx = map(int, value.split(","))
+            elif key == "Ln":
+                line = int(value)
+            elif key == "Ov":
+                ov = [int(v) for v in value.split(",")]
+            elif key == "Pn":
+                pins = telemetry.pin_mask(value)
+
+        # Current grbl operation
+        self.r.status["grbl_operation"] = fields[0]
+
+        # Planner blocks and RX buffer bytes available, if enabled by $10
+        if planner >= 0:
+            self.buffer_state = (planner, rx)
+
+        self.telemetry.add(fields[0], mpos, wpos, wco, feed, spindle, planner, rx, line, ov, pins)
+
+        with self.status_received:
+            self.status_count += 1
+            self.status_received.notify_all()
+
+    def subscribe(self, callback):
+        # Call callback(kind, line) for every status report, alarm and message
+        self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self.subscribers:
+            self.subscribers.remove(callback)
+
+    def query_status(self, timeout=1):
+        # Request a status report and wait until it has been parsed, False on timeout
+        with self.status_received:
+            count = self.status_count
+            self.send_status_query()
+            return self.status_received.wait_for(lambda: self.status_count > count, timeout)
+
+    def read(self, timeout=10):
+        # Next response to a command, "" if none arrives within timeout
+        try:
+            return self.responses.get(timeout=timeout)
+        except queue.Empty:
+            return ""
+
+    def flush(self):
+        # Discard responses which are not waited for
+        while not self.responses.empty():
+            log.debug(f"GRBL > {self.responses.get()}")
+
+    def write(self, data):
+        # Write bytes to grbl. On POSIX the port is written directly, so views
+        # into a compiled job are sent without being copied.
+        with self.port_lock:
+            fd = getattr(self.s, "fd", None)
+            if fd is None:
+                self.s.write(data)
+                return
+
+            view = memoryview(data)
+            while len(view):
+                try:
+                    written = os.write(fd, view)
+                except BlockingIOError:
+                    # Port is non-blocking, wait until it can be written again
+                    select.select([], [fd], [], self.s.write_timeout)
+                    continue
 
-            return "REMOVE"
+                view = view[written:]
 
-        # Lockout message warning
-        if re.search("\$X", output) or re.search("error:9", output):
-            r.status["grbl_lockout"] = 1
+    def realtime(self, command):
+        # Send a real-time command. These are not buffered by grbl and are never
+        # acknowledged, so they only wait for the block currently being written.
+        if command != "status":
+            log.debug(f"GRBL <! {command}")
 
-        return output
+        self.write(self.realtime_commands[command])
 
-    def send(self, data, settings_mode=False, batch=False):
+    def send(self, data, settings_mode=False, batch=False, start=0):
         def _sender(self, **args):
             l_count = 0
             error_count = 0
@@ -1241,105 +4370,113 @@ class grbl:
                 # Send settings file via simple call-response streaming method. Settings must be streamed
                 # in this manner since the EEPROM accessing cycles shut-off the serial interrupt.
 
-                self.is_run = True
+                with self.exchange_lock:
+                    if self.streaming:
+                        log.error("Cannot send commands while a program is streaming")
+                        return len(data)
 
-                for line in data:
-                    l_count += 1  # Iterate the line counter
-                    l_block = line.strip()  # Strip all EOL characters for consistency
+                    self.is_run = True
 
-                    # Asterisk indicates code is sent using settings mode
-                    log.debug(f"GRBL <* {str(l_count)}: {l_block}")
+                    for line in data:
+                        l_count += 1  # Iterate the line counter
+                        l_block = line.strip()  # Strip all EOL characters for consistency
 
-                    # Send g-code block to grbl
-                    self.s.write((l_block + '\n').encode())
+                        # Asterisk indicates code is sent using settings mode
+                        log.debug(f"GRBL <* {str(l_count)}: {l_block}")
 
-                    while True:
-                        # Wait for grbl response with carriage return
-                        out = self.read()
+                        # Send g-code block to grbl
+                        self.write((l_block + '\n').encode())
 
-                        if out.find('ok') >= 0:
-                            log.debug(f"GRBL > {str(l_count)}: {out}")
-                            break
-                        elif out.find('error') >= 0:
-                            log.warning(f"GRBL > {str(l_count)}: {out}")
-                            error_count += 1
-                            break
-                        elif out.find('ALARM') >= 0:
-                            log.error(f"GRBL > {str(l_count)}: {out}")
-                        else:
-                            if out.find('REMOVE') < 0:
+                        while True:
+                            # Wait for grbl response with carriage return
+                            out = self.read()
+
+                            if out.find('ok') >= 0:
+                                log.debug(f"GRBL > {str(l_count)}: {out}")
+                                break
+                            elif out.find('error') >= 0:
+                                log.warning(f"GRBL > {str(l_count)}: {out}")
+                                error_count += 1
+                                break
+                            elif out:
                                 log.debug(f"GRBL > {out}")
 
             else:
                 # Send g-code program via a more agressive streaming protocol that forces characters into
                 # Grbl's serial read buffer to ensure Grbl has immediate access to the next g-code command
-                # rather than wait for the call-response serial protocol to finish. This is done by careful
-                # counting of the number of characters sent by the streamer to Grbl and tracking Grbl's
-                # responses, such that we never overflow Grbl's serial read buffer.
+                # rather than wait for the call-response serial protocol to finish.
                 log.debug("Stream mode")
                 self.is_run = True
-                g_count = 0
-                c_line = []
-                rx_buffer_size = 128
                 gcode_length = len(data)
 
-                for line in data:
-                    l_count += 1  # Iterate line counter
-
-                    # Calculate percentage complete
-                    r.status["print_progress"] = (g_count / gcode_length) * 100
-
-                    # Estimate time remaining
-                    r.remaining = ((r.batch - 1 - r.batch_current) +
-                                   (gcode_length - g_count) / gcode_length) / r.batch
+                # Blocks are only decoded and logged with the serial trace setting, as the
+                # logger is always at DEBUG level for the GUI
+                trace = bool(db.settings["serial_trace"])
+                sender = streamer(self, db.settings["rx_buffer_size"],
+                                  bool(db.settings["planner_feedback"]), trace)
 
-                    # Strip comments/spaces/new line and capitalize
-                    l_block = re.sub(r'\s|\(.*?\)', '', line).upper()
-
-                    # Track number of characters in grbl serial read buffer
-                    c_line.append(len(l_block) + 1)
-                    out = ''
+                # Compiled jobs and streams give blocks ready to send, anything else is encoded per line
+                if isinstance(data, (job, stream)):
+                    blocks = iter(data)
+                else:
+                    blocks = (job.encode(line) for line in data)
 
-                    while sum(c_line) >= rx_buffer_size - 1 | self.s.inWaiting():
-                        out_temp = self.read()  # Wait for grbl response
+                if start:
+                    # Resuming, restore the state left by the lines already printed first
+                    preamble = gc.preamble(itertools.islice(blocks, start), self.r.radius)
+                    log.info(f"Resuming from line {start}: {' '.join(preamble)}")
 
-                        if out_temp.find('ok') < 0 and out_temp.find('error') < 0:
-                            if out_temp.find('REMOVE') < 0:
-                                # Debug response
-                                log.debug(f"GRBL > {out_temp}")
-                        else:
-                            if out_temp.find('error') >= 0:
-                                error_count += 1
+                    blocks = itertools.chain((job.encode(line) for line in preamble), blocks)
+                    sender.acknowledged = start
+                    sender.preamble = len(preamble)
+                    l_count = max(0, start - len(preamble))
 
-                            g_count += 1  # Iterate g-code counter
-                            log.debug(f"GRBL > {str(g_count)}: {out_temp}")
+                checkpoint_time = time.time()
+                interrupted = False
 
-                            # Delete the block character count corresponding to the last 'ok'
-                            del c_line[0]
+                # Wait for any exchange in progress, then refuse new ones until the stream ends
+                with self.exchange_lock:
+                    self.streaming = True
 
-                    data_to_send = l_block + '\n'
+                try:
+                    for l_block in blocks:
+                        if self.alarm or not self.connected:
+                            interrupted = True
+                            break
 
-                    # Send g-code block to grbl
-                    self.s.write(data_to_send.encode())
+                        l_count += 1  # Iterate line counter
 
-                    log.debug(f"GRBL < {str(l_count)}: {l_block}")
+                        # Calculate percentage complete
+                        self.r.status["print_progress"] = (sender.acknowledged / gcode_length) * 100
 
-                # Wait until all responses have been received.
-                while l_count > g_count:
-                    out_temp = self.read()  # Wait for grbl response
+                        sender.send(l_block)
 
-                    if out_temp.find('ok') < 0 and out_temp.find('error') < 0:
-                        if out_temp.find('REMOVE') < 0:
-                            log.debug(f"GRBL > {out_temp}")  # Debug response
-                    else:
-                        if out_temp.find('error') >= 0:
-                            error_count += 1
+                        if trace:
+                            log.debug(f"GRBL < {str(l_count)}: {str(l_block, 'ascii').strip()}")
 
-                        g_count += 1  # Iterate g-code counter
-                        log.debug(f"GRBL > {str(g_count)}: {out_temp}")
+                        if batch and time.time() >= checkpoint_time:
+                            self.r.checkpoint(sender.acknowledged)
+                            checkpoint_time = time.time() + self.r.checkpoint_interval
 
-                        # Delete the block character count corresponding to the last 'ok'
-                        del c_line[0]
+                    if not interrupted:
+                        sender.finish()
+                except:
+                    r.except_logger()
+                    interrupted = True
+                finally:
+                    sender.close()
+                    self.streaming = False
+                error_count = sender.errors
+
+                if interrupted or self.alarm or not self.connected:
+                    log.error(f"Print stopped at line {sender.acknowledged}. Clear the alarm "
+                              "or reconnect, then resume with RSM")
+                    self.is_run = False
+                    self.r.active = False
+                    return error_count
+
+                if sender.feedback:
+                    log.info(f"Planner ran empty in {sender.underruns} status report(s)")
 
             end_time = time.time()
             log.info(f"Time elapsed: {str(end_time-start_time)}")
@@ -1356,15 +4493,17 @@ class grbl:
 
             # Request next batch if required
             if batch:
-                r.batch_current += 1
-                r.batch_new_part()
+                self.r.batch_current += 1
+                self.r.batch_new_part()
+
+            return error_count
 
         # Submit task to pool
         if batch:
-            r.pool.submit(_sender, self, data=data,
+            self.r.pool.submit(_sender, self, data=data,
                           settings_mode=settings_mode, batch=batch)
         else:
-            _sender(self, data=data, settings_mode=settings_mode)
+            return _sender(self, data=data, settings_mode=settings_mode)
 
 
 if __name__ == "__main__":
@@ -1375,27 +4514,23 @@ if __name__ == "__main__":
     # Setup logging
     log, logs = r.setup_log()
 
-    # Connect backend database
+    # Create subsystems, these are connected below
     db = database()
-    db.connect()
-
-    # Connect gcode class
     gc = gcode()
-
-    # Start GUI websocket
     w = websocket()
-    w.connect()
-
-    # Start webserver
-    webserver().start()
-
-    # Connect grbl
-    g = grbl()  # GRBL object
-    g.connect()  # Serial connection
-
-    # Connect vision class
-    v = vision()
-    v.connect()
-
-    # Set up monitoring thread
-    g.monitor()
+    g = grbl(r)
+    v = vision(r)
+    r.g, r.v = g, v
+
+    # Printers after the first are added once the port setting is read
+    printers = fleet(r)
+
+    # Start everything once the database is connected, the GUI is usable while
+    # the printers and cameras connect in parallel
+    r.boot({
+        "database": (db.connect, []),
+        "websocket": (w.connect, ["database"]),
+        "logs": (logs.connect, ["database"]),
+        "webserver": (webserver().start, []),
+        "printers": (printers.connect, ["database"]),
+    })
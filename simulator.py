@@ -0,0 +1,527 @@
+#!/usr/bin/env python
+"""
+Copyright (c) 2020
+This file is part of the rotaprint project.
+
+GRBL 1.1 simulator for rotaprint, on a pseudo-terminal so it can be used in
+place of the printer's serial port. Run with `python simulator.py` and set
+the printed port in rotaprint's settings.
+
+Unauthorized copying of this file, via any medium is strictly prohibited
+Proprietary and confidential
+"""
+
+import os
+import pty
+import tty
+import re
+import sys
+import time
+import math
+import select
+import threading
+import collections
+
+
+class simulator:
+    """
+    Simulated grbl controller.
+
+    Bytes written to the port arrive at the baud rate into an RX buffer of
+    rx_buffer_size bytes, and are dropped and counted if it is full. Lines are
+    parsed one at a time, taking parse_time each, and motion is added to a
+    planner of planner_size blocks. A line is acknowledged once it has been
+    planned, so a full planner holds up the RX buffer as it does on grbl.
+
+    Blocks run at their programmed rate, limited by the $11x max rates, and
+    accelerate at the $12x rates from the speed of the previous block, or from
+    rest if the planner ran empty. Motion runs time_scale times faster than
+    real time.
+    """
+
+    banner = "Grbl 1.1h ['$' for help]"
+    version = "[VER:1.1h.20190825:]"
+
+    # Machine axes, in the order of the $10x-$13x settings
+    axes = "XYZAB"
+
+    # Defaults for the 5 axis rotaprint firmware, the same as rotaprint's database defaults
+    defaults = {
+        "$0": 10, "$1": 255, "$2": 0, "$3": 0, "$4": 0, "$5": 0, "$6": 0,
+        "$10": 1, "$11": 0.010, "$12": 0.002, "$13": 0,
+        "$20": 0, "$21": 0, "$22": 1, "$23": 0, "$24": 25, "$25": 500, "$26": 25, "$27": 1,
+        "$30": 1000, "$31": 0, "$32": 1, "$33": 0,
+        "$100": 250, "$101": 250, "$102": 250, "$103": 250, "$104": 250,
+        "$110": 500, "$111": 500, "$112": 500, "$113": 500, "$114": 500,
+        "$120": 10, "$121": 10, "$122": 10, "$123": 10, "$124": 10,
+        "$130": 200, "$131": 720, "$132": 200, "$133": 200, "$134": 360,
+    }
+
+    # Supported G and M codes
+    g_codes = {"0", "1", "2", "3", "4", "10", "17", "20", "21", "28", "30", "53", "54",
+               "55", "56", "57", "58", "59", "90", "91", "92", "92.1", "93", "94"}
+    m_codes = {"0", "1", "2", "3", "4", "5", "7", "8", "9", "30"}
+
+    def __init__(self, settings=None, baud_rate=115200, rx_buffer_size=128, planner_size=15,
+                 parse_time=0.0005, time_scale=1):
+        self.settings = dict(self.defaults)
+        self.settings.update(settings or {})
+        self.build_info = ""
+
+        self.baud_rate = baud_rate
+        self.rx_buffer_size = rx_buffer_size
+        self.planner_size = planner_size
+        self.parse_time = parse_time
+        self.time_scale = time_scale
+
+        # Keep the slave open as well, so the master never reads EIO between connections
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.master)
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+
+        # Machine position is kept through soft resets
+        self.position = [0.0] * len(self.axes)
+
+        self.running = False
+        self.reset()
+        self.reset_stats()
+
+    def reset(self):
+        # Power on or soft reset state
+        self.wire = bytearray()     # Bytes sent by the host, not yet arrived
+        self.wire_time = 0          # Time the next byte on the wire arrives
+        self.rx = bytearray()       # grbl's serial RX buffer
+        self.parse_ready = 0        # Time the parser finishes the last line
+
+        self.planner = collections.deque()
+        self.block = None           # Block being executed, and when it started and ends
+        self.block_start = 0
+        self.block_end = 0
+        self.idle_since = None      # Time the planner ran empty while streaming
+        self.exit_speed = 0
+
+        self.hold = False
+        self.hold_remaining = 0
+        self.check = False
+        self.feed_override = 100
+        self.rapid_override = 100
+        self.reports = 0
+
+        # Modal state, positions are machine coordinates
+        self.motion = "0"
+        self.relative = False
+        self.feed = 0
+        self.planned = list(self.position)
+        self.wcs_offset = [0.0] * len(self.axes)
+        self.g92_offset = [0.0] * len(self.axes)
+
+    def reset_stats(self):
+        self.stats = {
+            "lines": 0,         # Lines parsed
+            "bytes": 0,         # Bytes arrived, excluding real-time commands
+            "overflow": 0,      # Bytes dropped because the RX buffer was full
+            "blocks": 0,        # Motion blocks executed
+            "motion_time": 0,   # Time spent moving, in real seconds
+            "starved": 0,       # Time the planner was empty between blocks
+            "errors": 0,
+        }
+
+        # Starvation is only counted between blocks of the same run
+        self.idle_since = None
+
+    def start(self):
+        self.running = True
+        self.respond(self.banner)
+
+        thread = threading.Thread(target=self.run)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.running = False
+
+    def run(self):
+        while self.running:
+            readable, _, _ = select.select([self.master], [], [], 0.0002)
+            now = time.perf_counter()
+
+            if readable:
+                if not self.wire:
+                    self.wire_time = now
+                self.wire += os.read(self.master, 4096)
+
+            self.receive(now)
+            self.execute(now)
+            self.parse(now)
+
+    def respond(self, line):
+        os.write(self.master, (line + "\r\n").encode())
+
+    def receive(self, now):
+        # Move bytes which have arrived at the baud rate from the wire into the RX buffer
+        byte_time = 10 / self.baud_rate
+        if not self.wire or self.wire_time > now:
+            return
+
+        count = min(len(self.wire), int((now - self.wire_time) / byte_time) + 1)
+        arrived = self.wire[:count]
+        del self.wire[:count]
+        self.wire_time += count * byte_time
+
+        for c in arrived:
+            if c in b"?!~\x18" or c >= 0x80:
+                self.realtime(c, now)
+            elif len(self.rx) >= self.rx_buffer_size - 1:
+                self.stats["overflow"] += 1
+            else:
+                self.rx.append(c)
+                self.stats["bytes"] += 1
+
+    def realtime(self, c, now):
+        # Real-time commands act immediately, and are never buffered or acknowledged
+        if c == ord("?"):
+            self.respond(self.status(now))
+        elif c == ord("!") and not self.hold:
+            self.hold = True
+            self.hold_remaining = max(self.block_end - now, 0)
+        elif c == ord("~") and self.hold:
+            self.hold = False
+            self.block_end = now + self.hold_remaining
+        elif c == 0x18:
+            self.reset()
+            self.respond(self.banner)
+        elif c == 0x90:
+            self.feed_override = 100
+        elif c in (0x91, 0x92, 0x93, 0x94):
+            step = {0x91: 10, 0x92: -10, 0x93: 1, 0x94: -1}[c]
+            self.feed_override = min(max(self.feed_override + step, 10), 200)
+        elif c in (0x95, 0x96, 0x97):
+            self.rapid_override = {0x95: 100, 0x96: 50, 0x97: 25}[c]
+
+    def status(self, now):
+        # Status report in the format set by $10
+        if self.check:
+            state = "Check"
+        elif self.hold:
+            state = "Hold:0"
+        elif self.block is not None or self.planner:
+            state = "Run"
+        else:
+            state = "Idle"
+
+        # Interpolate position through the current block
+        position = self.position
+        if self.block is not None and not self.hold:
+            start, end = self.block["start"], self.block["end"]
+            duration = self.block_end - self.block_start
+            t = min(max((now - self.block_start) / duration, 0), 1) if duration > 0 else 1
+            position = [a + (b - a) * t for a, b in zip(start, end)]
+
+        mask = int(self.settings["$10"])
+        if mask & 1:
+            fields = ["MPos:" + ",".join(f"{p:.3f}" for p in position)]
+        else:
+            offset = [a + b for a, b in zip(self.wcs_offset, self.g92_offset)]
+            fields = ["WPos:" + ",".join(f"{p - o:.3f}" for p, o in zip(position, offset))]
+
+        if mask & 2:
+            free_planner = self.planner_size - len(self.planner) - (self.block is not None)
+            fields.append(f"Bf:{free_planner},{self.rx_buffer_size - 1 - len(self.rx)}")
+
+        speed = self.block["speed"] * 60 if self.block is not None and not self.hold else 0
+        fields.append(f"FS:{speed:.0f},0")
+
+        # Overrides are included every 10 reports
+        if self.reports % 10 == 0:
+            fields.append(f"Ov:{self.feed_override},{self.rapid_override},100")
+        self.reports += 1
+
+        return "<" + "|".join([state] + fields) + ">"
+
+    def execute(self, now):
+        # Run planned blocks in real time
+        if self.hold:
+            return
+
+        while self.block is not None and now >= self.block_end:
+            self.position = self.block["end"]
+            self.exit_speed = self.block["speed"]
+            self.stats["blocks"] += 1
+            self.stats["motion_time"] += self.block_end - self.block_start
+
+            finished = self.block_end
+            self.block = None
+
+            if self.planner:
+                self.start_block(finished)
+            else:
+                self.idle_since = finished
+                self.exit_speed = 0
+
+        if self.block is None and self.planner:
+            if self.idle_since is not None:
+                self.stats["starved"] += now - self.idle_since
+                self.idle_since = None
+            self.start_block(now)
+
+    def start_block(self, start):
+        self.block = self.planner.popleft()
+        self.block_start = start
+        self.block_end = start + self.duration(self.block) / self.time_scale
+
+    def duration(self, block):
+        # Time to run a block, accelerating from the previous block's speed
+        if block["dwell"] is not None:
+            return block["dwell"]
+
+        override = self.rapid_override if block["rapid"] else self.feed_override
+        speed = block["speed"] * override / 100
+        acceleration = block["acceleration"]
+        distance = block["distance"]
+
+        entry = min(self.exit_speed, speed)
+        ramp = (speed ** 2 - entry ** 2) / (2 * acceleration)
+        block["speed"] = speed
+
+        if ramp >= distance:
+            # Still accelerating at the end of the block
+            peak = math.sqrt(entry ** 2 + 2 * acceleration * distance)
+            block["speed"] = peak
+            return (peak - entry) / acceleration
+
+        return (speed - entry) / acceleration + (distance - ramp) / speed
+
+    def parse(self, now):
+        # Parse the next complete line once the last has finished and there is room to plan it
+        if now < self.parse_ready:
+            return
+
+        # The block being executed takes a planner slot too
+        if len(self.planner) + (self.block is not None) >= self.planner_size:
+            return
+
+        end = self.rx.find(b"\n")
+        if end < 0:
+            return
+
+        line = self.rx[:end].decode(errors="replace").strip()
+        del self.rx[:end + 1]
+
+        self.parse_ready = now + self.parse_time
+        self.stats["lines"] += 1
+
+        responses = self.system(line) if line.startswith("$") else self.gcode(line)
+        for response in responses:
+            if response.startswith("error"):
+                self.stats["errors"] += 1
+            self.respond(response)
+
+    def system(self, line):
+        # $ commands
+        command = line[1:].upper()
+
+        if command == "$":
+            lines = []
+            for key in sorted(self.settings, key=lambda k: int(k[1:])):
+                value = float(self.settings[key])
+                lines.append(f"{key}={value:.0f}" if value.is_integer() else f"{key}={value:.3f}")
+            return lines + ["ok"]
+
+        if command == "C":
+            self.check = not self.check
+            if self.check:
+                return ["[MSG:Enabled]", "ok"]
+
+            # Leaving check mode resets grbl
+            self.reset()
+            return ["[MSG:Disabled]", "ok", self.banner]
+
+        if command == "X":
+            return ["[MSG:Caution: Unlocked]", "ok"]
+
+        if command == "H":
+            self.position = [0.0] * len(self.axes)
+            self.planned = list(self.position)
+            return ["ok"]
+
+        if command == "I":
+            return [self.version[:-1] + self.build_info + "]",
+                    f"[OPT:V,{self.planner_size},{self.rx_buffer_size}]", "ok"]
+
+        if command.startswith("I="):
+            self.build_info = command[2:]
+            return ["ok"]
+
+        if command in ("RST=*", "RST=$"):
+            # Restore default settings, a full restore clears the build info too
+            self.settings = dict(self.defaults)
+            if command == "RST=*":
+                self.build_info = ""
+            return ["ok"]
+
+        if command == "G":
+            distance = "91" if self.relative else "90"
+            return [f"[GC:G{self.motion} G54 G17 G21 G{distance} G94 M5 M9 T0 F{self.feed:g} S0]", "ok"]
+
+        if command == "N":
+            return ["$N0=", "$N1=", "ok"]
+
+        match = re.match("^(\\d+)=([-+]?[0-9]*\\.?[0-9]+)$", command)
+        if match:
+            key = "$" + match.group(1)
+            if key not in self.settings:
+                return ["error:3"]
+
+            self.settings[key] = float(match.group(2))
+            return ["ok"]
+
+        return ["error:3"]
+
+    def gcode(self, line):
+        # G-code blocks, motion is added to the planner
+        line = re.sub("\\(.*?\\)|;.*$", "", line).upper().replace(" ", "")
+        if not line:
+            return ["ok"]
+
+        words = re.findall("([A-Z])([-+]?(?:[0-9]+\\.?[0-9]*|\\.[0-9]+))", line)
+        if "".join(letter + value for letter, value in words) != line:
+            return ["error:1"]
+
+        if any(letter not in "GMFNPLSTIJKR" + self.axes for letter, value in words):
+            return ["error:20"]
+
+        codes = [value for letter, value in words if letter == "G"]
+        values = {letter: float(value) for letter, value in words if letter != "G"}
+
+        for code in codes:
+            code = code.lstrip("0") or "0"
+            if code not in self.g_codes:
+                return ["error:20"]
+        codes = {code.lstrip("0") or "0" for code in codes}
+
+        if "M" in values and f"{values['M']:g}" not in self.m_codes:
+            return ["error:20"]
+
+        if "F" in values:
+            self.feed = values["F"]
+        if "90" in codes:
+            self.relative = False
+        if "91" in codes:
+            self.relative = True
+
+        axes = {axis: values[axis] for axis in self.axes if axis in values}
+
+        # Coordinate offsets
+        if "10" in codes:
+            if values.get("L") == 20:
+                for axis, value in axes.items():
+                    i = self.axes.index(axis)
+                    self.wcs_offset[i] = self.planned[i] - self.g92_offset[i] - value
+            elif values.get("L") == 2:
+                for axis, value in axes.items():
+                    self.wcs_offset[self.axes.index(axis)] = value
+            return ["ok"]
+
+        if "92.1" in codes:
+            self.g92_offset = [0.0] * len(self.axes)
+            return ["ok"]
+
+        if "92" in codes:
+            for axis, value in axes.items():
+                i = self.axes.index(axis)
+                self.g92_offset[i] = self.planned[i] - self.wcs_offset[i] - value
+            return ["ok"]
+
+        if "4" in codes:
+            self.plan(dict(dwell=values.get("P", 0), start=self.planned, end=self.planned,
+                           speed=0, rapid=False))
+            return ["ok"]
+
+        for code in ("0", "1", "2", "3"):
+            if code in codes:
+                self.motion = code
+
+        if not axes:
+            return ["ok"]
+
+        # Target in machine coordinates
+        target = list(self.planned)
+        for axis, value in axes.items():
+            i = self.axes.index(axis)
+            offset = self.wcs_offset[i] + self.g92_offset[i]
+            target[i] = target[i] + value if self.relative else value + offset
+
+        if self.motion != "0" and self.feed <= 0:
+            return ["error:22"]
+
+        block = self.motion_block(self.planned, target, values)
+        if block is None:
+            return ["error:33"]
+
+        self.planned = target
+        if block["distance"] > 0:
+            self.plan(block)
+
+        return ["ok"]
+
+    def motion_block(self, start, end, values):
+        # Distance, and speed and acceleration limited by every moving axis
+        delta = [b - a for a, b in zip(start, end)]
+
+        if self.motion in ("2", "3"):
+            if "I" not in values and "J" not in values:
+                return None
+
+            cx, cy = start[0] + values.get("I", 0), start[1] + values.get("J", 0)
+            radius = math.hypot(start[0] - cx, start[1] - cy)
+            if abs(radius - math.hypot(end[0] - cx, end[1] - cy)) > max(0.005, 0.001 * radius):
+                return None
+
+            a = math.atan2(start[1] - cy, start[0] - cx)
+            b = math.atan2(end[1] - cy, end[0] - cx)
+            sweep = (a - b) if self.motion == "2" else (b - a)
+            sweep %= 2 * math.pi
+            if sweep == 0:
+                sweep = 2 * math.pi
+
+            # Arcs move both plane axes, helical motion on the rest
+            plane = radius * sweep
+            distance = math.sqrt(plane ** 2 + sum(d ** 2 for d in delta[2:]))
+            components = [plane, plane] + [abs(d) for d in delta[2:]]
+        else:
+            distance = math.sqrt(sum(d ** 2 for d in delta))
+            components = [abs(d) for d in delta]
+
+        rapid = self.motion == "0"
+        speed = math.inf if rapid else self.feed / 60
+        acceleration = math.inf
+
+        for i, component in enumerate(components):
+            if component > 0:
+                scale = distance / component
+                speed = min(speed, self.settings[f"$11{i}"] / 60 * scale)
+                acceleration = min(acceleration, self.settings[f"$12{i}"] * scale)
+
+        return dict(dwell=None, start=list(start), end=list(end), distance=distance,
+                    speed=speed, acceleration=acceleration, rapid=rapid)
+
+    def plan(self, block):
+        # Check mode parses blocks without moving
+        if not self.check:
+            self.planner.append(block)
+
+
+if __name__ == "__main__":
+    time_scale = float(sys.argv[1]) if len(sys.argv) > 1 else 1
+
+    sim = simulator(time_scale=time_scale)
+    sim.start()
+
+    print(f"Simulating grbl on {sim.port}, motion {time_scale:g}x real time. Ctrl-C to stop.")
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print(f"Stopped: {sim.stats}")
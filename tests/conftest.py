@@ -0,0 +1,63 @@
+"""
+Copyright (c) 2020
+This file is part of the rotaprint project.
+
+Shared fixtures for the rotaprint tests, run from the repository root with `python -m pytest`.
+
+Unauthorized copying of this file, via any medium is strictly prohibited
+Proprietary and confidential
+"""
+
+import os
+import sys
+import logging
+import pytest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+import rotaprint
+import simulator
+
+# Kept after each test, as serial reader threads may log once their port closes
+rotaprint.log = logging.getLogger("rotaprint")
+
+
+@pytest.fixture
+def machine(tmp_path, monkeypatch):
+    # Simulated printer, with the module globals the rotaprint setup sequence creates.
+    # The database and compiled jobs are kept in a temporary directory
+    sim = simulator.simulator(time_scale=50)
+    sim.start()
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(rotaprint, "r", rotaprint.rotaprint(), raising=False)
+    monkeypatch.setattr(rotaprint, "db", rotaprint.database(), raising=False)
+    monkeypatch.setattr(rotaprint, "gc", rotaprint.gcode(), raising=False)
+
+    rotaprint.db.connect()
+    rotaprint.db.set_settings([(sim.port, "port")])
+
+    yield sim
+
+    sim.stop()
+
+
+@pytest.fixture
+def commands(machine, monkeypatch):
+    # Every line the simulated printer parses, in order
+    lines = []
+    system, gcode = machine.system, machine.gcode
+
+    def record_system(line):
+        lines.append(line)
+        return system(line)
+
+    def record_gcode(line):
+        lines.append(line)
+        return gcode(line)
+
+    monkeypatch.setattr(machine, "system", record_system)
+    monkeypatch.setattr(machine, "gcode", record_gcode)
+
+    return lines
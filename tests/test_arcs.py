@@ -0,0 +1,62 @@
+"""
+Copyright (c) 2020
+This file is part of the rotaprint project.
+
+Tests for fitting G2/G3 arcs to runs of moves on a circle.
+
+Unauthorized copying of this file, via any medium is strictly prohibited
+Proprietary and confidential
+"""
+
+import numpy as np
+import rotaprint
+
+from test_simplify import distance
+
+
+def path(program, steps=2000):
+    # Points along the drawn path, with arcs sampled finely
+    x, y = program.position(program.x), program.position(program.y)
+    g2, g3 = program.code("G2"), program.code("G3")
+    points = [(x[0], y[0])]
+
+    for idx in range(1, len(program)):
+        if program.opcode[idx] in (g2, g3) and program.opcode[idx] >= 0:
+            start = np.array([x[idx - 1], y[idx - 1]])
+            centre = start + [program.i[idx], program.j[idx]]
+            a0 = np.arctan2(*(start - centre)[::-1])
+            a1 = np.arctan2(y[idx] - centre[1], x[idx] - centre[0])
+
+            sweep = (a1 - a0) % (2 * np.pi)
+            if program.opcode[idx] == g2:
+                sweep -= 2 * np.pi
+
+            angles = a0 + np.linspace(0, sweep, steps)
+            radius = np.hypot(*(start - centre))
+            points.extend(zip(centre[0] + radius * np.cos(angles),
+                              centre[1] + radius * np.sin(angles)))
+        else:
+            points.append((x[idx], y[idx]))
+
+    return np.array(points)
+
+
+def test_drawn_path_stays_within_tolerance():
+    # Half a circle clockwise, then half a circle anticlockwise, then a straight line
+    angles = np.linspace(np.pi, 0, 60)
+    lines = ["G0 X10 Y20", "G1 Z1"]
+    lines += [f"G1 X{20 + 10 * np.cos(a):.4f} Y{20 + 10 * np.sin(a):.4f}" for a in angles[1:]]
+    lines += [f"G1 X{40 + 10 * np.cos(a):.4f} Y{20 - 10 * np.sin(a):.4f}" for a in angles[1:]]
+    lines += ["G1 X50 Y30", "G1 Z0"]
+    program = rotaprint.toolpath.parse(lines)
+    assert not program.raw
+
+    tolerance = 0.002 + 0.0001 / 2
+    fitted = program.fit_arcs(tolerance, 1, 1000)
+
+    assert len(fitted) < 10
+    assert {"G2", "G3"} <= {fitted.opcodes[op] for op in fitted.opcode}
+
+    # Every original point is still drawn, within tolerance
+    original = np.column_stack((program.position(program.x), program.position(program.y)))
+    assert distance(original, path(fitted)).max() <= tolerance + 1e-6
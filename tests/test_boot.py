@@ -0,0 +1,39 @@
+"""
+Copyright (c) 2020
+This file is part of the rotaprint project.
+
+Tests for the startup sequence, which starts subsystems in parallel.
+
+Unauthorized copying of this file, via any medium is strictly prohibited
+Proprietary and confidential
+"""
+
+import rotaprint
+
+
+def test_every_step_starts(machine, monkeypatch):
+    # The database is shared by every step, so boot a few times to catch any overlap
+    for _ in range(20):
+        monkeypatch.setattr(rotaprint, "r", rotaprint.rotaprint())
+        monkeypatch.setattr(rotaprint, "db", rotaprint.database())
+
+        r = rotaprint.r
+        r.g, r.v = rotaprint.grbl(r), rotaprint.vision(r)
+        printers = rotaprint.fleet(r)
+        logs = rotaprint.logstore()
+
+        # As the setup sequence, without the websocket servers
+        r.boot({
+            "database": (rotaprint.db.connect, []),
+            "logs": (logs.connect, ["database"]),
+            "settings": (rotaprint.db.get_settings, ["database"]),
+            "printers": (printers.connect, ["database"]),
+        })
+
+        # The simulated printer has no camera
+        vision = r.subsystems.pop("vision", None)
+        assert set(r.subsystems.values()) == {"ready"}, r.subsystems
+        assert vision == "failed"
+
+        r.g.connected = False
+        r.g.s.close()
@@ -0,0 +1,57 @@
+"""
+Copyright (c) 2020
+This file is part of the rotaprint project.
+
+Tests for connecting to grbl and keeping its settings up to date.
+
+Unauthorized copying of this file, via any medium is strictly prohibited
+Proprietary and confidential
+"""
+
+import time
+import rotaprint
+
+
+def connect():
+    g = rotaprint.grbl(rotaprint.r)
+    rotaprint.r.g = g
+    assert g.connect()
+
+    return g
+
+
+def disconnect(g):
+    g.connected = False
+    g.s.close()
+
+
+def test_unchanged_firmware_is_not_read_again(machine, commands):
+    # The first connection reads every setting, then tags the firmware with their hash
+    g = connect()
+    assert "$$" in commands
+    assert machine.build_info == g.settings_digest(g.settings)
+
+    disconnect(g)
+    commands.clear()
+
+    # The tag matches the snapshot, so nothing is read or written
+    connect()
+    assert "$$" not in commands
+    assert not [line for line in commands if "=" in line]
+
+
+def test_running_controller_is_not_reset(machine, monkeypatch):
+    g = connect()
+    g.send(["G0X5"], True)
+    while machine.block is not None or machine.planner:
+        time.sleep(0.01)
+
+    disconnect(g)
+
+    resets = []
+    monkeypatch.setattr(machine, "reset", lambda: resets.append(True))
+
+    # Reconnecting to a controller which is already running keeps its state
+    connect()
+    assert not resets
+    assert machine.position[0] == 5
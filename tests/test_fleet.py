@@ -0,0 +1,59 @@
+"""
+Copyright (c) 2020
+This file is part of the rotaprint project.
+
+Tests for driving several printers from one process.
+
+Unauthorized copying of this file, via any medium is strictly prohibited
+Proprietary and confidential
+"""
+
+import collections
+import rotaprint
+
+
+def test_print_runs_on_the_printer_it_is_routed_to(machine, monkeypatch):
+    printers = rotaprint.fleet(rotaprint.r)
+    monkeypatch.setattr(rotaprint, "printers", printers, raising=False)
+
+    for _ in range(2):
+        printers.add()
+    for printer in printers:
+        printer.g = rotaprint.grbl(printer)
+        printer.g.connected = True
+
+    # The selected printer is busy, so the print goes to the next idle one
+    printers.printers[0].active = True
+
+    w = rotaprint.websocket()
+    w.jobs, w.job_count = collections.OrderedDict(), 0
+
+    request = {"command": "PRN", "payload": "", "printer": 0}
+    handle = w.start_job(request)
+
+    assert handle["printer"] == 1
+    assert request["printer"] == 1
+
+
+def test_printers_have_their_own_threads(machine):
+    printers = rotaprint.fleet(rotaprint.r)
+    for _ in range(5):
+        printers.add()
+
+    # A print holds a timer and a sender thread, which never wait on another printer
+    assert len({id(printer.pool) for printer in printers}) == len(printers)
+    assert len({id(printer.commands) for printer in printers}) == len(printers)
+
+
+def test_corrections_use_the_radius_of_the_part(machine):
+    program = rotaprint.upload()
+    program.write("G0X1Y10\nG1Z1\n")
+    rotaprint.gc.load(program)
+
+    # The first printer's part has no bearing on a part printed elsewhere
+    rotaprint.r.radius = 10
+    near = rotaprint.gc.corrected(10)[1]
+    far = rotaprint.gc.corrected(20)[1]
+
+    assert rotaprint.gc.parameters(20)["radius"] == 20
+    assert near.z[-1] - far.z[-1] == 10
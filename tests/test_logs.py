@@ -0,0 +1,33 @@
+"""
+Copyright (c) 2020
+This file is part of the rotaprint project.
+
+Tests for the log records kept for the GUI.
+
+Unauthorized copying of this file, via any medium is strictly prohibited
+Proprietary and confidential
+"""
+
+import logging
+import rotaprint
+
+
+def test_unknown_level_sends_every_record():
+    store = rotaprint.logstore()
+    store.setFormatter(logging.Formatter("%(message)s;"))
+    logger = logging.getLogger("rotaprint.test")
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(store)
+
+    try:
+        logger.info("information")
+        logger.warning("warning")
+    finally:
+        logger.removeHandler(store)
+
+    # Names are matched in any case, numbers are used as they are
+    assert store.since(0, store.parse_level("warning"))[0] == "warning;"
+    assert store.since(0, store.parse_level("30"))[0] == "warning;"
+    assert store.since(0, store.parse_level(30))[0] == "warning;"
+
+    assert store.since(0, store.parse_level("VERBOSE"))[0] == "information;warning;"
@@ -0,0 +1,38 @@
+"""
+Copyright (c) 2020
+This file is part of the rotaprint project.
+
+Tests for print progress and the time remaining.
+
+Unauthorized copying of this file, via any medium is strictly prohibited
+Proprietary and confidential
+"""
+
+import rotaprint
+
+
+def test_streamed_time_remaining_is_extrapolated(machine):
+    r = rotaprint.r
+    r.program = list(range(100))
+    r.batch, r.batch_current = 2, 0
+
+    # A quarter of the batch took 60 s, so three quarters take another 180 s
+    r.acknowledged = 50
+    assert r.time_remaining(60) == 180
+
+    r.acknowledged = 0
+    assert r.time_remaining(60) == 0
+
+
+def test_stream_length_is_the_optimised_length(machine, monkeypatch):
+    program = rotaprint.upload()
+    program.write("G0X0Y0\n" + "".join(f"G1X{x}Y0\n" for x in range(1, 11)))
+    rotaprint.gc.load(program)
+
+    monkeypatch.setitem(rotaprint.db.settings, "simplify", 1)
+    streamed = rotaprint.gc.stream(10)
+    assert len(streamed) == 11
+
+    # Collinear moves are merged, so fewer blocks are sent
+    blocks = list(streamed)
+    assert len(streamed) == len(blocks) < 11
@@ -0,0 +1,57 @@
+"""
+Copyright (c) 2020
+This file is part of the rotaprint project.
+
+Tests for reordering strokes to reduce pen-up travel and colour changes.
+
+Unauthorized copying of this file, via any medium is strictly prohibited
+Proprietary and confidential
+"""
+
+import collections
+import numpy as np
+import rotaprint
+
+
+def drawn(program):
+    # Segments drawn with the pen down, each as its colour and unordered end points
+    x, y = program.position(program.x), program.position(program.y)
+    marker = (program.colour >= 0) & (program.opcode == 0)
+    colour = program.position(np.where(marker, program.colour, np.nan))
+
+    segments = collections.Counter()
+    down = False
+    for idx in range(1, len(program)):
+        if not np.isnan(program.z[idx]):
+            down = program.z[idx] == 1
+        elif down:
+            ends = frozenset({(round(x[idx - 1], 6), round(y[idx - 1], 6)),
+                              (round(x[idx], 6), round(y[idx], 6))})
+            segments[(colour[idx], ends)] += 1
+
+    return segments
+
+
+def stroke(colour, points):
+    # Travel to the first point, then draw through the rest
+    lines = [f"<C{colour}>", f"G0X{points[0][0]}Y{points[0][1]}", "G1Z1"]
+    lines += [f"G1X{px}Y{py}" for px, py in points[1:]]
+    lines += ["G1Z0"]
+
+    return lines
+
+
+def test_same_strokes_with_less_travel():
+    # Colours alternate, and strokes are drawn far from each other
+    lines = ["G21", "G90"]
+    lines += stroke(1, [(0, 0), (10, 0)])
+    lines += stroke(2, [(50, 50), (60, 50), (60, 60)])
+    lines += stroke(1, [(20, 0), (11, 0)])
+    lines += stroke(2, [(100, 100), (61, 60)])
+    program = rotaprint.toolpath.parse(lines)
+
+    reordered, stats = program.reorder()
+
+    assert drawn(reordered) == drawn(program)
+    assert stats["travel_after"] < stats["travel_before"]
+    assert stats["colours_after"] == 2 < stats["colours_before"]
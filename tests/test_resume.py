@@ -0,0 +1,49 @@
+"""
+Copyright (c) 2020
+This file is part of the rotaprint project.
+
+Tests for resuming an interrupted print from its checkpoint.
+
+Unauthorized copying of this file, via any medium is strictly prohibited
+Proprietary and confidential
+"""
+
+import time
+import threading
+import rotaprint
+
+
+def test_resume_inside_preamble(machine, commands, monkeypatch):
+    r = rotaprint.r
+    r.radius, r.batch, r.batch_current = 10, 1, 0
+    g = rotaprint.grbl(r)
+    r.g = g
+    assert g.connect()
+
+    program = ["G21", "G90", "G0X1Y10", "G1Z2F500", "G1X2", "G1X3", "G1X4"]
+
+    # Record every checkpoint, and when the part completes
+    lines = []
+    done = threading.Event()
+    monkeypatch.setattr(r, "checkpoint_interval", 0)
+    monkeypatch.setattr(r, "checkpoint", lines.append)
+    monkeypatch.setattr(r, "batch_new_part", done.set)
+
+    # Resuming after two lines sends more preamble lines than that
+    commands.clear()
+    g.send(program, batch=True, start=2)
+    assert done.wait(10)
+
+    # The preamble ends by restoring the distance and motion modes
+    preamble = commands[:-(len(program) - 2)]
+    assert len(preamble) > 2
+    assert preamble[-1] == "G90G0"
+
+    # Checkpoints never go back before the resumed line
+    assert lines and min(lines) >= 2
+    assert lines == sorted(lines)
+    assert r.acknowledged == len(program)
+
+    while machine.block is not None or machine.planner:
+        time.sleep(0.01)
+    assert machine.position[0] == 4
@@ -0,0 +1,48 @@
+"""
+Copyright (c) 2020
+This file is part of the rotaprint project.
+
+Tests for simplifying toolpaths before they are corrected.
+
+Unauthorized copying of this file, via any medium is strictly prohibited
+Proprietary and confidential
+"""
+
+import numpy as np
+import rotaprint
+
+
+def distance(points, polyline):
+    # Distance / mm from each point to the nearest segment of a polyline
+    a, b = polyline[:-1], polyline[1:]
+    ab = b - a
+    t = np.einsum("psk,sk->ps", points[:, None] - a, ab) / np.maximum((ab ** 2).sum(1), 1e-12)
+    nearest = a + np.clip(t, 0, 1)[..., None] * ab
+
+    return np.linalg.norm(points[:, None] - nearest, axis=2).min(1)
+
+
+def test_drawn_path_stays_within_tolerance():
+    # A quarter circle sampled finely, a straight line with a repeated point, then pen up
+    angles = np.linspace(0, np.pi / 2, 200)
+    lines = ["G0 X30 Y20", "G1 Z1"]
+    lines += [f"G1 X{20 + 10 * np.cos(a):.4f} Y{20 + 10 * np.sin(a):.4f}" for a in angles[1:]]
+    lines += ["G1 X20 Y30", "G1 X15 Y30", "G1 X10 Y30", "G1 Z0"]
+    program = rotaprint.toolpath.parse(lines)
+
+    tolerance = 0.01
+    simplified, removed = program.simplify(tolerance)
+
+    assert not program.raw
+    assert len(simplified) + len(removed) == len(program)
+    assert len(simplified) < len(program) / 2
+
+    # Every original point is still drawn, within tolerance
+    path = np.column_stack((simplified.position(simplified.x), simplified.position(simplified.y)))
+    original = np.column_stack((program.position(program.x), program.position(program.y)))
+    assert distance(original, path).max() <= tolerance + 1e-9
+
+    # Pen moves and the ends of the path are kept
+    kept = simplified.serialise()
+    assert kept[:2] == ["G0 X30 Y20", "G1 Z1"]
+    assert kept[-2:] == ["G1 X10 Y30", "G1 Z0"]
@@ -0,0 +1,51 @@
+"""
+Copyright (c) 2020
+This file is part of the rotaprint project.
+
+Tests for predicting print time with the motion planner simulation.
+
+Unauthorized copying of this file, via any medium is strictly prohibited
+Proprietary and confidential
+"""
+
+import math
+import pytest
+import rotaprint
+
+
+@pytest.fixture
+def settings():
+    # X accelerates at 500 mm/s², and its max rate is above any programmed feed
+    settings = dict(rotaprint.database.settings)
+    settings.update({"$110": 10000, "$120": 500})
+
+    return settings
+
+
+def test_single_trapezoid(settings):
+    # 2.5 mm to reach 50 mm/s, 95 mm at 50 mm/s, 2.5 mm to stop
+    times = rotaprint.toolpath.parse(["G1X100F3000"]).simulate(settings)
+
+    assert times[-1] == pytest.approx(0.1 + 95 / 50 + 0.1)
+
+
+def test_single_triangle(settings):
+    # Too short to reach the feed, so it accelerates half way and decelerates back
+    times = rotaprint.toolpath.parse(["G1X1F3000"]).simulate(settings)
+
+    assert times[-1] == pytest.approx(2 * math.sqrt(1 / 500))
+
+
+def test_straight_junction_does_not_slow_down(settings):
+    # Collinear blocks are planned as one move
+    split = rotaprint.toolpath.parse(["G1X50F3000", "G1X100"]).simulate(settings)
+    whole = rotaprint.toolpath.parse(["G1X100F3000"]).simulate(settings)
+
+    assert split[-1] == pytest.approx(whole[-1])
+
+
+def test_reversal_stops(settings):
+    # Going back the way it came, the machine stops between the blocks
+    times = rotaprint.toolpath.parse(["G1X100F3000", "G1X0"]).simulate(settings)
+
+    assert times[-1] == pytest.approx(2 * (0.1 + 95 / 50 + 0.1))
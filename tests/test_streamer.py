@@ -0,0 +1,64 @@
+"""
+Copyright (c) 2020
+This file is part of the rotaprint project.
+
+Tests for streaming programs to grbl.
+
+Unauthorized copying of this file, via any medium is strictly prohibited
+Proprietary and confidential
+"""
+
+import logging
+import rotaprint
+
+
+def connect():
+    g = rotaprint.grbl(rotaprint.r)
+    rotaprint.r.g = g
+    assert g.connect()
+
+    return g
+
+
+def test_blocks_are_only_logged_with_serial_trace(machine, monkeypatch, caplog):
+    g = connect()
+    program = [f"G1X{x}F1000" for x in range(20)]
+
+    with caplog.at_level(logging.DEBUG, "rotaprint"):
+        g.send(program)
+    assert not [record for record in caplog.records if record.getMessage().startswith("GRBL <")]
+
+    monkeypatch.setitem(rotaprint.db.settings, "serial_trace", 1)
+    caplog.clear()
+
+    with caplog.at_level(logging.DEBUG, "rotaprint"):
+        g.send(program)
+    assert len([record for record in caplog.records
+                if record.getMessage().startswith("GRBL < ")]) == len(program)
+
+
+def test_rx_buffer_is_never_overfilled(machine, commands, monkeypatch):
+    g = connect()
+    monkeypatch.setitem(rotaprint.db.settings, "rx_buffer_size", 128)
+
+    # Record how full the streamer believes the RX buffer is after every block
+    filled = []
+    send = rotaprint.streamer.send
+
+    def record(self, block):
+        send(self, block)
+        filled.append((self.filled, self.rx_buffer_size))
+
+    monkeypatch.setattr(rotaprint.streamer, "send", record)
+
+    # Blocks of mixed length, so the buffer is filled unevenly
+    program = [f"G1X{x}.{'5' * (x % 5)}Y{x % 7}F2000" for x in range(60)]
+    machine.reset_stats()
+    g.send(program)
+
+    assert len(filled) == len(program)
+    assert all(size <= limit for size, limit in filled)
+    assert max(size for size, _ in filled) > 128 / 2
+    assert machine.stats["overflow"] == 0
+    assert machine.stats["errors"] == 0
+    assert [line for line in commands if line.startswith("G1")] == program
@@ -0,0 +1,41 @@
+"""
+Copyright (c) 2020
+This file is part of the rotaprint project.
+
+Tests for status and log records pushed to websocket clients.
+
+Unauthorized copying of this file, via any medium is strictly prohibited
+Proprietary and confidential
+"""
+
+import asyncio
+import logging
+import websockets
+import rotaprint
+
+
+class closed:
+    # Websocket of a client which has disconnected
+    subprotocol = None
+
+    async def send(self, message):
+        raise websockets.ConnectionClosed(None, None)
+
+
+def test_push_to_a_closed_client_ends_quietly(machine, monkeypatch):
+    store = rotaprint.logstore()
+    store.emit(logging.makeLogRecord({"msg": "record", "levelno": logging.INFO}))
+
+    monkeypatch.setattr(rotaprint, "logs", store, raising=False)
+    monkeypatch.setattr(rotaprint, "w", rotaprint.websocket(), raising=False)
+
+    loop = asyncio.new_event_loop()
+    try:
+        client = rotaprint.subscription(closed(), loop)
+        client.log_subscribed = True
+        client.wake.set()
+
+        # Returns once the send fails, rather than raising from the task
+        loop.run_until_complete(asyncio.wait_for(client.run(), 5))
+    finally:
+        loop.close()
@@ -0,0 +1,64 @@
+"""
+Copyright (c) 2020
+This file is part of the rotaprint project.
+
+Tests for unwrapping rotary moves, and re-homing Y within its travel limit.
+
+Unauthorized copying of this file, via any medium is strictly prohibited
+Proprietary and confidential
+"""
+
+import numpy as np
+import rotaprint
+
+
+def walk(lines):
+    # Follow a program as grbl would, giving the Y work coordinate and the
+    # physical Y position after every move, with G92 re-homing in place
+    program = rotaprint.toolpath.parse(lines)
+    g92 = program.code("G92")
+    work, physical = [], []
+    current = travelled = 0.0
+
+    for idx in range(len(program)):
+        if program.opcode[idx] == g92 and g92 >= 0:
+            current = program.y[idx]
+            continue
+
+        if not np.isnan(program.y[idx]):
+            travelled += program.y[idx] - current
+            current = program.y[idx]
+
+        work.append(current)
+        physical.append(travelled)
+
+    return np.array(work), np.array(physical)
+
+
+def test_rehomes_within_travel_limit():
+    # One turn is 100 mm, with 150 mm of Y travel. A long stroke wraps around
+    # the part, then travel back to the start is shorter going forwards.
+    lines = ["G21", "G90", "G0 X10 Y0", "G1 Z1"]
+    lines += [f"G1 X10 Y{y}" for y in range(40, 201, 40)]
+    lines += ["G1 Z0", "G0 X20 Y5", "G1 Z1", "G1 X20 Y60", "G1 Z0"]
+    program = rotaprint.toolpath.parse(lines)
+
+    circumference, limit = 100, 150
+    unwrapped, stats = program.unwrap(circumference, limit)
+    output = unwrapped.serialise()
+
+    assert stats["rehomed"] > 0
+    assert stats["saved"] == 200 - 10
+    assert sum(line.startswith("G92") for line in output) >= stats["rehomed"]
+
+    work, physical = walk(output)
+    _, original = walk(lines)
+
+    # Y never leaves the travel limit, and ends within the first turn
+    assert np.all((work >= 0) & (work <= limit))
+    assert 0 <= work[-1] < circumference
+
+    # Every move reaches the same angle, and strokes are drawn the same length
+    assert np.allclose((physical - original + 1e-9) % circumference, 0, atol=1e-6)
+    down = program.position(program.z)[:-1] == 1
+    assert np.allclose(np.diff(physical)[down], np.diff(original)[down])
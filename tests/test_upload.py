@@ -0,0 +1,23 @@
+"""
+Copyright (c) 2020
+This file is part of the rotaprint project.
+
+Tests for uploading GCODE in chunks into toolpath columns.
+
+Unauthorized copying of this file, via any medium is strictly prohibited
+Proprietary and confidential
+"""
+
+import rotaprint
+
+
+def test_resolution_is_the_finest_of_any_block(machine, monkeypatch):
+    # Blocks of two lines, only the last has a finer grid
+    monkeypatch.setattr(rotaprint.upload, "block_size", 2)
+
+    program = rotaprint.upload()
+    program.write("G0X1Y2\nG1X1.5Y3\nG1X2.5\nG1Y4.25\n")
+    rotaprint.gc.load(program)
+
+    assert rotaprint.gc.resolution == 0.01
+    assert len(rotaprint.gc.toolpath) == 4
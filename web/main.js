@@ -80,11 +80,14 @@ class CG {
         // Update settings values and settings page
         COM.update_settings()
 
-        // Get current machine status
-        COM.get_current_status("FORCE")
+        // Follow machine status, changes are pushed by the backend
+        COM.subscribe_status()
 
-        // Initialise log requester
-        COM.get_logs("FORCE")
+        // Follow logs, new records are pushed by the backend
+        COM.subscribe_logs()
+
+        // Show the camera while aligning
+        COM.camera_preview()
     }
 
     // Enter html for static pages
@@ -325,12 +328,18 @@ class CG {
 // No HTML modification, or variable storage in this class.
 class WS {
     static async start() {
-        // Initialise websocket
-        this.ws = new WebSocket("ws://localhost:8765");
+        // Initialise websocket, preferring binary MessagePack messages when the library is loaded
+        var protocols = ["rotaprint.json"]
+        if (typeof MessagePack != "undefined") {
+            protocols.unshift("rotaprint.msgpack")
+        }
+
+        this.ws = new WebSocket("ws://localhost:8765", protocols);
+        this.ws.binaryType = "arraybuffer"
 
         // Function called when websocket first opened
         this.ws.onopen = function (e) {
-            console.log("[open] Connection established");
+            console.log(`[open] Connection established (${WS.ws.protocol || "rotaprint.json"})`);
 
             WS.check_open_elsewhere()
 
@@ -345,22 +354,20 @@ class WS {
             // Generate page content
             CG.generate_content()
 
-            // Check connection to grbl
-            setTimeout(() => {
-                COM.check_connected()
-            }, 3000);
+            // Show startup progress, then check connection to grbl
+            COM.check_boot()
         };
 
         // Function called when message received by websocket
         this.ws.onmessage = function (event) {
-            // Separate command and payload from JSON string
-            var data = JSON.parse(event.data)
+            // Separate command and payload, binary messages are MessagePack
+            var data = WS.decode(event.data)
             var command = data["command"]
             var payload = data["payload"]
 
-            // Display message in console if not log or gcs request
-            if ((command != "LOG") && (command != "GCS")) {
-                console.log(`[message] Data received from server: ${event.data}`);
+            // Display message in console if not log, gcs or upload chunk request
+            if ((command != "LOG") && (command != "GCS") && (command != "GCC") && (command != "SUB") && (command != "CAM")) {
+                console.log(`[message] Data received from server: ${JSON.stringify(data)}`);
             }
 
             // Display error if response contains error
@@ -383,12 +390,21 @@ class WS {
                 case "GCD":
                     COM.send_gcode(payload);
                     break
+                case "GCB":
+                    COM.upload_gcode(payload);
+                    break
+                case "GCC":
+                    COM.upload_gcode(payload);
+                    break
+                case "GCE":
+                    COM.send_gcode(payload);
+                    break
                 case "FTS":
                     COM.update_settings(payload);
                     break
                 case "RQV":
                     // Separate variable and response from payload
-                    payload = JSON.parse(payload)
+                    payload = COM.parse(payload)
                     var variable = payload["command"]
                     var value = payload["payload"]
 
@@ -400,6 +416,12 @@ class WS {
                         case "websocket":
                             WS.check_open_elsewhere(value);
                             break
+                        case "boot":
+                            COM.check_boot(value);
+                            break
+                        case "printers":
+                            COM.get_printers(value);
+                            break
                     }
                     break
                 case "DBS":
@@ -408,15 +430,33 @@ class WS {
                 case "LOG":
                     COM.get_logs(payload);
                     break
+                case "LGS":
+                    COM.subscribe_logs(payload);
+                    break
                 case "PRN":
                     COM.print_now(payload);
                     break
+                case "RSM":
+                    COM.resume(payload);
+                    break
+                case "EST":
+                    COM.estimate_time(payload);
+                    break
                 case "SET":
                     COM.print_now(payload);
                     break
                 case "GCS":
                     COM.get_current_status(payload);
                     break
+                case "SUB":
+                    COM.subscribe_status(payload);
+                    break
+                case "JOB":
+                    COM.job_update(payload);
+                    break
+                case "CAM":
+                    COM.camera_preview(payload);
+                    break
                 case "HME":
                     COM.home(payload);
                     break
@@ -426,6 +466,12 @@ class WS {
                 case "FRL":
                     COM.feed_release(payload);
                     break
+                case "FOV":
+                    COM.feed_override(payload);
+                    break
+                case "ROV":
+                    COM.rapid_override(payload);
+                    break
                 case "LGT":
                     COM.toggle_lighting(payload);
                     break
@@ -465,6 +511,20 @@ class WS {
         bulmaQuickview.attach();
     }
 
+    // Whether the backend accepted MessagePack messages
+    static binary() {
+        return WS.ws.protocol == "rotaprint.msgpack"
+    }
+
+    // Read a message from the backend
+    static decode(data) {
+        if (data instanceof ArrayBuffer) {
+            return MessagePack.decode(new Uint8Array(data))
+        }
+
+        return JSON.parse(data)
+    }
+
     // Checks if another websocket connection is already open
     static check_open_elsewhere(data) {
         data = parseInt(data)
@@ -487,19 +547,49 @@ class WS {
 // Updates content dynamically based on communication.
 // Dynamic variables are stored here.
 class COM {
+    // Size of each piece of a GCODE upload, in bytes
+    static upload_chunk_size = 1048576
+
+    // Index of the printer commands act on, chosen with the printer selector
+    static printer = Number(localStorage.getItem("printer") || 0)
+
+    // ID of the last request sent, echoed in its response
+    static request_id = 0
+
+    // Long running commands / {job: handle}
+    static jobs = {}
+
     // --- General Functions ---
 
-    // Combine command and payload into JSON string
-    static payloader(command, payload) {
+    // Combine command and payload into a message. MessagePack keeps the payload's type,
+    // JSON carries objects as a JSON string
+    static payloader(command, payload = "") {
         var data = {
             "command": String(command),
-            "payload": String(payload)
+            "payload": payload,
+            "printer": COM.printer,
+            "id": ++COM.request_id
+        }
+
+        if (WS.binary()) {
+            return MessagePack.encode(data)
+        }
+
+        if (typeof payload == "object") {
+            data["payload"] = JSON.stringify(payload)
+        } else {
+            data["payload"] = String(payload)
         }
 
         data = JSON.stringify(data)
         return data
     }
 
+    // Structured payloads are objects in MessagePack messages, and JSON strings in JSON messages
+    static parse(payload) {
+        return typeof payload == "string" ? JSON.parse(payload) : payload
+    }
+
     static update_surface_speed() {
         var display = document.querySelector("#display\_surface\_speed")
         var radius = document.querySelector("#input_radius").value
@@ -561,10 +651,10 @@ class COM {
         }
 
         // Split current and default settings
-        data = data.split("~<>~")
+        data = COM.parse(data)
 
         // Get settings from response
-        this.settings_table = JSON.parse(data[0])
+        this.settings_table = data[0]
 
         if (page == "index") {
             var container
@@ -605,7 +695,7 @@ class COM {
 
         // Update default settings once only
         if (this.default_settings == null) {
-            this.default_settings = JSON.parse(data[1])
+            this.default_settings = data[1]
         }
     }
 
@@ -651,8 +741,7 @@ class COM {
 
             // Once user clicks confirm on confirmation modal
             case "CONFIRM":
-                var send_data = JSON.stringify(this.commit_settings)
-                WS.ws.send(COM.payloader("DBS", send_data))
+                WS.ws.send(COM.payloader("DBS", this.commit_settings))
                 return
 
             // Once backend responds that new settings have been received successfully
@@ -726,15 +815,49 @@ class COM {
                 animate: { in: "fadeInRight", out: "fadeOutRight" }
             });
 
+            // Predict how long the new GCODE will take to print
+            COM.estimate_time()
+
+            return
+        }
+
+        // Start a chunked upload, the file is sent in pieces once the backend is ready
+        var file = this.fileInput.files[0]
+        this.upload = {
+            "file": file,
+            "offset": 0,
+            "decoder": new TextDecoder("utf-8")
+        }
+
+        WS.ws.send(COM.payloader("GCB", { "size": file.size }))
+    }
+
+    // Send the next chunk of the GCODE file each time the backend acknowledges the last one
+    static upload_gcode(data) {
+        var upload = this.upload
+
+        // Show upload progress in place of the filename
+        if (data != "DONE") {
+            var fileName = this.fileInput.parentElement.querySelectorAll("p")[0]
+            fileName.textContent = "Uploading... ".concat(Math.round(data), "%")
+        }
+
+        // All chunks sent, ask the backend to load the program
+        if (upload.offset >= upload.file.size) {
+            WS.ws.send(COM.payloader("GCE"))
             return
         }
 
-        // Read uploaded file as UTF-8, convert to string and send as payload to backend
+        var chunk = upload.file.slice(upload.offset, upload.offset + COM.upload_chunk_size)
+        upload.offset += COM.upload_chunk_size
+
+        // Read chunk as UTF-8, streaming so characters split between chunks are kept intact
         var reader = new FileReader();
-        reader.readAsText(this.fileInput.files[0], "UTF-8");
+        reader.readAsArrayBuffer(chunk);
         reader.onload = function (evt) {
-            var gcode = evt.target.result;
-            WS.ws.send(COM.payloader("GCD", gcode))
+            var stream = upload.offset < upload.file.size
+            var gcode = upload.decoder.decode(evt.target.result, { "stream": stream });
+            WS.ws.send(COM.payloader("GCC", gcode))
         }
     }
 
@@ -743,97 +866,196 @@ class COM {
         if (data == "FORCE") {
             WS.ws.send(COM.payloader("GCS"))
         } else {
-            var current_status = JSON.parse(data)
+            COM.show_status(COM.parse(data))
+        }
+    }
 
-            // Redirect to correct page based on current status
-            if ((page != "monitor") && (current_status["grbl_operation"] != "Idle" && current_status["grbl_operation"] != "Done")) {
-                window.location.replace("monitor.html");
-                return
-            } else if ((page == "monitor") && (current_status["grbl_operation"] == "Idle" || current_status["grbl_operation"] == "Done")) {
-                window.location.replace("index.html");
-                return
-            }
+    // Track a long running command, which is answered once it has finished
+    static job_update(data) {
+        var handle = COM.parse(data)
+        COM.jobs[handle["job"]] = handle
 
-            // Exit here if not on monitor page
-            if (page != "monitor") {
-                return
-            }
+        // The print start sequence can take a while, show progress from the monitor
+        if (handle["command"] == "PRN" && handle["state"] == "running") {
+            COM.print_now("DONE")
+        }
+    }
 
-            // Update alarm field
-            var div = document.getElementById("status_alarm")
-            if ((current_status["grbl_operation"] == "Alarm") || (current_status["grbl_operation"] == "Failed QC")) {
-                div.classList.remove("is-success")
-                div.classList.add("is-danger")
-            } else {
-                div.classList.add("is-success")
-                div.classList.remove("is-danger")
-            }
+    // Subscribe to machine status. The backend pushes every field once, then only fields which change
+    static subscribe_status(data) {
+        if (data == null) {
+            COM.status = {}
+            WS.ws.send(COM.payloader("SUB"))
+            return
+        }
 
-            // If QC has failed
-            if (current_status["grbl_operation"] == "Failed QC") {
-                bulmaToast.toast({
-                    message: "Quality check failed! <a href='COM.qc_override()'>Manual Override?</a>",
-                    type: "is-danger",
-                    position: "bottom-right",
-                    dismissible: true,
-                    closeOnClick: false,
-                    duration: 99999999,
-                    animate: { in: "fadeInRight", out: "fadeOutRight" }
-                });
-            }
+        // Subscription accepted
+        if (data == "DONE") {
+            return
+        }
 
-            // Enable 'Complete' button of run is finished
-            if (current_status["grbl_operation"] == "Done") {
-                document.getElementById("button_complete").disabled = false
-            }
+        Object.assign(COM.status, COM.parse(data))
+        COM.show_status(COM.status)
+    }
 
-            // Update status indicator colour based on current operation
-            if (current_status["grbl_operation"].includes("Hold")) {
-                document.getElementById("status_grbl").classList.remove("is-success")
-                document.getElementById("status_grbl").classList.add("is-warning")
-            } else if (current_status["grbl_operation"] == "Run" || current_status["grbl_operation"] == "Done") {
-                document.getElementById("status_grbl").classList.add("is-success")
-                document.getElementById("status_grbl").classList.remove("is-warning")
-            } else {
-                document.getElementById("status_grbl").classList.remove("is-success")
-                document.getElementById("status_grbl").classList.remove("is-warning")
-            }
+    // Live frames from the selected printer's camera, pushed by the backend at a capped rate
+    static camera_preview(data) {
+        var preview = document.getElementById("camera_preview")
+        if (preview == null) {
+            return
+        }
 
-            var id
-            var key
+        if (data == null) {
+            WS.ws.send(COM.payloader("CAM"))
+            return
+        }
+
+        // Subscription accepted
+        if (data == "DONE") {
+            return
+        }
+
+        // Printer has no camera
+        if (data == "NONE") {
+            preview.classList.add("is-hidden")
+            return
+        }
+
+        // JPEG as bytes in MessagePack messages, and as base64 in JSON messages
+        var image = document.getElementById("camera_preview_image")
+        var previous = image.src
+
+        if (typeof data == "string") {
+            image.src = "data:image/jpeg;base64,".concat(data)
+        } else {
+            image.src = URL.createObjectURL(new Blob([data], { "type": "image/jpeg" }))
+        }
+
+        if (previous.startsWith("blob:")) {
+            URL.revokeObjectURL(previous)
+        }
+
+        preview.classList.remove("is-hidden")
+    }
+
+    // Update the page from the current machine status
+    static show_status(current_status) {
+        // Redirect to correct page based on current status
+        if ((page != "monitor") && (current_status["grbl_operation"] != "Idle" && current_status["grbl_operation"] != "Done")) {
+            window.location.replace("monitor.html");
+            return
+        } else if ((page == "monitor") && (current_status["grbl_operation"] == "Idle" || current_status["grbl_operation"] == "Done")) {
+            window.location.replace("index.html");
+            return
+        }
+
+        // Exit here if not on monitor page
+        if (page != "monitor") {
+            return
+        }
+
+        // Update alarm field
+        var div = document.getElementById("status_alarm")
+        if ((current_status["grbl_operation"] == "Alarm") || (current_status["grbl_operation"] == "Failed QC")) {
+            div.classList.remove("is-success")
+            div.classList.add("is-danger")
+        } else {
+            div.classList.add("is-success")
+            div.classList.remove("is-danger")
+        }
+
+        // If QC has failed
+        if (current_status["grbl_operation"] == "Failed QC") {
+            bulmaToast.toast({
+                message: "Quality check failed! <a href='COM.qc_override()'>Manual Override?</a>",
+                type: "is-danger",
+                position: "bottom-right",
+                dismissible: true,
+                closeOnClick: false,
+                duration: 99999999,
+                animate: { in: "fadeInRight", out: "fadeOutRight" }
+            });
+        }
+
+        // Enable 'Complete' button of run is finished
+        if (current_status["grbl_operation"] == "Done") {
+            document.getElementById("button_complete").disabled = false
+        }
+
+        // Update status indicator colour based on current operation
+        if (current_status["grbl_operation"].includes("Hold")) {
+            document.getElementById("status_grbl").classList.remove("is-success")
+            document.getElementById("status_grbl").classList.add("is-warning")
+        } else if (current_status["grbl_operation"] == "Run" || current_status["grbl_operation"] == "Done") {
+            document.getElementById("status_grbl").classList.add("is-success")
+            document.getElementById("status_grbl").classList.remove("is-warning")
+        } else {
+            document.getElementById("status_grbl").classList.remove("is-success")
+            document.getElementById("status_grbl").classList.remove("is-warning")
+        }
+
+        var id
+        var key
 
-            var container = document.getElementById("monitor_column")
-            for (key of Object.keys(current_status)) {
-                // Update all matching display elements
-                id = container.querySelector("#display_"
+        var container = document.getElementById("monitor_column")
+        for (key of Object.keys(current_status)) {
+            // Update all matching display elements
+            id = container.querySelector("#display_"
+                .concat(key)
+                .replace(/_/g, "\\_")
+            )
+
+            if (id != null) {
+                if (id.innerHTML != current_status[key]) {
+                    id.innerHTML = current_status[key]
+                }
+                continue
+            }
+
+            // Update all matching value elements
+            if (id == null) {
+                id = container.querySelector("#value_"
                     .concat(key)
                     .replace(/_/g, "\\_")
                 )
+            }
 
-                if (id != null) {
-                    if (id.innerHTML != current_status[key]) {
-                        id.innerHTML = current_status[key]
-                    }
-                    continue
-                }
+            if ((id != null) && (id.value != current_status[key])) {
+                id.value = current_status[key]
+            }
+        }
+    }
 
-                // Update all matching value elements
-                if (id == null) {
-                    id = container.querySelector("#value_"
-                        .concat(key)
-                        .replace(/_/g, "\\_")
-                    )
-                }
+    // Request a print time prediction for the uploaded GCODE with the current print settings
+    static estimate_time(data) {
+        if (data == null) {
+            var div = document.querySelector("#primary\_settings\_column")
 
-                if ((id != null) && (id.value != current_status[key])) {
-                    id.value = current_status[key]
-                }
+            data = {
+                "radius": div.querySelector("#input_radius").value,
+                "batch": div.querySelector("#input_batch").value
             }
 
-            setTimeout(function () {
-                COM.get_current_status("FORCE")
-            }, COM.settings_table["polling_interval"]);
+            WS.ws.send(COM.payloader("EST", data))
+            return
+        }
+
+        var estimate = COM.parse(data)
+
+        // Format seconds as minutes and seconds
+        var format = function (seconds) {
+            return String(Math.floor(seconds / 60)).concat("m ", Math.floor(seconds % 60), "s")
         }
+
+        bulmaToast.toast({
+            message: "Predicted print time: ".concat(format(estimate["part"]), " per part, ", format(estimate["batch"]), " for the batch"),
+            type: "is-info",
+            position: "bottom-right",
+            dismissible: true,
+            closeOnClick: false,
+            duration: 8000,
+            animate: { in: "fadeInRight", out: "fadeOutRight" }
+        });
     }
 
     // Get current settings and send the backend, then request print to begin
@@ -857,16 +1079,14 @@ class COM {
         var position_fine = document.getElementById("input_position_fine").value
         var offset = Number(position_coarse) + Number(position_fine)
 
-        data = JSON.stringify(
-            {
-                "check_mode": check_mode,
-                "scan_mode": scan_mode,
-                "radius": radius,
-                "length": length,
-                "batch": batch,
-                "offset": offset
-            }
-        )
+        data = {
+            "check_mode": check_mode,
+            "scan_mode": scan_mode,
+            "radius": radius,
+            "length": length,
+            "batch": batch,
+            "offset": offset
+        }
 
         // Send current print settings
         WS.ws.send(COM.payloader("SET", data))
@@ -875,6 +1095,30 @@ class COM {
         WS.ws.send(COM.payloader("PRN"))
     }
 
+    // Resume an interrupted print from its last checkpoint
+    static resume(data) {
+        // Send command
+        if (data == null) {
+            WS.ws.send(COM.payloader("RSM"))
+            return
+        }
+
+        if (data == "DONE") {
+            WS.ws.close()
+            window.location.replace("monitor.html");
+        } else {
+            bulmaToast.toast({
+                message: "No interrupted print to resume.",
+                type: "is-warning",
+                position: "bottom-right",
+                dismissible: true,
+                closeOnClick: false,
+                duration: 4000,
+                animate: { in: "fadeInRight", out: "fadeOutRight" }
+            });
+        }
+    }
+
     // Toggle lights
     static toggle_lighting(data) {
         // Send command
@@ -932,6 +1176,99 @@ class COM {
         WS.ws.send(COM.payloader("RQV", "grbl"))
     }
 
+    // Show startup state of each backend subsystem, until all have started
+    static check_boot(data) {
+        if (data == null) {
+            WS.ws.send(COM.payloader("RQV", "boot"))
+            return
+        }
+
+        var subsystems = COM.parse(data)
+        var colours = {
+            "waiting": "is-light",
+            "starting": "is-warning",
+            "ready": "is-success",
+            "failed": "is-danger",
+        }
+
+        var div = document.getElementById("boot_status")
+        var starting = false
+
+        if (div != null) {
+            div.innerHTML = ""
+        }
+
+        for (var name of Object.keys(subsystems)) {
+            var state = subsystems[name]
+            starting = starting || state == "waiting" || state == "starting"
+
+            // Only show subsystems which are not ready yet, or have failed
+            if (div != null && state != "ready") {
+                var tag = document.createElement("span")
+                tag.className = "tag " + colours[state]
+                tag.title = state
+                tag.innerHTML = name
+                div.appendChild(tag)
+            }
+        }
+
+        if (starting) {
+            setTimeout(() => {
+                this.check_boot();
+            }, 500);
+        } else {
+            this.get_printers();
+            this.check_connected();
+        }
+    }
+
+    // Fill the printer selector, which is only shown when there is more than one printer
+    static get_printers(data) {
+        if (data == null) {
+            WS.ws.send(COM.payloader("RQV", "printers"))
+            return
+        }
+
+        var printers = COM.parse(data)
+        var select = document.getElementById("select_printer")
+
+        if (select == null) {
+            return
+        }
+
+        select.innerHTML = ""
+
+        printers.forEach((printer, index) => {
+            var option = document.createElement("option")
+            option.value = index
+            option.innerHTML = printer["name"]
+
+            if (!printer["connected"]) {
+                option.innerHTML += " (not connected)"
+            } else if (printer["busy"]) {
+                option.innerHTML += " (" + printer["operation"] + ")"
+            }
+
+            select.appendChild(option)
+        })
+
+        select.value = COM.printer < printers.length ? COM.printer : 0
+        document.getElementById("printer_selector").classList.toggle("is-hidden", printers.length < 2)
+    }
+
+    // Send following commands to the printer chosen in the printer selector
+    static select_printer() {
+        COM.printer = Number(document.getElementById("select_printer").value)
+        localStorage.setItem("printer", COM.printer)
+
+        console.log(`Selected printer ${COM.printer + 1}`)
+
+        this.get_printers()
+        this.check_connected()
+        this.subscribe_status()
+        this.camera_preview()
+    }
+
     // Request that backend reconnects to printer
     static reconnect_printer() {
         // Send request
@@ -1001,9 +1338,29 @@ class COM {
 
             this.logs_array = this.logs_array.concat(data)
 
-            setTimeout(function () {
-                COM.get_logs("FORCE")
-            }, COM.settings_table["polling_interval"]);
+            // Keep at most the log history, the displayed table is trimmed separately
+            var excess = this.logs_array.length - COM.settings_table["log_history"]
+            if (excess > 0) {
+                this.logs_array = this.logs_array.slice(excess)
+                this.log_length = Math.max(this.log_length - excess, 0)
+            }
+        }
+    }
+
+    // Subscribe to log records of at least the level selected, records the backend still has are sent again
+    static subscribe_logs(data) {
+        if (data == null) {
+            var select = document.getElementById("logs_level")
+            var level = select == null ? "DEBUG" : select.value
+
+            // Show the records again with the new level
+            if (this.logs_array != null) {
+                this.logs_array = []
+                this.log_length = 0
+                document.getElementById("logs_div").innerHTML = ""
+            }
+
+            WS.ws.send(COM.payloader("LGS", level))
         }
     }
 
@@ -1212,6 +1569,52 @@ class COM {
         }
     }
 
+    // Change feed rate override during run operation
+    static feed_override(data) {
+        if (data == "DONE") {
+            return
+        }
+
+        if (data == "ERROR") {
+            bulmaToast.toast({
+                message: "Feed override could not be changed",
+                type: "is-danger",
+                position: "bottom-right",
+                dismissible: true,
+                closeOnClick: false,
+                duration: 4000,
+                animate: { in: "fadeInRight", out: "fadeOutRight" }
+            });
+            return
+        }
+
+        // Send command, data is "+10", "-10", "+1", "-1" or "100"
+        WS.ws.send(COM.payloader("FOV", data))
+    }
+
+    // Change rapid rate override during run operation
+    static rapid_override(data) {
+        if (data == "DONE") {
+            return
+        }
+
+        if (data == "ERROR") {
+            bulmaToast.toast({
+                message: "Rapid override could not be changed",
+                type: "is-danger",
+                position: "bottom-right",
+                dismissible: true,
+                closeOnClick: false,
+                duration: 4000,
+                animate: { in: "fadeInRight", out: "fadeOutRight" }
+            });
+            return
+        }
+
+        // Send command, data is "100", "50" or "25"
+        WS.ws.send(COM.payloader("ROV", data))
+    }
+
     // Override QC error
     static qc_override(data) {
         // Send command